@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# Which calibration tables go on which field, applied in one applycal pass
+# A plan is {field: [(caltable, gainfield), ...]}, built once for every field that gets calibrated:
+# the bandpass always comes from the primary and the flux scaled gains from the primary for the
+# primary itself and from the secondary for everything else. The plan is checked (each field once,
+# every table there, a gainfield for every table) and written out as a casa cal library, so a single
+# applycal with docallib=True writes CORRECTED_DATA of each field exactly once.
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+APPLY_TABLES = ["B1", "F0"]
+
+
+def apply_plan(calfile, pri, sec, fields):
+    plan = {}
+    for field in fields:
+        if field in plan:
+            continue
+        plan[field] = [(f"{calfile}.B1", pri), (f"{calfile}.F0", pri if field == pri else sec)]
+    return plan
+
+
+def check_plan(plan):
+    errors = []
+    if len(plan) == 0:
+        errors.append("no fields to calibrate")
+    for field, tables in plan.items():
+        names = [table for table, gainfield in tables]
+        if len(set(names)) != len(names):
+            errors.append(f"{field} has a table more than once")
+        for table, gainfield in tables:
+            if gainfield in [None, ""]:
+                errors.append(f"{field} has no gainfield for {table}")
+            if not os.path.exists(table):
+                errors.append(f"{table} for {field} doesn't exist")
+    if len(errors) > 0:
+        raise ValueError(f"Bad apply plan: {'; '.join(errors)}")
+    return
+
+
+def callib_lines(plan):
+    # One line per field and table, fldmap picks the solutions of the gainfield
+    lines = []
+    for field, tables in plan.items():
+        for table, gainfield in tables:
+            lines.append(f"field='{field}' caltable='{table}' fldmap='{gainfield}' tinterp='linear' calwt=True")
+    return lines
+
+
+def callib_name(vis):
+    return f"{vis.rstrip('/')}.callib"
+
+
+def run_apply(vis, plan, callib, parang=True):
+    from casatasks import applycal
+
+    check_plan(plan)
+    with open(callib, "w") as f:
+        f.write("\n".join(callib_lines(plan)) + "\n")
+    applycal(
+        vis=vis,
+        field=",".join(plan),
+        docallib=True,
+        callib=callib,
+        parang=parang,
+        flagbackup=False,
+    )
+    logger.info(f"Applied {callib} to {', '.join(plan)} of {vis}")
+    return
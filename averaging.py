@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# Time and channel averaging chosen from a smearing budget
+# The longest baseline (from the antenna positions), the channel widths and frequencies (from the
+# ms index) and the radius of the field that has to survive (by default half the primary beam FWHM
+# at the lowest frequency of the band) set how much bandwidth and time smearing averaging would
+# cause at the edge of the field. The largest channel bin (a divisor of nchan) and time bin (a
+# multiple of the integration time) that keep the peak loss of a point source there under max_loss
+# are used to make a compact per target ms.
+# Smearing follows Bridle & Schwab (1999) for a square bandpass and a Gaussian taper.
+
+import os
+import json
+import math
+import logging
+import numpy as np
+
+from msindex import load_index
+
+logger = logging.getLogger(__name__)
+
+SPEED_OF_LIGHT = 299792458.0
+DISH_DIAMETER = 22.0
+# ATCA correlator cycle, used when the index doesn't have the integration time
+DEFAULT_INTEGRATION = 10.0
+
+
+def longest_baseline(vis, exclude=()):
+    # Longest baseline in metres between the antennas that aren't excluded (by index)
+    from casatools import table
+
+    tb = table()
+    tb.open(f"{vis.rstrip('/')}/ANTENNA")
+    positions = np.asarray(tb.getcol("POSITION"), dtype=float).T
+    tb.close()
+    keep = [i for i in range(len(positions)) if i not in exclude]
+    positions = positions[keep]
+    if len(positions) < 2:
+        return 0.0
+    diff = positions[:, None, :] - positions[None, :, :]
+    return float(np.sqrt((diff**2).sum(axis=-1)).max())
+
+
+def primary_beam_fwhm(freq):
+    return 1.02 * SPEED_OF_LIGHT / freq / DISH_DIAMETER
+
+
+def bandwidth_loss(chan_width, radius, bmax):
+    # beta * theta / theta_b, with the synthesised beam lambda/bmax the frequency drops out
+    x = chan_width * radius * bmax / SPEED_OF_LIGHT
+    if x == 0:
+        return 0.0
+    return 1.0 - 1.0645 * math.erf(0.8326 * x) / x
+
+
+def time_loss(timebin, radius, freq, bmax):
+    ratio = radius * freq * bmax / SPEED_OF_LIGHT
+    return 1.22e-9 * ratio**2 * timebin**2
+
+
+def choose_averaging(vis, max_loss=0.02, fov=None, exclude=()):
+    # fov is the radius in arcmin that has to stay within the budget, max_loss the fractional peak
+    # loss allowed from each of bandwidth and time smearing
+    index = load_index(vis)
+    bmax = longest_baseline(vis, exclude=exclude)
+    freq_min = min(spw["freq_min"] for spw in index["spws"])
+    freq_max = max(spw["freq_max"] for spw in index["spws"])
+    if fov is None:
+        radius = primary_beam_fwhm(freq_min) / 2
+    else:
+        radius = math.radians(fov / 60.0)
+
+    chanbin = []
+    bw_loss = []
+    for spw in index["spws"]:
+        divisors = [n for n in range(1, spw["nchan"] + 1) if spw["nchan"] % n == 0]
+        allowed = [n for n in divisors if bandwidth_loss(n * spw["chan_width"], radius, bmax) <= max_loss]
+        n = max(allowed) if len(allowed) > 0 else 1
+        chanbin.append(n)
+        bw_loss.append(bandwidth_loss(n * spw["chan_width"], radius, bmax))
+
+    integrations = [s.get("integration", 0.0) for s in index["scans"]]
+    integration = min([t for t in integrations if t > 0], default=DEFAULT_INTEGRATION)
+    # Never average over more than the shortest scan
+    shortest = min([(s["end"] - s["begin"]) * 86400.0 for s in index["scans"]], default=integration)
+    nbin = 1
+    while (nbin + 1) * integration <= shortest and time_loss((nbin + 1) * integration, radius, freq_max, bmax) <= max_loss:
+        nbin += 1
+    timebin = nbin * integration
+
+    fraction = float(np.mean([1.0 / n for n in chanbin])) / nbin
+    return {
+        "max_loss": max_loss,
+        "fov_radius_arcmin": math.degrees(radius) * 60.0,
+        "longest_baseline_m": bmax,
+        "chanbin": chanbin,
+        "bandwidth_loss": bw_loss,
+        "integration": integration,
+        "timebin": timebin,
+        "time_loss": time_loss(timebin, radius, freq_max, bmax),
+        "volume_fraction": fraction,
+    }
+
+
+def averaging_name(msname):
+    return f"{msname.rstrip('/')}.averaging.json"
+
+
+def save_averaging(msname, averaging):
+    with open(averaging_name(msname), "w") as f:
+        json.dump(averaging, f, indent=2)
+
+
+def load_averaging(msname):
+    filename = averaging_name(msname)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        return json.load(f)
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+# Batch runner for processing.py: takes a manifest of (day, target, secondary, band) jobs and runs
+# them concurrently, each in its own worker process since casa task state is global.
+# Jobs that share a day and band share the same visname, so they are run one after another inside a
+# single worker and only different days/bands run at the same time.
+
+import os
+import csv
+import json
+import time
+import resource
+import queue
+import logging
+import traceback
+import multiprocessing
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def read_manifest(manifest, project="c3487", pri="1934_cal", ref="CA04", path="./data/{day}"):
+    # CSV with a header of at least day,target,sec,band. project, pri, ref and path (the directory
+    # holding the day's rpfits files, {day} is filled in) columns are optional
+    jobs = []
+    with open(manifest, "r") as f:
+        rows = [l for l in f if l.strip() != "" and not l.lstrip().startswith("#")]
+    for row in csv.DictReader(rows):
+        row = {k.strip(): v.strip() for k, v in row.items() if k is not None and v is not None}
+        for key in ["day", "target", "sec", "band"]:
+            if row.get(key, "") == "":
+                raise ValueError(f"Manifest row {row} is missing {key}")
+        row.setdefault("project", project)
+        row.setdefault("pri", pri)
+        row.setdefault("ref", ref)
+        row["path"] = row.get("path", "") or path
+        row["path"] = row["path"].format(day=row["day"])
+        jobs.append(row)
+    return jobs
+
+
+def group_jobs(jobs):
+    # Jobs on the same ms can't run at the same time, keep the manifest order inside each group
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job["project"], job["day"], job["band"]), []).append(job)
+    return list(groups.values())
+
+
+def set_memory_limit(mem_limit):
+    # RLIMIT_AS is per process and inherited, every worker a group spawns gets the whole limit.
+    # run_job hands the same limit to run_pipeline as mem_budget so the concurrent cx images split
+    # it between them, the cal_nproc calibration workers don't and can use up to cal_nproc times it
+    if mem_limit is None:
+        return
+    nbytes = int(mem_limit * 1024**3)
+    resource.setrlimit(resource.RLIMIT_AS, (nbytes, nbytes))
+
+
+def run_job(job, cont=True, plots=False, flag6=True, mem_limit=None, bandpass="solve", bandpass_maxage=30.0, cal_nproc=1):
+    # casa gets imported here so the parent process never loads it
+    import processing
+    from stagecache import StageCache
+    from callibrary import CalLibrary
+
+    tar, sec, band = job["target"], job["sec"], job["band"]
+    pri = f"{job['pri']}_{band}"
+    visname, calfile, imagename = processing.day_names(job["day"], job["project"], tar, sec, band)
+    files = processing.find_rpfits(job["project"], path=job["path"])
+    if len(files) == 0:
+        raise FileNotFoundError(f"No .{job['project']} files in {job['path']}")
+    cache = StageCache(f"./data/{job['day']}/stagecache_{band}.json")
+    library = CalLibrary("./data/callibrary", mode=bandpass, maxage=bandpass_maxage)
+    processing.run_pipeline(
+        cache,
+        files,
+        visname,
+        calfile,
+        imagename,
+        sec,
+        tar,
+        pri,
+        band,
+        ref=job["ref"],
+        flag6=flag6,
+        force=not cont,
+        library=library,
+        project=job["project"],
+        day=job["day"],
+        mem_budget=mem_limit,
+        cal_nproc=cal_nproc,
+        plots=plots,
+    )
+    # The casa wrappers log and carry on when a task fails, so check the last stage actually finished
+    if cache.fingerprint(f"image_{tar}") is None:
+        return "incomplete"
+    return "ok"
+
+
+def run_group(group, cont=True, plots=False, flag6=True, mem_limit=None, bandpass="solve", bandpass_maxage=30.0, cal_nproc=1):
+    set_memory_limit(mem_limit)
+    results = []
+    for job in group:
+        start = time.time()
+        try:
+            status = run_job(
+                job,
+                cont=cont,
+                plots=plots,
+                flag6=flag6,
+                mem_limit=mem_limit,
+                bandpass=bandpass,
+                bandpass_maxage=bandpass_maxage,
+                cal_nproc=cal_nproc,
+            )
+            error = ""
+        except MemoryError as e:
+            # Either a real one or imgmfs_ms refusing an image that wouldn't fit
+            status = "failed"
+            error = f"Ran out of memory (limit {mem_limit} GB) {e}"
+        except Exception:
+            status = "failed"
+            error = traceback.format_exc()
+        results.append(
+            {
+                "job": job,
+                "status": status,
+                "error": error,
+                "duration": time.time() - start,
+                "pid": os.getpid(),
+            }
+        )
+    return results
+
+
+def group_worker(i, group, options, results):
+    from processing import log_setup
+
+    log_setup()
+    results.put((i, run_group(group, **options)))
+
+
+def run_batch(jobs, nproc=4, mem_limit=None, cont=True, plots=False, flag6=True, bandpass="solve", bandpass_maxage=30.0, cal_nproc=1):
+    groups = group_jobs(jobs)
+    logger.info(f"Running {len(jobs)} jobs in {len(groups)} groups on {nproc} workers")
+    # spawn a fresh interpreter with its own casa for every group so nothing leaks from one day into
+    # the next. These are plain (non daemonic) processes rather than a Pool so a group can start its
+    # own workers, e.g. to image both cx spws at once
+    ctx = multiprocessing.get_context("spawn")
+    options = {
+        "cont": cont,
+        "plots": plots,
+        "flag6": flag6,
+        "mem_limit": mem_limit,
+        "bandpass": bandpass,
+        "bandpass_maxage": bandpass_maxage,
+        "cal_nproc": cal_nproc,
+    }
+    results = ctx.Queue()
+    done = {}
+    todo = list(enumerate(groups))
+    running = {}
+    while len(todo) > 0 or len(running) > 0:
+        while len(todo) > 0 and len(running) < nproc:
+            i, group = todo.pop(0)
+            proc = ctx.Process(target=group_worker, args=(i, group, options, results))
+            proc.start()
+            running[i] = proc
+        try:
+            i, res = results.get(timeout=1.0)
+            done[i] = res
+        except queue.Empty:
+            pass
+        for i, proc in list(running.items()):
+            if i in done:
+                proc.join()
+                del running[i]
+            elif not proc.is_alive():
+                # Its result may still be on the way, otherwise the worker itself died (e.g. killed
+                # by the OS) and the whole group is marked as failed
+                try:
+                    j, res = results.get(timeout=5.0)
+                    done[j] = res
+                    continue
+                except queue.Empty:
+                    pass
+                del running[i]
+                done[i] = [
+                    {"job": job, "status": "failed", "error": f"Worker exited with code {proc.exitcode}", "duration": 0.0, "pid": proc.pid}
+                    for job in groups[i]
+                ]
+    summary = []
+    for i in range(len(groups)):
+        summary.extend(done[i])
+    return summary
+
+
+def print_summary(summary):
+    for res in summary:
+        job = res["job"]
+        logger.info(
+            f"{job['day']:>8} {job['target']:>12} {job['sec']:>12} {job['band']:>3} "
+            f"{res['status']:>10} {res['duration']:8.1f}s"
+        )
+        if res["status"] == "failed":
+            logger.warning(f"{job['day']} {job['target']} failed: {res['error']}")
+    nfail = len([r for r in summary if r["status"] != "ok"])
+    logger.info(f"{len(summary) - nfail}/{len(summary)} jobs completed")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(
+        description="Run processing.py over a manifest of days, targets and bands in parallel"
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="CSV file with columns day,target,sec,band and optionally project,pri,ref,path"
+    )
+    parser.add_argument(
+        "--nproc",
+        type=int,
+        default=4,
+        help="Number of worker processes to run at once, default=4"
+    )
+    parser.add_argument(
+        "--mem_limit",
+        type=float,
+        default=None,
+        help="Memory limit in GB for each worker process, shared by its concurrent images but not by its --cal_nproc workers, default=no limit"
+    )
+    parser.add_argument(
+        "--data_path",
+        type=str,
+        default="./data/{day}",
+        help="Directory with the rpfits files of a job when the manifest has no path column, {day} is replaced by the job's day, default=./data/{day}"
+    )
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default="batch_summary.json",
+        help="Where to write the json summary of the batch, default=batch_summary.json"
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        default=False,
+        help="Rerun every stage instead of continuing from cached products"
+    )
+    parser.add_argument(
+        "--plots",
+        action="store_true",
+        default=False,
+        help="Make the calibration plots for each job"
+    )
+    parser.add_argument(
+        "--noflag6",
+        action="store_true",
+        default=False,
+        help="Don't flag antenna 6"
+    )
+    parser.add_argument(
+        "--bandpass",
+        type=str,
+        default="solve",
+        choices=["solve", "reuse", "interpolate"],
+        help="solve every bandpass, or reuse/interpolate the nearest ones in the calibration library, default=solve"
+    )
+    parser.add_argument(
+        "--bandpass_maxage",
+        type=float,
+        default=30.0,
+        help="Furthest away in days a library bandpass can be to get reused, default=30"
+    )
+    parser.add_argument(
+        "--cal_nproc",
+        type=int,
+        default=1,
+        help="Workers each job uses to solve the spws of its calibration at once, default=1"
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Enable extra logging'
+    )
+    args = parser.parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    jobs = read_manifest(args.manifest, path=args.data_path)
+    summary = run_batch(
+        jobs,
+        nproc=args.nproc,
+        mem_limit=args.mem_limit,
+        cont=not args.restart,
+        plots=args.plots,
+        flag6=not args.noflag6,
+        bandpass=args.bandpass,
+        bandpass_maxage=args.bandpass_maxage,
+        cal_nproc=args.cal_nproc,
+    )
+    print_summary(summary)
+    with open(args.summary, "w") as f:
+        json.dump(summary, f, indent=2)
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# Checks pointfit against a uvmodelfit style fit and times both on synthetic visibilities
+# The reference fit does what uvmodelfit does for a point source: a per scan selection followed by
+# niter Gauss-Newton iterations on (flux, x offset, y offset). With --vis and casa installed the
+# fluxes are also compared against real uvmodelfit runs on that ms.
+
+import os
+import sys
+import time
+import numpy as np
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pointfit import fit_point_source, fit_field
+
+
+def synthetic_vis(nscan=100, nrow=1000, nchan=64, ncorr=4, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    flux = rng.uniform(0.5, 2.0, nscan)
+    scan = np.repeat(np.arange(1, nscan + 1), nrow)
+    time_ = np.arange(nscan * nrow) * 10.0
+    uvw = rng.normal(0, 2000.0, (2, nscan * nrow))
+    model = np.zeros((ncorr, nchan, nscan * nrow), dtype=complex)
+    model[0] = flux[scan - 1]
+    model[-1] = flux[scan - 1]
+    shape = model.shape
+    data = model + noise * (rng.normal(size=shape) + 1j * rng.normal(size=shape))
+    flag = rng.uniform(size=shape) < 0.05
+    weight = np.ones((ncorr, nscan * nrow))
+    return data, flag, weight, scan, time_, uvw, flux
+
+
+def reference_fit(data, flag, weight, uvw, niter=10):
+    # Gauss-Newton fit of a point source with a position offset, like uvmodelfit
+    stokes_i = 0.5 * (data[0] + data[-1])
+    w = np.where(flag[0] | flag[-1], 0.0, weight[0] + weight[-1])[None, :] * np.ones(stokes_i.shape)
+    u = np.broadcast_to(uvw[0], stokes_i.shape)
+    v = np.broadcast_to(uvw[1], stokes_i.shape)
+    par = np.array([1.0, 0.0, 0.0])
+    for _ in range(niter):
+        phase = 2 * np.pi * (u * par[1] + v * par[2])
+        model = par[0] * np.exp(1j * phase)
+        resid = (stokes_i - model).ravel()
+        jac = np.stack(
+            [
+                np.exp(1j * phase).ravel(),
+                (2j * np.pi * u * model).ravel(),
+                (2j * np.pi * v * model).ravel(),
+            ],
+            axis=1,
+        )
+        wr = w.ravel()
+        a = np.real(jac.conj().T @ (jac * wr[:, None]))
+        b = np.real(jac.conj().T @ (resid * wr))
+        par = par + np.linalg.solve(a, b)
+    return par[0]
+
+
+def bench_synthetic(nscan, nrow, nchan):
+    data, flag, weight, scan, time_, uvw, truth = synthetic_vis(nscan=nscan, nrow=nrow, nchan=nchan)
+
+    start = time.perf_counter()
+    uniq, flux, flux_err, nvis = fit_point_source(data, flag, weight, scan, time_)
+    t_batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ref = []
+    for s in uniq[:, 0]:
+        sel = scan == s
+        ref.append(reference_fit(data[..., sel], flag[..., sel], weight[..., sel], uvw[:, sel]))
+    t_loop = time.perf_counter() - start
+    ref = np.array(ref)
+
+    diff = np.abs(flux - ref)
+    pull = np.abs(flux - truth) / flux_err
+    print(f"{nscan} scans x {nrow} rows x {nchan} chans")
+    print(f"  batched pointfit : {t_batch:8.3f} s")
+    print(f"  per scan loop    : {t_loop:8.3f} s  ({t_loop / t_batch:.1f}x slower)")
+    print(f"  max |pointfit - reference| : {diff.max():.2e} Jy")
+    print(f"  median |pointfit - truth| / err : {np.median(pull):.2f}")
+    return diff.max()
+
+
+def bench_ms(vis, field, spw):
+    # Compare against real uvmodelfit calls on every scan of a field
+    from fluxfit import fit_uv
+
+    start = time.perf_counter()
+    fit = fit_field(vis, field, spw=spw)
+    t_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    for s in fit["scans"]:
+        res = fit_uv(
+            {
+                "vis": vis,
+                "field": field,
+                "spw": spw,
+                "scan": f"{s['scan']}",
+                "sourcepar": [fit["flux"], 0, 0],
+                "outfile": f"bench_{field}_{s['scan']}.cl",
+            }
+        )
+        print(f"  scan {s['scan']:4d}: pointfit {s['flux']:.4f} +- {s['flux_err']:.4f}  uvmodelfit {res['flux']:.4f}")
+    t_loop = time.perf_counter() - start
+    print(f"  pointfit {t_batch:.2f} s, uvmodelfit {t_loop:.2f} s for {len(fit['scans'])} scans")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the vectorised point source fitter")
+    parser.add_argument("--nscan", type=int, default=100, help="Number of synthetic scans, default=100")
+    parser.add_argument("--nrow", type=int, default=150, help="Rows per synthetic scan, default=150")
+    parser.add_argument("--nchan", type=int, default=64, help="Channels per row, default=64")
+    parser.add_argument("--vis", type=str, default=None, help="Real ms to compare with uvmodelfit (needs casa)")
+    parser.add_argument("--field", type=str, default=None, help="Field in --vis to fit")
+    parser.add_argument("--spw", type=str, default="", help="Spw in --vis to fit")
+    args = parser.parse_args()
+
+    maxdiff = bench_synthetic(args.nscan, args.nrow, args.nchan)
+    if maxdiff > 1e-3:
+        print("pointfit disagrees with the reference fit!")
+        sys.exit(1)
+    if args.vis is not None:
+        bench_ms(args.vis, args.field, args.spw)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# Startup time of the pipeline scripts and what importing them drags in
+# Each module is imported (and each script run with --help) in a fresh interpreter, like a spawned
+# worker would, and timed over a few repeats. Importing processing.py and the modules the workers
+# use must not load casa, plotms, matplotlib or astropy, those only come in when a stage needs them.
+# Exits with 1 if any of them do or a startup is slower than --max seconds.
+# e.g. python benchmarks/bench_startup.py --repeat 5
+
+import os
+import sys
+import time
+import subprocess
+from argparse import ArgumentParser
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+repodir = os.path.dirname(benchdir)
+
+MODULES = ["processing", "batch_processing", "watch", "selfcal", "measureflux_casa", "fluxfit", "lightcurves"]
+SCRIPTS = ["processing.py", "batch_processing.py", "watch.py"]
+HEAVY = ["casatasks", "casatools", "casaplotms", "matplotlib", "astropy"]
+
+
+def heavy_imports(module):
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=repodir, capture_output=True, text=True)
+    if out.returncode != 0:
+        return None
+    return [m for m in out.stdout.strip().split(",") if m != ""]
+
+
+def best_time(cmd, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=repodir, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Time the startup of the pipeline modules and check they don't import casa")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each, the fastest counts, default=3")
+    parser.add_argument("--max", type=float, default=2.0, help="Slowest acceptable startup in seconds, default=2")
+    args = parser.parse_args()
+
+    bare = best_time([sys.executable, "-c", "pass"], args.repeat)
+    print(f"{'python':<28} {bare:6.3f} s")
+    failed = False
+    for module in MODULES:
+        seconds = best_time([sys.executable, "-c", f"import {module}"], args.repeat)
+        heavy = heavy_imports(module)
+        if heavy is None:
+            note = "import failed"
+            failed = True
+        elif len(heavy) > 0:
+            note = f"imports {', '.join(heavy)}"
+            failed = True
+        else:
+            note = ""
+        failed = failed or seconds > args.max
+        print(f"{'import ' + module:<28} {seconds:6.3f} s {note}")
+    for script in SCRIPTS:
+        seconds = best_time([sys.executable, script, "--help"], args.repeat)
+        failed = failed or seconds > args.max
+        print(f"{script + ' --help':<28} {seconds:6.3f} s")
+    if failed:
+        print("Startup is too slow or pulls in casa/plotting at import")
+        sys.exit(1)
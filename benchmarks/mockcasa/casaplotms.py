@@ -0,0 +1,8 @@
+# Mock casaplotms for the benchmarks
+
+from mockconfig import CALLS, wait
+
+
+def plotms(**kwargs):
+    CALLS.append(("plotms", kwargs))
+    wait()
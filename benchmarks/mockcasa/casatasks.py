@@ -0,0 +1,194 @@
+# Mock casatasks for the benchmarks, see mockconfig.py for the settings
+# Tasks sleep for the configured latency, record their call and create whatever products a real
+# task would leave on disk so the pipeline logic downstream of them behaves normally.
+
+import os
+import shutil
+import mockconfig
+from mockconfig import CALLS, wait, make_table
+
+
+def _task(name, kwargs, products=(), mb=0.0):
+    CALLS.append((name, kwargs))
+    touched = mockconfig.touched_partitions(kwargs.get("vis", ""), kwargs.get("spw", ""), kwargs.get("scan", ""))
+    if touched is not None:
+        mockconfig.PARTITIONS.append((name, kwargs["vis"], touched))
+    wait()
+    for key in products:
+        path = kwargs.get(key)
+        if isinstance(path, str) and path != "":
+            make_table(path, mb=mb)
+
+
+def importatca(**kwargs):
+    _task("importatca", kwargs, ["vis"], mb=mockconfig.MS_MB)
+
+
+def _transform(name, kwargs):
+    if kwargs.get("createmms", False):
+        _task(name, kwargs)
+        mockconfig.make_mms(kwargs["outputvis"], kwargs.get("separationaxis", "scan"), mb=mockconfig.MS_MB)
+    else:
+        _task(name, kwargs, ["outputvis"], mb=mockconfig.MS_MB)
+
+
+def mstransform(**kwargs):
+    _transform("mstransform", kwargs)
+
+
+def split(**kwargs):
+    _task("split", kwargs, ["outputvis"], mb=mockconfig.MS_MB)
+
+
+def partition(**kwargs):
+    _transform("partition", dict(kwargs, createmms=kwargs.get("createmms", True)))
+
+
+def virtualconcat(**kwargs):
+    # With keepcopy=False the inputs are moved into the multi-ms as its sub-ms
+    _task("virtualconcat", kwargs, ["concatvis"])
+    os.makedirs(os.path.join(kwargs["concatvis"], "SUBMSS"), exist_ok=True)
+    for vis in kwargs["vis"]:
+        target = os.path.join(kwargs["concatvis"], "SUBMSS", os.path.basename(vis))
+        if kwargs.get("keepcopy", False) is False:
+            os.rename(vis, target)
+        else:
+            shutil.copytree(vis, target)
+
+
+def concat(**kwargs):
+    _task("concat", kwargs, ["concatvis"], mb=mockconfig.MS_MB)
+
+
+def flagmanager(**kwargs):
+    _task("flagmanager", kwargs)
+    version = os.path.join(f"{kwargs['vis']}.flagversions", f"flags.{kwargs.get('versionname', '')}")
+    if kwargs.get("mode") == "save":
+        os.makedirs(os.path.dirname(version), exist_ok=True)
+        with open(version, "w") as f:
+            f.write(mockconfig.flag_state(kwargs["vis"]))
+    elif kwargs.get("mode") == "restore" and os.path.exists(version):
+        with open(version, "r") as f:
+            mockconfig.set_flag_state(kwargs["vis"], f.read())
+    elif kwargs.get("mode") == "delete" and os.path.exists(version):
+        os.remove(version)
+
+
+def flagdata(**kwargs):
+    _task("flagdata", kwargs)
+    if kwargs.get("mode") == "list":
+        # One summary report per summary agent in the list, each adding a little more flagging
+        reports = {}
+        nsummary = 0
+        for cmd in kwargs.get("inpfile", []):
+            if "mode='summary'" in cmd:
+                name = cmd.split("name='")[1].split("'")[0]
+                reports[f"report{nsummary}"] = {"name": name, "flagged": 1000.0 * (nsummary + 1), "total": 1e5}
+                nsummary += 1
+        if len(kwargs.get("inpfile", [])) > nsummary:
+            mockconfig.set_flag_state(kwargs["vis"], str(int(mockconfig.flag_state(kwargs["vis"])) + 1))
+        return reports
+    if kwargs.get("mode", "manual") != "summary":
+        mockconfig.set_flag_state(kwargs["vis"], str(int(mockconfig.flag_state(kwargs["vis"])) + 1))
+    return {}
+
+
+def setjy(**kwargs):
+    _task("setjy", kwargs)
+    mockconfig.save_model(kwargs["vis"], kwargs.get("field", ""), scratch=kwargs.get("usescratch", False))
+
+
+def gaincal(**kwargs):
+    _task("gaincal", kwargs, ["caltable"])
+
+
+def bandpass(**kwargs):
+    _task("bandpass", kwargs, ["caltable"])
+
+
+def fluxscale(**kwargs):
+    _task("fluxscale", kwargs, ["fluxtable"])
+    return {}
+
+
+def applycal(**kwargs):
+    _task("applycal", kwargs)
+
+
+def clearcal(**kwargs):
+    _task("clearcal", kwargs)
+
+
+def ft(**kwargs):
+    _task("ft", kwargs)
+    mockconfig.save_model(kwargs["vis"], kwargs.get("field", ""), scratch=kwargs.get("usescratch", False))
+
+
+def delmod(**kwargs):
+    _task("delmod", kwargs)
+    mockconfig.delete_model(kwargs["vis"], otf=kwargs.get("otf", True), scr=kwargs.get("scr", False))
+
+
+def tclean(**kwargs):
+    _task("tclean", kwargs)
+    if kwargs.get("savemodel", "none") != "none":
+        mockconfig.save_model(kwargs["vis"], kwargs.get("field", ""), scratch=kwargs["savemodel"] == "modelcolumn")
+    imagename = kwargs["imagename"]
+    for ext in ["image", "residual", "model", "psf", "pb", "sumwt"]:
+        make_table(f"{imagename}.{ext}")
+
+
+def rmtables(tablenames=None, **kwargs):
+    import shutil
+
+    _task("rmtables", dict(kwargs, tablenames=tablenames))
+    names = [tablenames] if isinstance(tablenames, str) else tablenames or []
+    for name in names:
+        shutil.rmtree(name, ignore_errors=True)
+
+
+def impbcor(**kwargs):
+    _task("impbcor", kwargs, ["outfile"])
+
+
+def exportfits(**kwargs):
+    _task("exportfits", kwargs)
+
+
+def uvmodelfit(**kwargs):
+    _task("uvmodelfit", kwargs)
+    # Every iteration takes the flux 70% of the way from where it started to the field's true flux
+    outfile = kwargs["outfile"]
+    os.makedirs(outfile, exist_ok=True)
+    sourcepar = kwargs.get("sourcepar") or [1.0, 0, 0]
+    start = sourcepar[0] if sourcepar[0] is not None else 1.0
+    true = mockconfig.true_flux(kwargs.get("field", ""))
+    flux = true + (start - true) * 0.3 ** kwargs.get("niter", 10)
+    with open(os.path.join(outfile, "flux"), "w") as f:
+        f.write(f"{flux}\n")
+
+
+def listobs(vis="", listfile="", **kwargs):
+    _task("listobs", dict(kwargs, vis=vis, listfile=listfile))
+    names = mockconfig.source_names()
+    obsinfo = {"nfields": len(names), "numrecords": mockconfig.NSCANS * mockconfig.NROWS}
+    for i, name in enumerate(names):
+        obsinfo[f"field_{i}"] = {"name": name, "code": "", "direction": {}}
+    start = 60000.0
+    step = 300.0 / 86400.0
+    for scan in range(1, mockconfig.NSCANS + 1):
+        field = mockconfig.scan_field(scan)
+        obsinfo[f"scan_{scan}"] = {
+            "0": {
+                "BeginTime": start + (scan - 1) * step,
+                "EndTime": start + scan * step - 10.0 / 86400.0,
+                "FieldId": field,
+                "FieldName": names[field],
+                "IntegrationTime": 290.0,
+                "SpwIds": list(range(mockconfig.NSPW)),
+                "nRow": mockconfig.NROWS,
+                "scanId": scan,
+                "StateId": 0,
+            }
+        }
+    return obsinfo
@@ -0,0 +1,177 @@
+# Mock casatools for the benchmarks, just enough of the tools the pipeline touches
+
+import os
+import numpy as np
+import mockconfig
+
+
+class msmetadata:
+    def open(self, vis):
+        mockconfig.wait()
+        self.vis = vis
+
+    def close(self):
+        pass
+
+    def done(self):
+        pass
+
+    def nspw(self):
+        return mockconfig.NSPW
+
+    def nchan(self, spw):
+        return mockconfig.NCHAN
+
+    def chanfreqs(self, spw):
+        start = 5.5e9 if spw == 0 else 9.0e9
+        return start - 1e9 + np.arange(mockconfig.NCHAN) * 1e6
+
+    def chanwidths(self, spw):
+        return np.full(mockconfig.NCHAN, 1e6)
+
+    def antennanames(self):
+        return [f"CA0{i}" for i in range(1, 7)]
+
+    def fieldnames(self):
+        return mockconfig.source_names()
+
+    def nrows(self):
+        return mockconfig.NSCANS * mockconfig.NROWS
+
+    def nscans(self):
+        return mockconfig.NSCANS
+
+
+class componentlist:
+    def open(self, filename):
+        mockconfig.wait()
+        with open(os.path.join(filename, "flux"), "r") as f:
+            self.flux = float(f.read())
+
+    def getcomponent(self, i):
+        return {"flux": {"value": [self.flux, 0.0, 0.0, 0.0]}}
+
+    def getrefdir(self, i):
+        # Always at the phase centre
+        return {"m0": {"unit": "rad", "value": 0.0}, "m1": {"unit": "rad", "value": 0.0}, "refer": "J2000"}
+
+    def close(self):
+        pass
+
+    def done(self):
+        pass
+
+
+class image:
+    def open(self, imagename):
+        mockconfig.wait()
+        self.imagename = imagename
+
+    def statistics(self, **kwargs):
+        return {"rms": np.array([1e-4]), "max": np.array([1.0]), "min": np.array([-5e-4]), "medabsdevmed": np.array([6e-5])}
+
+    def close(self):
+        pass
+
+    def done(self):
+        pass
+
+
+# Sub tables of a mock ms, anything else opened is taken to be the main table
+SUBTABLES = ["ANTENNA", "FIELD", "POLARIZATION", "DATA_DESCRIPTION", "SPECTRAL_WINDOW", "SOURCE"]
+
+
+class table:
+    def open(self, tablename, nomodify=True):
+        mockconfig.wait()
+        self.tablename = tablename
+        self.selection = ""
+
+    def field_ids(self):
+        # Fields a FIELD_ID==n or FIELD_ID IN [..] query selected, rows cycle through them
+        if "FIELD_ID IN [" in self.selection:
+            return [int(f) for f in self.selection.split("FIELD_ID IN [")[1].split("]")[0].split(",")]
+        if "FIELD_ID==" in self.selection:
+            return [int(self.selection.split("FIELD_ID==")[1].split()[0])]
+        return [0]
+
+    def main_col(self, column, nrow):
+        # Main table rows with four linear correlations, every visibility 1 Jy and nothing flagged
+        shape = (4, mockconfig.NCHAN, nrow)
+        if column in ["DATA", "CORRECTED_DATA", "MODEL_DATA"]:
+            return np.ones(shape, dtype=np.complex64)
+        if column == "FLAG":
+            return np.zeros(shape, dtype=bool)
+        if column == "WEIGHT":
+            return np.ones((4, nrow), dtype=np.float32)
+        if column == "FIELD_ID":
+            ids = self.field_ids()
+            return np.array([ids[i % len(ids)] for i in range(nrow)])
+        if column == "SCAN_NUMBER":
+            return np.arange(nrow) // max(1, mockconfig.NROWS // 10) + 1
+        if column == "TIME":
+            return 5.0e9 + np.arange(nrow) * 10.0
+        raise KeyError(column)
+
+    def getcell(self, column, row):
+        name = self.tablename.rstrip("/")
+        if name.endswith("SPECTRAL_WINDOW") and column == "CHAN_FREQ":
+            return msmetadata().chanfreqs(row)
+        if name.endswith("POLARIZATION") and column == "CORR_TYPE":
+            return np.array([9, 10, 11, 12])
+        return self.main_col(column, 1)[..., 0]
+
+    def getcol(self, column, startrow=0, nrow=-1):
+        # ANTENNA is a 6 antenna east-west array with a 6 km arm, the UVW of the main table only has
+        # baselines up to 200 m (as if CA06 was flagged), its other columns come from main_col
+        name = self.tablename.rstrip("/")
+        if name.endswith("ANTENNA"):
+            east = np.array([0.0, 30.6, 61.2, 91.8, 153.0, 6000.0])
+            if column == "POSITION":
+                return np.stack([-4751640.0 + east * 0.0, 2791700.0 + east, -3200490.0 + east * 0.0])
+            if column == "NAME":
+                return np.array([f"CA0{i}" for i in range(1, 7)])
+        if name.endswith("POLARIZATION") and column == "NUM_CORR":
+            return np.array([4])
+        if name.endswith("DATA_DESCRIPTION") and column == "SPECTRAL_WINDOW_ID":
+            return np.arange(mockconfig.NSPW)
+        if name.endswith("DATA_DESCRIPTION") and column == "POLARIZATION_ID":
+            return np.zeros(mockconfig.NSPW, dtype=int)
+        if name.endswith("FIELD") and column == "NAME":
+            return np.array(mockconfig.source_names())
+        if name.endswith("FIELD") and column == "PHASE_DIR":
+            return np.zeros((2, 1, len(mockconfig.source_names())))
+        if column == "UVW":
+            u = np.linspace(-200.0, 200.0, mockconfig.NROWS)
+            return np.stack([u, u[::-1] * 0.5, np.zeros_like(u)])
+        if os.path.basename(name) in SUBTABLES:
+            raise KeyError(column)
+        nrow = mockconfig.NROWS - startrow if nrow < 0 else min(nrow, mockconfig.NROWS - startrow)
+        return self.main_col(column, nrow)
+
+    def copyrows(self, outtable):
+        mockconfig.wait()
+
+    def query(self, query, columns=""):
+        sel = table()
+        sel.tablename = self.tablename
+        sel.selection = query
+        return sel
+
+    def nrows(self):
+        return mockconfig.NROWS
+
+    def colnames(self):
+        names = ["UVW", "FLAG", "DATA"]
+        if os.path.isdir(os.path.join(self.tablename, "MODEL_DATA")):
+            names.append("MODEL_DATA")
+        return names
+
+    def keywordnames(self):
+        return [f"definedmodel_field_{i}" for i in mockconfig.model_fields(self.tablename)]
+
+    def close(self):
+        pass
+
+    def done(self):
+        pass
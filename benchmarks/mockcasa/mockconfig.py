@@ -0,0 +1,150 @@
+# Settings shared by the mock casatasks/casatools/casaplotms modules
+# Everything can be set from the environment so worker processes pick up the same values.
+#   MOCKCASA_LATENCY   seconds every task call sleeps for (default 0)
+#   MOCKCASA_NSOURCES  number of target fields in a mock ms (default 100)
+#   MOCKCASA_NSCANS    number of scans in a mock ms (default 5000)
+#   MOCKCASA_NROWS     rows per scan (default 300)
+#   MOCKCASA_NSPW      spectral windows (default 2)
+#   MOCKCASA_NCHAN     channels per spw (default 2048)
+#   MOCKCASA_MS_MB     size of the data file importatca/mstransform/split "write" (default 1, sparse)
+
+import os
+import json
+import time
+
+LATENCY = float(os.environ.get("MOCKCASA_LATENCY", 0.0))
+NSOURCES = int(os.environ.get("MOCKCASA_NSOURCES", 100))
+NSCANS = int(os.environ.get("MOCKCASA_NSCANS", 5000))
+NROWS = int(os.environ.get("MOCKCASA_NROWS", 300))
+NSPW = int(os.environ.get("MOCKCASA_NSPW", 2))
+NCHAN = int(os.environ.get("MOCKCASA_NCHAN", 2048))
+MS_MB = float(os.environ.get("MOCKCASA_MS_MB", 1.0))
+
+# Every task call is recorded here as (task, kwargs)
+CALLS = []
+# Every task call on a multi-ms is recorded here as (task, vis, [sub-ms the call touched])
+PARTITIONS = []
+
+
+def source_names():
+    return ["1934_cal_cx", "1934_cal_l", "secondary"] + [f"src{i:04d}" for i in range(NSOURCES)]
+
+
+def true_flux(field):
+    # Flux uvmodelfit converges to for a field, different for every source
+    names = source_names()
+    i = names.index(field) if field in names else 0
+    return 1.0 + 0.1 * (i % 10)
+
+
+def scan_field(scan):
+    # Cycle through the sources with a secondary scan every tenth scan, like a real schedule
+    names = source_names()
+    if scan % 10 == 0:
+        return 2
+    return 3 + (scan % NSOURCES)
+
+
+def wait():
+    if LATENCY > 0:
+        time.sleep(LATENCY)
+
+
+def make_table(path, mb=0.0):
+    # An on disk "table", with a sparse data file of the requested size
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "table.dat"), "w") as f:
+        f.write("mock\n")
+    with open(os.path.join(path, "table.f0"), "wb") as f:
+        f.truncate(int(mb * 1024**2))
+    for sub in ["FIELD", "SPECTRAL_WINDOW", "ANTENNA"]:
+        os.makedirs(os.path.join(path, sub), exist_ok=True)
+        with open(os.path.join(path, sub, "table.dat"), "w") as f:
+            f.write("mock\n")
+
+
+def flag_state(vis):
+    # The flags of a mock ms are a counter in FLAG_STATE, bumped by every flagdata that flags
+    try:
+        with open(os.path.join(vis, "FLAG_STATE"), "r") as f:
+            return f.read()
+    except OSError:
+        return "0"
+
+
+def set_flag_state(vis, state):
+    if os.path.isdir(vis):
+        with open(os.path.join(vis, "FLAG_STATE"), "w") as f:
+            f.write(state)
+
+
+def make_mms(path, axis, mb=0.0):
+    # A multi-ms: the reference table plus one sub-ms per scan chunk or per spw under SUBMSS, with
+    # what each sub-ms holds in partitions.json
+    make_table(path)
+    if axis == "spw":
+        parts = {f"sub{i}": {"spw": [i]} for i in range(NSPW)}
+    else:
+        nsub = min(4, NSCANS)
+        scans = list(range(1, NSCANS + 1))
+        parts = {f"sub{i}": {"scan": scans[i::nsub]} for i in range(nsub)}
+    for name in parts:
+        make_table(os.path.join(path, "SUBMSS", name), mb=mb / len(parts))
+    with open(os.path.join(path, "partitions.json"), "w") as f:
+        json.dump({"axis": axis, "parts": parts}, f)
+
+
+def touched_partitions(vis, spw="", scan=""):
+    # Sub-ms of a multi-ms that a selection reaches, None if vis isn't a multi-ms
+    filename = os.path.join(str(vis), "partitions.json")
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        info = json.load(f)
+    wanted = {"spw": str(spw), "scan": str(scan)}
+    touched = []
+    for name, holds in info["parts"].items():
+        ok = True
+        for key, values in holds.items():
+            sel = [v for v in wanted[key].split(",") if v != ""]
+            if len(sel) > 0 and not any(int(v.split(":")[0]) in values for v in sel if v.split(":")[0].isdigit()):
+                ok = False
+        if ok:
+            touched.append(name)
+    return touched
+
+
+def save_model(vis, field, scratch):
+    # A MODEL_DATA column is a directory in the ms, virtual models are field ids in models.json
+    if not os.path.isdir(str(vis)):
+        return
+    if scratch:
+        make_table(os.path.join(vis, "MODEL_DATA"))
+        return
+    names = source_names()
+    filename = os.path.join(vis, "models.json")
+    ids = set(model_fields(vis))
+    for f in str(field).split(","):
+        if f.isdigit():
+            ids.add(int(f))
+        elif f in names:
+            ids.add(names.index(f))
+    with open(filename, "w") as fp:
+        json.dump(sorted(ids), fp)
+
+
+def model_fields(vis):
+    filename = os.path.join(str(vis), "models.json")
+    if not os.path.exists(filename):
+        return []
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def delete_model(vis, otf=True, scr=False):
+    import shutil
+
+    if scr:
+        shutil.rmtree(os.path.join(vis, "MODEL_DATA"), ignore_errors=True)
+    if otf and os.path.exists(os.path.join(vis, "models.json")):
+        os.remove(os.path.join(vis, "models.json"))
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# Which sub-ms of a multi-ms each task of processing.py reaches with --partition
+# Runs the stage graph of a day against the mocks in benchmarks/mockcasa with the ms partitioned by
+# scan or spw and prints every task that ran on a multi-ms with the sub-ms its selection touched.
+# Under mpicasa those are the sub-ms the task is spread over, so a task touching one sub-ms of many
+# gets nothing from the partitioning. The cx images are made in child processes and aren't listed.
+# e.g. python benchmarks/partition_trace.py --axis spw --nscans 40
+
+import os
+import sys
+import logging
+import tempfile
+from collections import Counter
+from argparse import ArgumentParser
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+repodir = os.path.dirname(benchdir)
+
+
+def trace(axis):
+    import processing
+    import mockconfig
+    from stagecache import StageCache
+
+    os.makedirs("./data/day0", exist_ok=True)
+    open("2021-01-01_0000.c3487", "w").close()
+    visname, calfile, imagename = processing.day_names("day0", "c3487", "src0001", "secondary", "cx")
+    cache = StageCache("./data/day0/stagecache_cx.json")
+    processing.run_pipeline(
+        cache,
+        ["2021-01-01_0000.c3487"],
+        visname,
+        calfile,
+        imagename,
+        "secondary",
+        "src0001",
+        "1934_cal_cx",
+        "cx",
+        partition_axis=axis,
+    )
+    return mockconfig.PARTITIONS
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Print the sub-ms each task touches when processing.py partitions the ms")
+    parser.add_argument("--axis", type=str, default="scan", choices=["scan", "spw"], help="Partition axis, default=scan")
+    parser.add_argument("--nscans", type=int, default=40, help="Scans in the mock ms, default=40")
+    args = parser.parse_args()
+
+    os.environ["MOCKCASA_NSCANS"] = str(args.nscans)
+    sys.path[:0] = [os.path.join(benchdir, "mockcasa"), repodir]
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        calls = trace(args.axis)
+    counts = Counter()
+    for task, vis, touched in calls:
+        print(f"{task:<12} {os.path.basename(vis):<24} {len(touched)} sub-ms: {', '.join(touched)}")
+        counts[len(touched) > 1] += 1
+    print(f"{counts[True]} of {len(calls)} calls on a multi-ms span more than one sub-ms")
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# Benchmarks of the pure python parts of processing.py and measureflux_casa.py
+# casatasks/casatools/casaplotms are swapped for the mocks in benchmarks/mockcasa, so this runs
+# anywhere and only measures our own orchestration, metadata, flux bookkeeping and lightcurve code.
+# Each run is appended to benchmarks/results.jsonl (not tracked by git, every machine keeps its own)
+# and compared against the last run with the same settings, anything slower by more than --tolerance
+# is reported as a regression.
+# e.g. python benchmarks/run_benchmarks.py --ndays 50 --nsources 100 --nscans 5000
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import logging
+import contextlib
+import tempfile
+import datetime
+import subprocess
+from argparse import ArgumentParser
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+repodir = os.path.dirname(benchdir)
+
+
+def setup_mocks(args):
+    # The mock settings are read from the environment when mockconfig is first imported
+    os.environ["MOCKCASA_LATENCY"] = str(args.latency)
+    os.environ["MOCKCASA_NSOURCES"] = str(args.nsources)
+    os.environ["MOCKCASA_NSCANS"] = str(args.nscans)
+    os.environ["MOCKCASA_MS_MB"] = str(args.ms_mb)
+    sys.path[:0] = [os.path.join(benchdir, "mockcasa"), repodir]
+    logging.disable(logging.WARNING)
+
+
+def timed(func, *args, **kwargs):
+    # The scripts print a line per source/scan, keep that out of the timings and the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - start
+
+
+def bench_orchestration(ndays):
+    # Full stage graph for every day, then again with everything cached. Everything runs in this
+    # process (interactive=True images the cx spws one after the other, the mock tclean never waits)
+    # so this is only our own orchestration, bench_spawn has the cost of the worker processes
+    import processing
+    from stagecache import StageCache
+
+    def run_days():
+        for d in range(ndays):
+            day = f"day{d}"
+            os.makedirs(f"./data/{day}", exist_ok=True)
+            visname, calfile, imagename = processing.day_names(day, "c3487", "src0001", "secondary", "cx")
+            cache = StageCache(f"./data/{day}/stagecache_cx.json")
+            processing.run_pipeline(
+                cache, ["2021-01-01_0000.c3487"], visname, calfile, imagename, "secondary", "src0001", "1934_cal_cx", "cx",
+                interactive=True, cal_nproc=1,
+            )
+
+    open("2021-01-01_0000.c3487", "w").close()
+    cold = timed(run_days)
+    warm = timed(run_days)
+    return {"orchestration_cold": cold, "orchestration_cached": warm}
+
+
+def bench_diagnostics():
+    # One day with plots=True, the postcal diagnostics read the mock ms and render in the background
+    import threading
+    import processing
+    from stagecache import StageCache
+
+    def run_day():
+        os.makedirs("./data/plots", exist_ok=True)
+        visname, calfile, imagename = processing.day_names("plots", "c3487", "src0001", "secondary", "cx")
+        cache = StageCache("./data/plots/stagecache_cx.json")
+        processing.run_pipeline(
+            cache, ["2021-01-01_0000.c3487"], visname, calfile, imagename, "secondary", "src0001", "1934_cal_cx", "cx",
+            plots=True, interactive=True, cal_nproc=1,
+        )
+        for thread in threading.enumerate():
+            if thread.name.startswith("diagnostics_"):
+                thread.join()
+
+    open("2021-01-01_0000.c3487", "w").close()
+    return {"orchestration_plots": timed(run_day)}
+
+
+def bench_spawn():
+    # The concurrent cx imaging of a day, both spws in their own spawned process with its own casa
+    import processing
+    from mockconfig import make_table
+
+    make_table("spawn.ms")
+    jobs = [
+        {"imagems": "spawn.ms", "imagename": f"spawn_spw{spw}", "field": "src0001", "spw": spw, "interactive": False, "savemodel": "none"}
+        for spw in ["0", "1"]
+    ]
+    return {"image_spawn": timed(processing.image_concurrent, jobs)}
+
+
+def bench_metadata():
+    from msindex import load_index
+    from mockconfig import make_table
+
+    make_table("meta.ms")
+    build = timed(load_index, "meta.ms", rebuild=True)
+    load = timed(load_index, "meta.ms")
+    return {"metadata_build": build, "metadata_load": load}
+
+
+def bench_flux_bookkeeping(nsources):
+    import mockconfig
+    import measureflux_casa
+    from lightcurve_store import LightcurveStore
+
+    mockconfig.make_table("flux.ms")
+    measureflux_casa.day = "day0"
+    measureflux_casa.band = "c"
+    measureflux_casa.nproc = 1
+    src_names = mockconfig.source_names()[3:3 + nsources]
+    store = LightcurveStore("flux.db")
+    days = timed(measureflux_casa.fit_days, store, "flux.ms", "0", src_names)
+    scans = timed(measureflux_casa.fit_scans, store, "flux.ms", "0", src_names)
+    store.close()
+    # The same fits as a single uvmodelfit run of max_niter each, what stopping at the tolerance has to beat
+    tolerance = measureflux_casa.tolerance
+    measureflux_casa.tolerance = None
+    store = LightcurveStore("flux_plain.db")
+    timed(measureflux_casa.fit_days, store, "flux.ms", "0", src_names)
+    plain = timed(measureflux_casa.fit_scans, store, "flux.ms", "0", src_names)
+    store.close()
+    measureflux_casa.tolerance = tolerance
+    return {"flux_day_fits": days, "flux_scan_fits": scans, "flux_scan_fits_plain": plain}
+
+
+def bench_lightcurves(nsources, ndays, nscans):
+    import numpy as np
+    from lightcurve_store import LightcurveStore
+
+    store = LightcurveStore("lightcurves.db")
+    rng = np.random.default_rng(1)
+    # Every day has nscans scans shared between the sources, like the mock ms
+    per_day = max(1, nscans // nsources)
+    records = []
+    for s in range(nsources):
+        for d in range(ndays):
+            for i in range(per_day):
+                records.append(
+                    {
+                        "source": f"src{s:04d}",
+                        "band": "c",
+                        "day": f"day{d}",
+                        "timestamp": 60000.0 + d + i / 288.0,
+                        "scan": i,
+                        "flux": float(rng.normal(1.0, 0.05)),
+                        "flux_err": 0.01,
+                    }
+                )
+    append = timed(store.append, records)
+
+    def aggregate():
+        stats = {}
+        for src in store.sources():
+            fluxes = [r["flux"] for r in store.history(src, "c")]
+            mean = sum(fluxes) / len(fluxes)
+            std = (sum((f - mean) ** 2 for f in fluxes) / len(fluxes)) ** 0.5
+            stats[src] = (mean, std / mean)
+        return stats
+
+    agg = timed(aggregate)
+    store.close()
+
+    def bulk_stats():
+        import lightcurves
+
+        lightcurves.source_stats(lightcurves.load_table("lightcurves.db", "c"))
+
+    bulk = timed(bulk_stats)
+    return {"lightcurve_append": append, "lightcurve_aggregate": agg, "lightcurve_stats": bulk, "lightcurve_rows": len(records)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repodir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_last(results, config, filename, tolerance):
+    if not os.path.exists(filename):
+        return []
+    previous = None
+    with open(filename, "r") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["config"] == config:
+                previous = entry
+    if previous is None:
+        return []
+    regressions = []
+    for key, value in results.items():
+        old = previous["results"].get(key)
+        if key.endswith("_rows") or old in [None, 0]:
+            continue
+        if value > old * (1 + tolerance):
+            regressions.append(f"{key}: {old:.3f}s -> {value:.3f}s ({value / old:.2f}x) vs {previous['commit']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the pure python paths against a mock casa")
+    parser.add_argument("--ndays", type=int, default=50, help="Days to run the stage graph over, default=50")
+    parser.add_argument("--nsources", type=int, default=100, help="Sources in the mock ms, default=100")
+    parser.add_argument("--nscans", type=int, default=5000, help="Scans in the mock ms, default=5000")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per casa task, default=0")
+    parser.add_argument("--ms_mb", type=float, default=1.0, help="Simulated (sparse) size of each ms in MB, default=1")
+    parser.add_argument(
+        "--results",
+        type=str,
+        default=os.path.join(benchdir, "results.jsonl"),
+        help="Where the results are tracked, default=benchmarks/results.jsonl"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown counted as a regression, default=0.2")
+    parser.add_argument("--keep", action="store_true", default=False, help="Keep the temporary work directory")
+    args = parser.parse_args()
+
+    setup_mocks(args)
+    config = {k: getattr(args, k) for k in ["ndays", "nsources", "nscans", "latency", "ms_mb"]}
+    workdir = tempfile.mkdtemp(prefix="atca_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        results.update(bench_orchestration(args.ndays))
+        results.update(bench_diagnostics())
+        results.update(bench_spawn())
+        results.update(bench_metadata())
+        results.update(bench_flux_bookkeeping(args.nsources))
+        results.update(bench_lightcurves(args.nsources, args.ndays, args.nscans))
+    finally:
+        os.chdir(cwd)
+        if args.keep is False:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for key, value in results.items():
+        print(f"{key:<24} {value:10.3f}" + ("" if key.endswith("_rows") else " s"))
+    regressions = compare_last(results, config, args.results, args.tolerance)
+    entry = {
+        "time": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "host": socket.gethostname(),
+        "config": config,
+        "results": results,
+    }
+    with open(args.results, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    if len(regressions) > 0:
+        print("Regressions against the last run:")
+        for r in regressions:
+            print(f"  {r}")
+        sys.exit(1)
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+# Cross day library of bandpass solutions
+# 1934 bandpasses barely change between days in the same array configuration, so the B0/B1 tables
+# solved for a day are copied into ./data/callibrary/ and indexed by project, band, array config,
+# primary and observing date. Another day can then reuse the nearest solution (or interpolate
+# between the nearest ones either side of it) instead of solving G0, B0, G1 and B1 again.
+# Which solution a day ended up with is written next to its tables as {calfile}.callib.json, and
+# every library entry keeps a list of the days that reused it.
+
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import contextlib
+import numpy as np
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BANDPASS_TABLES = ["B0", "B1"]
+MODES = ["solve", "reuse", "interpolate"]
+
+
+def array_config(vis):
+    # Antenna stations define the config, the rounded positions are enough to tell configs apart
+    from casatools import table
+
+    tb = table()
+    tb.open(f"{vis.rstrip('/')}/ANTENNA")
+    positions = np.round(np.asarray(tb.getcol("POSITION"), dtype=float)).astype(int)
+    names = list(tb.getcol("NAME"))
+    tb.close()
+    digest = hashlib.sha1((",".join(names) + positions.tobytes().hex()).encode()).hexdigest()
+    return f"auto_{digest[:10]}"
+
+
+def provenance_name(calfile):
+    return f"{calfile}.callib.json"
+
+
+def load_provenance(calfile):
+    filename = provenance_name(calfile)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def save_provenance(calfile, record):
+    with open(provenance_name(calfile), "w") as f:
+        json.dump(record, f, indent=2)
+
+
+def table_average(tablename):
+    # Time averaged bandpass per (spw, antenna): {key: (cparam, flagged)} over the unflagged solutions
+    from casatools import table
+
+    tb = table()
+    tb.open(tablename)
+    cparam = tb.getcol("CPARAM")
+    flag = tb.getcol("FLAG")
+    keys = np.stack([tb.getcol("SPECTRAL_WINDOW_ID"), tb.getcol("ANTENNA1")], axis=1)
+    tb.close()
+    good = ~flag
+    averages = {}
+    for key in np.unique(keys, axis=0):
+        rows = np.all(keys == key, axis=1)
+        n = good[..., rows].sum(axis=-1)
+        total = np.where(good[..., rows], cparam[..., rows], 0).sum(axis=-1)
+        averages[tuple(int(k) for k in key)] = (total / np.maximum(n, 1), n == 0)
+    return averages
+
+
+def interpolate_table(before, after, weight, outname):
+    # Amplitude and phase are interpolated separately between the two tables, weight is the fraction
+    # of the way from before to after. The result goes into a copy of the nearer table, every row of
+    # an antenna/spw gets the same interpolated bandpass
+    from casatools import table
+
+    first = table_average(before)
+    second = table_average(after)
+    template = before if weight <= 0.5 else after
+    shutil.copytree(template, outname)
+    tb = table()
+    tb.open(outname, nomodify=False)
+    cparam = tb.getcol("CPARAM")
+    flag = tb.getcol("FLAG")
+    keys = np.stack([tb.getcol("SPECTRAL_WINDOW_ID"), tb.getcol("ANTENNA1")], axis=1)
+    for row, key in enumerate(keys):
+        key = tuple(int(k) for k in key)
+        if key not in first or key not in second or first[key][0].shape != cparam[..., row].shape:
+            continue
+        (a, fa), (b, fb) = first[key], second[key]
+        amp = (1 - weight) * np.abs(a) + weight * np.abs(b)
+        phase = np.angle(a) + weight * np.angle(np.where(fb | fa, 1, b / np.where(a == 0, 1, a)))
+        value = amp * np.exp(1j * phase)
+        # Where only one side has a solution use that one
+        value = np.where(fa, b, np.where(fb, a, value))
+        cparam[..., row] = value
+        flag[..., row] = fa & fb
+    tb.putcol("CPARAM", cparam)
+    tb.putcol("FLAG", flag)
+    tb.close()
+    return
+
+
+class CalLibrary:
+    def __init__(self, libdir="./data/callibrary", mode="reuse", maxage=30.0, config=None):
+        # mode: solve always solves (and adds the solutions to the library), reuse takes the nearest
+        # valid solution, interpolate interpolates between the nearest either side of the day.
+        # maxage is the furthest away in days a solution can be, config overrides the array config
+        # worked out from the antenna positions
+        if mode not in MODES:
+            raise ValueError(f"Unknown calibration library mode {mode}, use one of {MODES}")
+        self.libdir = libdir
+        self.mode = mode
+        self.maxage = maxage
+        self.config = config
+        self.filename = os.path.join(libdir, "index.json")
+
+    @contextlib.contextmanager
+    def locked(self):
+        # Batch workers can add to the library at the same time
+        os.makedirs(self.libdir, exist_ok=True)
+        with open(os.path.join(self.libdir, "index.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return []
+        with open(self.filename, "r") as f:
+            return json.load(f)
+
+    def save(self, entries):
+        with open(f"{self.filename}.tmp", "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(f"{self.filename}.tmp", self.filename)
+
+    def key(self, vis, project, band, pri):
+        config = self.config if self.config is not None else array_config(vis)
+        return {"project": project, "band": band, "config": config, "pri": pri}
+
+    def candidates(self, key, date):
+        # Library entries that match the key, are within maxage of date and still have their tables
+        found = []
+        for entry in self.load():
+            if entry["key"] != key or abs(entry["date"] - date) > self.maxage:
+                continue
+            if all(os.path.exists(entry["tables"][ext]) for ext in BANDPASS_TABLES):
+                found.append(entry)
+        return sorted(found, key=lambda e: abs(e["date"] - date))
+
+    def add(self, calfile, key, date, day):
+        name = "_".join([key["project"], key["band"], key["config"], key["pri"], day])
+        tables = {}
+        for ext in BANDPASS_TABLES:
+            dest = os.path.join(self.libdir, f"{name}.{ext}")
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            shutil.copytree(f"{calfile}.{ext}", dest)
+            tables[ext] = dest
+        with self.locked():
+            entries = [e for e in self.load() if not (e["key"] == key and e["day"] == day)]
+            entries.append({"key": key, "date": date, "day": day, "tables": tables, "reused_by": []})
+            self.save(entries)
+        save_provenance(calfile, {"mode": "solved", "library": name})
+        logger.info(f"Added the {day} bandpass to the calibration library as {name}")
+        return
+
+    def note_reuse(self, days, day):
+        with self.locked():
+            entries = self.load()
+            for entry in entries:
+                if entry["day"] in days and day not in entry["reused_by"]:
+                    entry["reused_by"].append(day)
+            self.save(entries)
+
+    def fetch(self, calfile, key, date, day):
+        # Puts a library bandpass at {calfile}.B0/.B1, returns what was used or None to solve it
+        if self.mode == "solve":
+            return None
+        found = [e for e in self.candidates(key, date) if e["day"] != day]
+        if len(found) == 0:
+            logger.info(f"No bandpass in the library within {self.maxage} days for {key}, solving it")
+            return None
+        nearest = found[0]
+        record = {"mode": "reused", "from": [nearest["day"]], "offset_days": nearest["date"] - date}
+        before = [e for e in found if e["date"] <= date]
+        after = [e for e in found if e["date"] > date]
+        if self.mode == "interpolate" and len(before) > 0 and len(after) > 0:
+            first, second = before[0], after[0]
+            weight = (date - first["date"]) / (second["date"] - first["date"])
+            for ext in BANDPASS_TABLES:
+                interpolate_table(first["tables"][ext], second["tables"][ext], weight, f"{calfile}.{ext}")
+            record = {"mode": "interpolated", "from": [first["day"], second["day"]], "weight": weight}
+        else:
+            for ext in BANDPASS_TABLES:
+                shutil.copytree(nearest["tables"][ext], f"{calfile}.{ext}")
+        save_provenance(calfile, record)
+        self.note_reuse(record["from"], day)
+        logger.info(f"Bandpass for {day} {record['mode']} from {', '.join(record['from'])}")
+        return record
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(description="List the bandpass solutions in the calibration library")
+    parser.add_argument("--libdir", type=str, default="./data/callibrary", help="Library directory, default=./data/callibrary")
+    args = parser.parse_args()
+    for entry in sorted(CalLibrary(args.libdir).load(), key=lambda e: (e["key"]["band"], e["date"])):
+        key = entry["key"]
+        reused = ", ".join(entry["reused_by"]) if entry["reused_by"] else "-"
+        print(f"{entry['day']:<10} {entry['date']:.3f} {key['project']} {key['band']} {key['config']} {key['pri']} reused by: {reused}")
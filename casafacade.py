@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+# Lazy stand-ins for the casa tasks processing.py calls
+# Importing casatasks takes seconds and every spawned worker pays it again. A LazyTask looks like the
+# task it names but only imports casa the first time it is called, so processing.py --help, a fully
+# cached rerun or a module that just wants day_names or the flag plans never loads it.
+# benchmarks/bench_startup.py checks that importing processing.py stays free of casa and matplotlib.
+
+import importlib
+
+
+class LazyTask:
+    def __init__(self, module, name):
+        self.module = module
+        self.func = None
+        self.__name__ = name
+        self.__qualname__ = name
+
+    def __call__(self, *args, **kwargs):
+        if self.func is None:
+            self.func = getattr(importlib.import_module(self.module), self.__name__)
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<lazy {self.module}.{self.__name__}>"
+
+
+flagmanager = LazyTask("casatasks", "flagmanager")
+flagdata = LazyTask("casatasks", "flagdata")
+importatca = LazyTask("casatasks", "importatca")
+mstransform = LazyTask("casatasks", "mstransform")
+listobs = LazyTask("casatasks", "listobs")
+setjy = LazyTask("casatasks", "setjy")
+gaincal = LazyTask("casatasks", "gaincal")
+bandpass = LazyTask("casatasks", "bandpass")
+fluxscale = LazyTask("casatasks", "fluxscale")
+applycal = LazyTask("casatasks", "applycal")
+tclean = LazyTask("casatasks", "tclean")
+rmtables = LazyTask("casatasks", "rmtables")
+impbcor = LazyTask("casatasks", "impbcor")
+split = LazyTask("casatasks", "split")
+partition = LazyTask("casatasks", "partition")
+uvmodelfit = LazyTask("casatasks", "uvmodelfit")
+exportfits = LazyTask("casatasks", "exportfits")
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# Calibration diagnostics from one read of the ms, replacing the plotms calls in processing.py
+# One streaming pass over the data column reduces every selected field to amplitude and phase per
+# channel and correlation, of the complex visibilities averaged over time and baselines like plotms
+# with avgtime and avgbaseline (so the noise averages down instead of biasing the amplitude up).
+# The reduced arrays are cached as an npz next to the calibration tables and the pngs are drawn
+# from that cache in a background thread, so the pipeline carries on while they render and
+# restyling never has to read the ms again.
+
+import os
+import logging
+import threading
+import numpy as np
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bytes of visibilities read per chunk, the flags come on top
+CHUNK_BYTES = 256 * 1024**2
+# casacore Stokes enum to names for the correlations ATCA records
+CORR_NAMES = {5: "RR", 6: "RL", 7: "LR", 8: "LL", 9: "XX", 10: "XY", 11: "YX", 12: "YY"}
+# matplotlib style of the plots, used to be set when processing.py was imported
+PLOT_STYLE = {
+    "font.family": "serif",
+    "xtick.major.size": 8,
+    "xtick.minor.size": 8,
+    "ytick.major.size": 8,
+    "ytick.minor.size": 8,
+    "xtick.major.width": 1.1,
+    "xtick.minor.width": 1.1,
+    "ytick.major.width": 1.1,
+    "ytick.minor.width": 1.1,
+    "xtick.direction": "in",
+    "ytick.direction": "in",
+    "xtick.major.pad": 5.0,
+    "figure.figsize": [10.0, 4.5],
+}
+
+
+def extract(vis, fields, datacolumn="corrected", chunk_bytes=CHUNK_BYTES):
+    from casatools import table
+
+    tb = table()
+    tb.open(f"{vis}/FIELD")
+    names = list(tb.getcol("NAME"))
+    tb.close()
+    tb.open(f"{vis}/DATA_DESCRIPTION")
+    dd_spw = tb.getcol("SPECTRAL_WINDOW_ID")
+    dd_pol = tb.getcol("POLARIZATION_ID")
+    tb.close()
+    tb.open(f"{vis}/SPECTRAL_WINDOW")
+    chan_freqs = [tb.getcell("CHAN_FREQ", int(spw)) for spw in dd_spw]
+    tb.close()
+    tb.open(f"{vis}/POLARIZATION")
+    corr_types = [tb.getcell("CORR_TYPE", int(pol)) for pol in dd_pol]
+    tb.close()
+
+    diag = {"vis": vis, "fields": [], "spws": [], "freqs": [], "corrs": [], "amp": [], "phase": []}
+    field_ids = [names.index(f) for f in fields if f in names]
+    if len(field_ids) == 0:
+        logger.warning(f"None of {fields} are in {vis}, no diagnostics to make")
+        return diag
+    column = {"corrected": "CORRECTED_DATA", "data": "DATA", "model": "MODEL_DATA"}[datacolumn]
+    tb.open(vis)
+    # Each data description is its own shape, go through them one at a time, still only one read
+    for ddid in range(len(dd_spw)):
+        query = f"DATA_DESC_ID=={ddid} && ANTENNA1!=ANTENNA2 && FIELD_ID IN [{','.join(str(f) for f in field_ids)}]"
+        sel = tb.query(query)
+        nrow = sel.nrows()
+        if nrow == 0:
+            sel.close()
+            continue
+        nfield = len(field_ids)
+        ncorr, nchan = len(corr_types[ddid]), len(chan_freqs[ddid])
+        # complex64 rows of this data description that fit in chunk_bytes
+        chunk = max(1, int(chunk_bytes // (ncorr * nchan * 8)))
+        vsum = np.zeros((nfield, ncorr, nchan), dtype=complex)
+        count = np.zeros((nfield, ncorr, nchan))
+        for start in range(0, nrow, chunk):
+            n = min(chunk, nrow - start)
+            data = sel.getcol(column, startrow=start, nrow=n)
+            good = ~sel.getcol("FLAG", startrow=start, nrow=n)
+            fid = sel.getcol("FIELD_ID", startrow=start, nrow=n)
+            for i, f in enumerate(field_ids):
+                rows = fid == f
+                if not rows.any():
+                    continue
+                d = np.where(good[..., rows], data[..., rows], 0)
+                vsum[i] += d.sum(axis=-1)
+                count[i] += good[..., rows].sum(axis=-1)
+        sel.close()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            amp = np.abs(vsum / count)
+            phase = np.degrees(np.angle(vsum / count))
+        for i, f in enumerate(field_ids):
+            diag["fields"].append(names[f])
+            diag["spws"].append(int(dd_spw[ddid]))
+            diag["freqs"].append(np.asarray(chan_freqs[ddid]))
+            diag["corrs"].append([CORR_NAMES.get(int(c), str(c)) for c in corr_types[ddid]])
+            diag["amp"].append(amp[i])
+            diag["phase"].append(phase[i])
+    tb.close()
+    return diag
+
+
+def save_cache(diag, filename):
+    arrays = {"vis": diag["vis"], "fields": np.array(diag["fields"]), "spws": np.array(diag["spws"])}
+    for i in range(len(diag["fields"])):
+        arrays[f"freqs_{i}"] = diag["freqs"][i]
+        arrays[f"corrs_{i}"] = np.array(diag["corrs"][i])
+        arrays[f"amp_{i}"] = diag["amp"][i]
+        arrays[f"phase_{i}"] = diag["phase"][i]
+    np.savez_compressed(filename, **arrays)
+
+
+def load_cache(filename):
+    npz = np.load(filename)
+    diag = {"vis": str(npz["vis"]), "fields": list(npz["fields"]), "spws": list(npz["spws"])}
+    for key in ["freqs", "corrs", "amp", "phase"]:
+        diag[key] = [npz[f"{key}_{i}"] for i in range(len(diag["fields"]))]
+    diag["corrs"] = [list(c) for c in diag["corrs"]]
+    return diag
+
+
+def render(diag, prefix, suffix, correlations=("XX",), style=None):
+    # Draws {prefix}_{field}_amp{suffix}.png and {prefix}_{field}_phase{suffix}.png for each field,
+    # every spw of a field goes on the same axes. Uses Figure directly so it is safe off the main thread
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    matplotlib.rcParams.update(PLOT_STYLE)
+    style = {"marker": ".", "markersize": 2, "linestyle": "none"} if style is None else style
+    made = []
+    for field in sorted(set(diag["fields"])):
+        entries = [i for i, f in enumerate(diag["fields"]) if f == field]
+        for yaxis in ["amp", "phase"]:
+            fig = Figure(figsize=(10.0, 4.5))
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(111)
+            for i in entries:
+                for c, corr in enumerate(diag["corrs"][i]):
+                    if corr not in correlations:
+                        continue
+                    ax.plot(diag["freqs"][i] / 1e9, diag[yaxis][i][c], label=f"spw{diag['spws'][i]} {corr}", **style)
+            ax.set_xlabel("Frequency (GHz)")
+            ax.set_ylabel("Amplitude (Jy)" if yaxis == "amp" else "Phase (deg)")
+            ax.set_title(f"{field} {suffix}")
+            ax.legend(loc="best", fontsize=8)
+            fig.tight_layout()
+            plotfile = f"{prefix}_{field}_{yaxis}{suffix}.png"
+            fig.savefig(plotfile)
+            made.append(plotfile)
+    logger.debug(f"Made {made}")
+    return made
+
+
+def run_diagnostics(vis, fields, prefix, suffix, datacolumn="corrected", correlations=("XX",)):
+    # Reads the ms now, then hands the plotting to a thread and returns it straight away
+    diag = extract(vis, fields, datacolumn=datacolumn)
+    save_cache(diag, f"{prefix}_{suffix}.npz")
+    thread = threading.Thread(
+        target=render, args=(diag, prefix, suffix), kwargs={"correlations": correlations}, name=f"diagnostics_{suffix}"
+    )
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(
+        description="Redraw the calibration diagnostic plots from a cached npz, without touching the ms"
+    )
+    parser.add_argument("cache", type=str, help="npz written by run_diagnostics, e.g. {calfile}_postcal.npz")
+    parser.add_argument(
+        "--prefix",
+        type=str,
+        default=None,
+        help="Prefix of the plot names, default=the cache name up to the last _"
+    )
+    parser.add_argument(
+        "--suffix",
+        type=str,
+        default=None,
+        help="Suffix of the plot names, default=the cache name after the last _"
+    )
+    parser.add_argument(
+        "--corr",
+        type=str,
+        default="XX",
+        help="Comma separated correlations to plot, default=XX"
+    )
+    args = parser.parse_args()
+    base = os.path.splitext(args.cache)[0]
+    prefix = args.prefix if args.prefix is not None else base.rsplit("_", 1)[0]
+    suffix = args.suffix if args.suffix is not None else base.rsplit("_", 1)[1]
+    render(load_cache(args.cache), prefix, suffix, correlations=args.corr.split(","))
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# Declarative flagging plans run as list mode flagdata passes
+# A plan is a list of steps, each {"name": ..., "cmd": {flagdata parameters}}. Consecutive steps are
+# sent to flagdata together as one list so the ms is only read once for all of them, later agents in
+# a list already see the flags of the earlier ones. A step with "new_pass": True starts a new read,
+# use it when a step needs earlier flags written to disk first. {"checkpoint": name} saves a flag
+# version and always ends the current pass.
+# A summary agent goes in after every step so the flag percentage of each step comes back from the
+# same pass, these are kept in {vis}.flagreport.json
+
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cmd_string(cmd):
+    return " ".join(f"{key}={value!r}" for key, value in cmd.items())
+
+
+def split_passes(plan):
+    # Returns a list of (steps, checkpoint) where checkpoint is a flag version to save afterwards
+    passes = []
+    steps = []
+    for step in plan:
+        if "checkpoint" in step:
+            passes.append((steps, step["checkpoint"]))
+            steps = []
+            continue
+        if step.get("new_pass", False) and len(steps) > 0:
+            passes.append((steps, None))
+            steps = []
+        steps.append(step)
+    if len(steps) > 0:
+        passes.append((steps, None))
+    return passes
+
+
+def pass_commands(steps, field=""):
+    # Starts with a summary of what was already flagged, so the first step gets a percentage too
+    start = {"mode": "summary", "name": "start"}
+    if field != "":
+        start["field"] = field
+    cmds = [cmd_string(start)]
+    for step in steps:
+        cmd = dict(step["cmd"])
+        if field != "" and "field" not in cmd:
+            cmd["field"] = field
+        cmds.append(cmd_string(cmd))
+        summary = {"mode": "summary", "name": step["name"]}
+        if "field" in cmd:
+            summary["field"] = cmd["field"]
+        cmds.append(cmd_string(summary))
+    return cmds
+
+
+def step_percentages(steps, summary, before=None):
+    # Summaries are cumulative, so each step gets the extra percentage it flagged
+    reports = {}
+    if isinstance(summary, dict):
+        for value in summary.values():
+            if isinstance(value, dict) and "name" in value and "total" in value:
+                reports[value["name"]] = value
+    result = []
+    previous = before
+    if previous is None and "start" in reports and reports["start"]["total"] > 0:
+        previous = 100.0 * reports["start"]["flagged"] / reports["start"]["total"]
+    for step in steps:
+        rep = reports.get(step["name"])
+        if rep is None or rep["total"] == 0:
+            result.append({"step": step["name"], "flagged": None, "added": None})
+            continue
+        flagged = 100.0 * rep["flagged"] / rep["total"]
+        added = None if previous is None else flagged - previous
+        result.append({"step": step["name"], "flagged": flagged, "added": added})
+        previous = flagged
+    return result
+
+
+def report_name(vis):
+    return f"{vis.rstrip('/')}.flagreport.json"
+
+
+def save_report(vis, plan_name, report):
+    filename = report_name(vis)
+    reports = {}
+    if os.path.exists(filename):
+        try:
+            with open(filename, "r") as f:
+                reports = json.load(f)
+        except ValueError:
+            logger.warning(f"Couldn't read {filename}, starting a new flag report")
+    reports[plan_name] = report
+    with open(f"{filename}.tmp", "w") as f:
+        json.dump(reports, f, indent=2)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def load_report(vis):
+    filename = report_name(vis)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def run_plan(vis, plan, plan_name, field="", flagbackup=False):
+    from casatasks import flagdata, flagmanager
+
+    report = []
+    before = None
+    passes = split_passes(plan)
+    logger.debug(f"Running {plan_name} as {len(passes)} flagdata passes")
+    for steps, checkpoint in passes:
+        if len(steps) > 0:
+            logger.debug(f"Flagging {', '.join(s['name'] for s in steps)} in one pass")
+            summary = flagdata(
+                vis=vis,
+                mode="list",
+                inpfile=pass_commands(steps, field=field),
+                action="apply",
+                flagbackup=flagbackup,
+            )
+            percentages = step_percentages(steps, summary, before=before)
+            for p in percentages:
+                if p["flagged"] is not None:
+                    logger.info(f"{plan_name} {p['step']}: {p['flagged']:.2f}% flagged")
+                    before = p["flagged"]
+            report.extend(percentages)
+        if checkpoint is not None:
+            flagmanager(vis=vis, mode="save", versionname=checkpoint)
+    save_report(vis, plan_name, report)
+    return report
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# uvmodelfit helpers for measureflux_casa.py
+# Each fit is described by a job dict (vis, field, spw, scan, sourcepar, outfile, niter, tol) so the
+# day level and per scan fits can be fanned out over a pool of worker processes. Every worker imports
+# its own casa, results always come back in the same order as the jobs.
+# With tol set and a seed flux in sourcepar, uvmodelfit is run step iterations at a time (STEP by
+# default, every run pays for the task setup, the selection and a component list), each run starting
+# from where the last one got to, until the flux moves by less than tol (as a fraction) or niter
+# iterations are used. A fit seeded close to the answer stops after the first run. Without a seed
+# there is nothing to stop early from and the fit is a single run of niter. "niter_used" is the
+# iterations of the runs it took to get within tol of the final flux, casa doesn't report how many
+# iterations inside a run were needed. The component list of a fit is read with the one componentlist tool of the
+# process and deleted afterwards, unless the job has "keep_cl".
+
+import json
+import math
+import shutil
+import hashlib
+import logging
+import importlib
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Relative flux change a fit has converged at, and the most iterations it gets
+TOLERANCE = 1e-3
+MAX_NITER = 10
+# uvmodelfit iterations per run when stepping towards tol
+STEP = 5
+# Job keys a fit's result depends on
+INPUT_KEYS = ["field", "spw", "scan", "sourcepar", "niter", "tol", "step"]
+
+_cl = None
+
+
+def component_tool():
+    # One componentlist per process, reused for every fit it reads
+    global _cl
+    if _cl is None:
+        from casatools import componentlist
+
+        _cl = componentlist()
+    return _cl
+
+
+def read_component(clfile):
+    return read_fit(clfile)["flux"]["value"][0]
+
+
+def read_fit(clfile):
+    cl = component_tool()
+    cl.open(clfile)
+    try:
+        fit = cl.getcomponent(0)
+        fit["refdir"] = cl.getrefdir(0)
+    finally:
+        cl.close()
+    return fit
+
+
+def job_inputs(job, signature, fitter):
+    # Fingerprint of everything a fit's result depends on, signature is the msindex signature of the
+    # ms so a reflagged or recalibrated ms gets fitted again
+    key = {k: job.get(k) for k in INPUT_KEYS}
+    key["signature"] = signature
+    key["fitter"] = fitter if isinstance(fitter, str) else f"{fitter.__module__}:{fitter.__name__}"
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def phase_centre(vis, field):
+    from casatools import table
+
+    tb = table()
+    tb.open(f"{vis.rstrip('/')}/FIELD")
+    names = list(tb.getcol("NAME"))
+    phase_dir = tb.getcol("PHASE_DIR")
+    tb.close()
+    i = names.index(field) if field in names else int(field)
+    return float(phase_dir[0, 0, i]), float(phase_dir[1, 0, i])
+
+
+def fit_sourcepar(fit, centre):
+    # [flux, x offset, y offset] of a fitted component, offsets in arcsec as uvmodelfit takes them
+    ra, dec = fit["refdir"]["m0"]["value"], fit["refdir"]["m1"]["value"]
+    arcsec = math.degrees(1.0) * 3600.0
+    # Wrapped into [-pi, pi) so a source and centre either side of RA 0 aren't a whole turn apart
+    dra = (ra - centre[0] + math.pi) % (2 * math.pi) - math.pi
+    return [fit["flux"]["value"][0], dra * math.cos(centre[1]) * arcsec, (dec - centre[1]) * arcsec]
+
+
+def run_uvmodelfit(job, niter, sourcepar):
+    from casatasks import uvmodelfit
+
+    # uvmodelfit won't write over an existing component list
+    shutil.rmtree(job["outfile"], ignore_errors=True)
+    uvmodelfit(
+        vis=job["vis"],
+        niter=niter,
+        field=job["field"],
+        selectdata=True,
+        spw=job.get("spw", ""),
+        scan=job.get("scan", ""),
+        sourcepar=sourcepar,
+        outfile=job["outfile"],
+    )
+
+
+def fit_uv(job):
+    niter = job.get("niter", 10)
+    sourcepar = list(job.get("sourcepar") or [None, 0, 0])
+    seeded = sourcepar[0] is not None
+    if sourcepar[0] is None:
+        sourcepar[0] = 1
+    result = dict(job)
+    if job.get("tol") is None or seeded is False:
+        run_uvmodelfit(job, niter, sourcepar)
+        result["flux"] = read_component(job["outfile"])
+        result["niter_used"] = niter
+        remove_cl(job)
+        return result
+
+    step = max(job.get("step", STEP), 1)
+    used = 0
+    runs = []
+    while True:
+        n = min(step, niter - used)
+        run_uvmodelfit(job, n, sourcepar)
+        used += n
+        fit = read_fit(job["outfile"])
+        flux = fit["flux"]["value"][0]
+        change = abs(flux - sourcepar[0]) / abs(flux) if flux != 0 else math.inf
+        runs.append((used, flux))
+        if change < job["tol"] or used >= niter:
+            break
+        # Only a fit that is still moving needs the position to carry on from
+        sourcepar = fit_sourcepar(fit, phase_centre(job["vis"], job["field"]))
+    result["flux"] = flux
+    result["niter_used"] = next(n for n, f in runs if f == flux or (flux != 0 and abs(f - flux) / abs(flux) < job["tol"]))
+    remove_cl(job)
+    return result
+
+
+def remove_cl(job):
+    if job.get("keep_cl", False) is False:
+        shutil.rmtree(job["outfile"], ignore_errors=True)
+
+
+def get_fitter(fitter):
+    # Fitters can be given as "module:function" so a stubbed fitter can be picked up by the workers
+    if callable(fitter):
+        return fitter
+    module, func = fitter.split(":")
+    return getattr(importlib.import_module(module), func)
+
+
+def iter_fits(jobs, nproc=1, fitter=fit_uv):
+    # Yields the results in job order as they finish, so the caller can write them out as it goes
+    fitter = get_fitter(fitter)
+    if nproc <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield fitter(job)
+        return
+    logger.info(f"Fitting {len(jobs)} jobs on {nproc} workers")
+    # spawn so every worker gets a clean casa instance rather than a fork of ours
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=min(nproc, len(jobs))) as pool:
+        for result in pool.imap(fitter, jobs, chunksize=1):
+            yield result
+
+
+def fit_many(jobs, nproc=1, fitter=fit_uv):
+    return list(iter_fits(jobs, nproc=nproc, fitter=fitter))
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# Image geometry and memory budget for imgmfs_ms
+# The cell is a fraction of the synthesised beam at the top of the selected spws, from the longest
+# unflagged baseline actually in the data (so a flagged CA06 gives bigger cells), and the image
+# covers the primary beam FWHM at the bottom of the spws, rounded up to a size the FFT likes.
+# Before tclean runs its peak memory is estimated from the image size and nterms and checked
+# against a budget, by default the physical memory (or the address space limit batch_processing.py
+# sets with --mem_limit).
+
+import os
+import math
+import resource
+import logging
+import numpy as np
+
+from msindex import load_index
+from averaging import SPEED_OF_LIGHT, primary_beam_fwhm
+
+logger = logging.getLogger(__name__)
+
+# Pixels across the synthesised beam
+OVERSAMPLE = 4
+# tclean pads the uv grid by this much
+PADDING = 1.2
+# Memory of a casa session before any images exist
+BASE_MEMORY = 0.5 * 1024**3
+
+
+def field_query(vis, field):
+    from casatools import table
+
+    if field == "" or field.isdigit():
+        return "" if field == "" else f"FIELD_ID=={field}"
+    tb = table()
+    tb.open(f"{vis}/FIELD")
+    names = list(tb.getcol("NAME"))
+    tb.close()
+    ids = [str(names.index(f)) for f in field.split(",") if f in names]
+    if len(ids) == 0:
+        raise ValueError(f"{field} is not a field in {vis}")
+    return f"FIELD_ID IN [{','.join(ids)}]"
+
+
+def max_uv_distance(vis, field=""):
+    # Longest unflagged projected baseline of the field in metres, only UVW and FLAG_ROW are read
+    from casatools import table
+
+    query = " && ".join(q for q in [field_query(vis, field), "ANTENNA1!=ANTENNA2", "!FLAG_ROW"] if q != "")
+    tb = table()
+    tb.open(vis)
+    sel = tb.query(query, columns="UVW")
+    tb.close()
+    uvw = sel.getcol("UVW") if sel.nrows() > 0 else np.zeros((3, 0))
+    sel.close()
+    if uvw.shape[1] == 0:
+        return 0.0
+    return float(np.sqrt(uvw[0] ** 2 + uvw[1] ** 2).max())
+
+
+def next_fft_size(n):
+    # Smallest even size >= n with no prime factors above 5
+    n = max(int(math.ceil(n)), 2)
+    while True:
+        if n % 2 == 0:
+            m = n
+            for p in [2, 3, 5]:
+                while m % p == 0:
+                    m //= p
+            if m == 1:
+                return n
+        n += 1
+
+
+def spw_range(index, spw=""):
+    selected = [s for s in index["spws"] if spw == "" or str(s["spw"]) in spw.split(",")]
+    if len(selected) == 0:
+        selected = index["spws"]
+    return min(s["freq_min"] for s in selected), max(s["freq_max"] for s in selected)
+
+
+def image_geometry(vis, field="", spw="", oversample=OVERSAMPLE, fov_scale=1.0):
+    # Returns the cell in arcsec and imsize in pixels, with what they were worked out from
+    index = load_index(vis)
+    freq_min, freq_max = spw_range(index, spw)
+    bmax = max_uv_distance(vis, field)
+    if bmax == 0:
+        raise ValueError(f"No unflagged baselines for field {field} in {vis}")
+    beam = math.degrees(SPEED_OF_LIGHT / freq_max / bmax) * 3600.0
+    # Two significant figures is plenty and keeps the cell readable
+    cell = float(f"{beam / oversample:.2g}")
+    fov = math.degrees(primary_beam_fwhm(freq_min)) * 3600.0 * fov_scale
+    imsize = next_fft_size(fov / cell)
+    return {"cell_arcsec": cell, "imsize": imsize, "beam_arcsec": beam, "fov_arcmin": fov / 60.0, "longest_baseline_m": bmax}
+
+
+def estimate_memory(imsize, nterms=1):
+    # Peak bytes of an mfs tclean: float images (psf terms, residual, model, image, pb, weight per
+    # term) and a padded complex grid with its FFT copy for every psf term
+    nplanes = (2 * nterms - 1) + 5 * nterms
+    images = 4 * imsize**2 * nplanes
+    grids = 8 * (PADDING * imsize) ** 2 * 2 * (2 * nterms - 1)
+    return BASE_MEMORY + 1.2 * (images + grids)
+
+
+def available_memory():
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if soft != resource.RLIM_INFINITY:
+        total = min(total, soft)
+    return total
+
+
+def check_memory(imagename, imsize, nterms=1, budget=None):
+    # budget in GB, None is everything this process may use. Refuses anything over the budget
+    budget = available_memory() if budget is None else budget * 1024**3
+    need = estimate_memory(imsize, nterms)
+    msg = f"{imagename} ({imsize}x{imsize}, nterms={nterms}) needs about {need / 1024**3:.1f} GB of {budget / 1024**3:.1f} GB"
+    if need > budget:
+        raise MemoryError(f"{msg}, refusing to run tclean")
+    if need > 0.8 * budget:
+        logger.warning(msg)
+    else:
+        logger.info(msg)
+    return need
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# Single indexed store for the fluxes measured by measureflux_casa.py
+# Replaces the {source}_dict.json files, which had to be reread and rewritten for every scan.
+# Rows are keyed by source, band, day and scan timestamp (the listobs BeginTime). The day level fit
+# of a source is stored with an empty timestamp. niter is how many uvmodelfit iterations the fit
+# used, empty for fits that don't iterate. inputs is a fingerprint of what a scan fit was made from
+# (ms data, selection, starting flux and fit settings) so a rerun only refits the scans it changed for.
+# Scans imported from the old json files have an empty day, a fit of the same scan with its day
+# replaces that row rather than sitting next to it.
+
+import os
+import json
+import sqlite3
+import logging
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+COLUMNS = ["source", "band", "day", "timestamp", "scan", "flux", "flux_err", "niter", "inputs"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fluxes (
+    source TEXT NOT NULL,
+    band TEXT NOT NULL,
+    day TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    scan INTEGER,
+    flux REAL,
+    flux_err REAL,
+    niter INTEGER,
+    inputs TEXT,
+    PRIMARY KEY (source, band, day, timestamp)
+);
+CREATE INDEX IF NOT EXISTS fluxes_source ON fluxes (source, band, timestamp);
+"""
+
+
+def day_number(day):
+    # N of a dayN name, None for days named some other way
+    digits = day[len(day.rstrip("0123456789")):]
+    if digits == "":
+        return None
+    return int(digits)
+
+
+class LightcurveStore:
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.conn = sqlite3.connect(dbname)
+        self.conn.row_factory = sqlite3.Row
+        # WAL keeps readers going while a fit is appending and survives a crash mid write
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.conn.commit()
+
+    def migrate(self):
+        # Stores made before a column existed get it added, empty for the rows already there
+        have = [r["name"] for r in self.conn.execute("PRAGMA table_info(fluxes)")]
+        for col, kind in [("niter", "INTEGER"), ("inputs", "TEXT")]:
+            if col not in have:
+                self.conn.execute(f"ALTER TABLE fluxes ADD COLUMN {col} {kind}")
+                logger.info(f"Added the {col} column to {self.dbname}")
+        # Undated scans that were fit again with a day before append dropped them
+        cur = self.conn.execute(
+            "DELETE FROM fluxes WHERE day='' AND timestamp!='' AND EXISTS (SELECT 1 FROM fluxes AS dated "
+            "WHERE dated.source=fluxes.source AND dated.band=fluxes.band AND dated.timestamp=fluxes.timestamp AND dated.day!='')"
+        )
+        if cur.rowcount > 0:
+            logger.info(f"Dropped {cur.rowcount} undated scans of {self.dbname} that also have a dated row")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def append(self, records):
+        # records is a list of dicts with (a subset of) COLUMNS, written in one transaction.
+        # Refitting a scan replaces its old value, a dated scan also replaces the same scan with an
+        # empty day and an undated scan is left out when the dated one is already there
+        rows = []
+        for rec in records:
+            row = {col: rec.get(col) for col in COLUMNS}
+            if row["timestamp"] is None:
+                row["timestamp"] = ""
+            row["timestamp"] = str(row["timestamp"])
+            rows.append(row)
+        if len(rows) == 0:
+            return 0
+        cols = ", ".join(COLUMNS)
+        vals = ", ".join(f":{col}" for col in COLUMNS)
+        dated = [r for r in rows if r["day"] != "" or r["timestamp"] == ""]
+        undated = [r for r in rows if r["day"] == "" and r["timestamp"] != ""]
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM fluxes WHERE source=:source AND band=:band AND timestamp=:timestamp AND day='' AND timestamp!=''",
+                dated,
+            )
+            self.conn.executemany(f"INSERT OR REPLACE INTO fluxes ({cols}) VALUES ({vals})", dated)
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO fluxes ({cols}) SELECT {vals} WHERE NOT EXISTS (SELECT 1 FROM fluxes "
+                "WHERE source=:source AND band=:band AND timestamp=:timestamp AND day!='')",
+                undated,
+            )
+        logger.debug(f"Appended {len(rows)} fluxes to {self.dbname}")
+        return len(rows)
+
+    def day_flux(self, source, band, day):
+        row = self.conn.execute(
+            "SELECT flux FROM fluxes WHERE source=? AND band=? AND day=? AND timestamp=''",
+            (source, band, day),
+        ).fetchone()
+        if row is None:
+            return None
+        return row["flux"]
+
+    def latest_day_flux(self, source, band, day=None):
+        # Day level flux of the nearest day before day that has one, a starting point before day's own
+        # exists. Without an earlier one (or a day) it's the most recent day of the source instead
+        rows = self.conn.execute(
+            "SELECT day, flux FROM fluxes WHERE source=? AND band=? AND timestamp='' AND day!=''",
+            (source, band),
+        ).fetchall()
+        if len(rows) == 0:
+            return None
+        current = day_number(day) if day is not None else None
+        if current is not None:
+            earlier = [r for r in rows if day_number(r["day"]) is not None and day_number(r["day"]) < current]
+            if len(earlier) > 0:
+                rows = earlier
+        # Days are named dayN, so day10 is after day9
+        return max(rows, key=lambda r: (day_number(r["day"]) is not None, day_number(r["day"]) or 0, r["day"]))["flux"]
+
+    def scan_timestamps(self, source, band, day):
+        rows = self.conn.execute(
+            "SELECT timestamp FROM fluxes WHERE source=? AND band=? AND day=? AND timestamp!=''",
+            (source, band, day),
+        )
+        return set(r["timestamp"] for r in rows)
+
+    def scan_inputs(self, source, band, day):
+        # {timestamp: inputs} of the scans of a day already in the store
+        rows = self.conn.execute(
+            "SELECT timestamp, inputs FROM fluxes WHERE source=? AND band=? AND day=? AND timestamp!=''",
+            (source, band, day),
+        )
+        return {r["timestamp"]: r["inputs"] for r in rows}
+
+    def history(self, source, band=None, scans_only=True):
+        query = "SELECT * FROM fluxes WHERE source=?"
+        params = [source]
+        if band is not None:
+            query += " AND band=?"
+            params.append(band)
+        if scans_only is True:
+            query += " AND timestamp!=''"
+        query += " ORDER BY band, timestamp"
+        return [dict(r) for r in self.conn.execute(query, params)]
+
+    def sources(self):
+        return [r["source"] for r in self.conn.execute("SELECT DISTINCT source FROM fluxes ORDER BY source")]
+
+
+def import_json_dicts(store, datadir, sources):
+    # One time import of the old {source}_dict.json files, {band: {day or BeginTime: flux}}.
+    # The old files didn't record which day a scan came from, so those rows get an empty day until
+    # the scan is fit again with its day. Scans already in the store with a day aren't imported again
+    records = []
+    for src in sources:
+        dict_name = f"{datadir}/{src}_dict.json"
+        if not os.path.exists(dict_name):
+            continue
+        try:
+            with open(dict_name, "r") as f:
+                src_dict = json.load(f)
+        except ValueError:
+            logger.warning(f"Couldn't read {dict_name}, skipping it")
+            continue
+        for band, fluxes in src_dict.items():
+            for key, flux in fluxes.items():
+                if isinstance(flux, list):
+                    flux = flux[0]
+                if key.startswith("day"):
+                    records.append({"source": src, "band": band, "day": key, "timestamp": "", "flux": flux})
+                else:
+                    records.append({"source": src, "band": band, "day": "", "timestamp": key, "flux": flux})
+    store.append(records)
+    logger.info(f"Imported {len(records)} fluxes from the json dictionaries in {datadir}")
+    return len(records)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(
+        description="Import the old per source json flux dictionaries into the lightcurve store"
+    )
+    parser.add_argument(
+        "--datadir",
+        type=str,
+        default="/home/cira/ATCA/bin/data",
+        help="Directory with source_fluxesdict.json and the {source}_dict.json files"
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default=None,
+        help="Lightcurve store to write to, default={datadir}/lightcurves.db"
+    )
+    args = parser.parse_args()
+    dbname = args.db if args.db is not None else f"{args.datadir}/lightcurves.db"
+    with open(f"{args.datadir}/source_fluxesdict.json", "r") as f:
+        srcs = json.load(f)
+    with LightcurveStore(dbname) as store:
+        import_json_dicts(store, args.datadir, list(srcs.keys()))
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# Lightcurves and variability statistics of every source in the lightcurve store
+# All the scan fluxes of a band come out of the store in one query into flat numpy arrays sorted by
+# source and time, the listobs BeginTime keys (MJD) are converted with one astropy Time call, and
+# the per source statistics are worked out for every source at once with bincount/reduceat.
+#   modulation index     m = std / mean
+#   debiased variability V = sqrt(var - mean(err^2)) / mean, 0 where the scatter is all noise
+#   chi2                 against the error weighted mean, with its reduced value over n - 1
+# e.g. python lightcurves.py --db ./data/lightcurves.db --band c --stats c_stats.csv --plot c_lightcurves.png
+
+import sqlite3
+import logging
+import numpy as np
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAT_COLUMNS = ["source", "n", "mean", "std", "modulation_index", "debiased_variability", "chi2", "reduced_chi2"]
+
+
+def to_time(timestamps):
+    # Timestamps are stored as text, normally MJD from listobs but pointfit time bins or old json
+    # keys can be dates. One Time call either way
+    from astropy.time import Time
+
+    timestamps = np.asarray(timestamps, dtype=str)
+    try:
+        return Time(timestamps.astype(float), format="mjd")
+    except ValueError:
+        return Time(timestamps)
+
+
+def load_table(dbname, band, sources=None):
+    # {"source": names, "index": source number of each row, "start": first row of each source,
+    #  "time": astropy Time, "mjd", "flux", "flux_err"} with the rows sorted by source then time
+    conn = sqlite3.connect(dbname)
+    query = "SELECT source, timestamp, flux, flux_err FROM fluxes WHERE band=? AND timestamp!='' AND flux IS NOT NULL"
+    rows = conn.execute(query, (band,)).fetchall()
+    conn.close()
+    if sources is not None:
+        wanted = set(sources)
+        rows = [r for r in rows if r[0] in wanted]
+    if len(rows) == 0:
+        raise ValueError(f"No {band} band scan fluxes in {dbname}")
+
+    source, timestamp, flux, flux_err = zip(*rows)
+    names, index = np.unique(np.asarray(source, dtype=str), return_inverse=True)
+    time = to_time(timestamp)
+    mjd = time.mjd
+    flux = np.asarray(flux, dtype=float)
+    flux_err = np.array([np.nan if e is None else e for e in flux_err], dtype=float)
+
+    order = np.lexsort((mjd, index))
+    index = index[order]
+    start = np.searchsorted(index, np.arange(len(names)))
+    logger.info(f"Loaded {len(order)} {band} band fluxes of {len(names)} sources from {dbname}")
+    return {
+        "band": band,
+        "source": names,
+        "index": index,
+        "start": start,
+        "time": time[order],
+        "mjd": mjd[order],
+        "flux": flux[order],
+        "flux_err": flux_err[order],
+    }
+
+
+def source_stats(table):
+    # Per source statistics as arrays over table["source"]. chi2 only uses the rows with an
+    # uncertainty and is nan for sources that have none
+    index, flux, err = table["index"], table["flux"], table["flux_err"]
+    nsrc = len(table["source"])
+
+    n = np.bincount(index, minlength=nsrc).astype(float)
+    mean = np.bincount(index, weights=flux, minlength=nsrc) / n
+    resid = flux - mean[index]
+    var = np.bincount(index, weights=resid**2, minlength=nsrc) / n
+    std = np.sqrt(var)
+
+    has_err = np.isfinite(err) & (err > 0)
+    n_err = np.bincount(index, weights=has_err, minlength=nsrc)
+    weight = np.where(has_err, 1.0 / np.where(has_err, err, 1.0) ** 2, 0.0)
+    err2 = np.where(has_err, err, 0.0) ** 2
+    noise = np.bincount(index, weights=err2, minlength=nsrc) / np.maximum(n_err, 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        modulation = std / mean
+        debiased = np.sqrt(np.clip(var - noise, 0, None)) / mean
+        wmean = np.bincount(index, weights=weight * flux, minlength=nsrc) / np.bincount(index, weights=weight, minlength=nsrc)
+        chi2 = np.bincount(index, weights=np.where(has_err, weight * (flux - wmean[index]) ** 2, 0.0), minlength=nsrc)
+        chi2 = np.where(n_err > 0, chi2, np.nan)
+        reduced = np.where(n_err > 1, chi2 / (n_err - 1), np.nan)
+    return {
+        "source": table["source"],
+        "n": n.astype(int),
+        "mean": mean,
+        "std": std,
+        "modulation_index": modulation,
+        "debiased_variability": debiased,
+        "chi2": chi2,
+        "reduced_chi2": reduced,
+    }
+
+
+def write_stats(stats, filename):
+    with open(filename, "w") as f:
+        f.write(",".join(STAT_COLUMNS) + "\n")
+        for i, src in enumerate(stats["source"]):
+            values = [f"{stats[col][i]:.6g}" for col in STAT_COLUMNS[2:]]
+            f.write(f"{src},{stats['n'][i]}," + ",".join(values) + "\n")
+    return
+
+
+def plot_lightcurves(table, outfile, sources=None, ncols=4, panel=(4.0, 2.5)):
+    # One panel per source on a single figure, sources default to every source in the table
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    names = list(table["source"])
+    selected = names if sources is None else [s for s in sources if s in names]
+    if len(selected) == 0:
+        raise ValueError("None of the sources to plot are in the table")
+    nrows = int(np.ceil(len(selected) / ncols))
+    fig = Figure(figsize=(panel[0] * ncols, panel[1] * nrows))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows, ncols, sharex=True, squeeze=False).ravel()
+    # Each source's rows are one contiguous slice of the sorted table
+    end = np.append(table["start"][1:], len(table["index"]))
+    t0 = np.floor(table["mjd"].min())
+    for ax, src in zip(axes, selected):
+        i = names.index(src)
+        rows = slice(table["start"][i], end[i])
+        ax.errorbar(
+            table["mjd"][rows] - t0,
+            table["flux"][rows],
+            yerr=np.nan_to_num(table["flux_err"][rows]),
+            marker=".",
+            markersize=3,
+            linestyle="none",
+        )
+        ax.set_title(src, fontsize=9)
+    for ax in axes[len(selected):]:
+        ax.set_visible(False)
+    fig.supxlabel(f"MJD - {t0:.0f}")
+    fig.supylabel(f"{table['band']} band flux (Jy)")
+    fig.tight_layout()
+    fig.savefig(outfile)
+    logger.info(f"Plotted {len(selected)} lightcurves to {outfile}")
+    return outfile
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(description="Variability statistics and lightcurve plots of the sources in the lightcurve store")
+    parser.add_argument("--db", type=str, default="./data/lightcurves.db", help="Lightcurve store, default=./data/lightcurves.db")
+    parser.add_argument("--band", type=str, default="c", help="Band to use, default=c")
+    parser.add_argument("--stats", type=str, default=None, help="csv file to write the statistics of every source to")
+    parser.add_argument("--plot", type=str, default=None, help="png file to plot the lightcurves to")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=16,
+        help="Plot only the top sources by debiased variability, 0 plots all of them, default=16"
+    )
+    args = parser.parse_args()
+
+    table = load_table(args.db, args.band)
+    stats = source_stats(table)
+    if args.stats is not None:
+        write_stats(stats, args.stats)
+    order = np.argsort(-np.nan_to_num(stats["debiased_variability"]))
+    for i in order[:10]:
+        logger.info(
+            f"{stats['source'][i]}: n={stats['n'][i]} mean={stats['mean'][i]:.4g} Jy m={stats['modulation_index'][i]:.3f} "
+            f"V={stats['debiased_variability'][i]:.3f} chi2_r={stats['reduced_chi2'][i]:.2f}"
+        )
+    if args.plot is not None:
+        sources = None if args.top == 0 else [stats["source"][i] for i in order[:args.top]]
+        plot_lightcurves(table, args.plot, sources=sources)
@@ -1,100 +1,205 @@
 # Script to be run WITHIN CASA!
+import os
+import sys
+import json
+
 day = "day4"
 band="c"
-
-
-filename = open("/home/cira/ATCA/bin/data/source_fluxesdict.json", "r")
-srcs = json.load(filename)
-src_names = list(srcs.keys())
-
-
-if band == "c":
-    ms = f"c3487_{day}_cx.ms"
-    spw = "0"
-elif band == "x":
-    ms = f"c3487_{day}_cx.ms"
-    spw = "1"
-elif band == "l":
-    ms = f"c3487_{day}_l.ms"
-    spw = ""
-
-# TODO: add option to check if the band is there not just the file since it crashes for second freq atm
-for key in list(srcs.keys()):
-    try:
-        dict_file = open(f"/home/cira/ATCA/bin/data/{key}_dict.json", "r")
-        src_dict = json.load(dict_file)
-        if day in list(src_dict.keys()):
+bindir = "/home/cira/ATCA/bin"
+datadir = f"{bindir}/data"
+batch_size = 50
+# Number of worker processes for the fits, 1 runs them all here one after the other
+nproc = 1
+# "uvmodelfit" for the full casa fit of every scan, or "pointfit" to solve the flux of a point
+# source at the phase centre for every scan of a field from one read of the data
+method = "uvmodelfit"
+# Sub scan time bins in seconds for pointfit, None gives one flux per scan
+timebin = None
+# "module:function" doing a single fit, swap in a stub to run without casa
+fitter = "fluxfit:fit_uv"
+# uvmodelfit stops once the flux changes by less than this fraction (None always runs max_niter)
+tolerance = 1e-3
+max_niter = 10
+
+sys.path.append(bindir)
+from lightcurve_store import LightcurveStore, import_json_dicts
+from fluxfit import fit_many, iter_fits, job_inputs
+from msindex import load_index, data_signature
+
+
+def catalogue_flux(entry):
+    # source_fluxesdict.json entries are a flux or a {band: flux} dict
+    if isinstance(entry, dict):
+        entry = entry.get(band)
+    if isinstance(entry, list):
+        entry = entry[0] if len(entry) > 0 else None
+    return float(entry) if isinstance(entry, (int, float)) else None
+
+
+def seed_flux(store, key, catalogue=None):
+    # Starting flux for a fit, the day flux of the source in this band from the nearest day before
+    # this one (any day if there's none before) or failing that the catalogue flux. None when there's
+    # neither, the fit then runs all its iterations from 1 Jy
+    flux = store.latest_day_flux(key, band, day)
+    if flux is None and catalogue is not None:
+        flux = catalogue_flux(catalogue.get(key))
+    return flux
+
+
+def fit_days(store, ms, spw, src_names, catalogue=None):
+    # The day level fits of each source are independent, so do them all at once
+    fields = load_index(ms)["fields"]
+    jobs = []
+    for key in src_names:
+        if key not in fields:
+            print(f"{key} isn't in {ms}, skipping")
+            continue
+        if store.day_flux(key, band, day) is not None:
             print("Already has the flux for this day, moving on")
-        else: 
-            print("Couldn't find the file, refitting the day uv")
-            uvmodelfit(
-                vis=ms,
-                niter=10,
-                field=key,
-                selectdata=True,
-                spw="0",
-                outfile=f"{key}_{band}_{day}.cl"
-            )
-            src_dict = {f"{band}": {}}
-    except: 
-        print("Couldnt find the src dictionary file, making another one and fitting the uv")
-        uvmodelfit(
-            vis=ms,
-            niter=10,
-            field=key,
-            selectdata=True,
-            spw="0",
-            outfile=f"{key}_{band}_{day}.cl"
+            continue
+        print("Couldn't find the day flux, refitting the day uv")
+        jobs.append(
+            {
+                "vis": ms,
+                "niter": max_niter,
+                "tol": tolerance,
+                "field": key,
+                "spw": spw,
+                "sourcepar": [seed_flux(store, key, catalogue), 0, 0],
+                "outfile": f"{key}_{band}_{day}.cl",
+            }
         )
-        src_dict = {f"{band}": {}}
-
-
-    tbl = cl.open(f"{key}_{band}_{day}.cl")
-    fit = cl.getcomponent(0)
-    flux = fit["flux"]["value"][0]
-    src_dict[f"{band}"][f"{day}"] =  flux
-    # src_dict[f"{key}"][f"{band}"][f"{day}"] = [flux]
-
-
-    with open(f"/home/cira/ATCA/bin/data/{key}_dict.json", "w") as f: 
-        json.dump(src_dict,f)
-
-
-obsinfo = listobs(f"{ms}")
-info_keys = list(obsinfo.keys())
-for key in info_keys:
-    if key.startswith("scan"):
-        continue
-    else:
-        obsinfo.pop(key)
-
-for key in list(obsinfo.keys()):
-    fieldname = obsinfo[key]["0"]["FieldName"]
-    if fieldname in src_names:
-        timestamp = obsinfo[key]["0"]["BeginTime"]
-        scan = obsinfo[key]["0"]["scanId"]
-
-        dict_file = open(f"/home/cira/ATCA/bin/data/{fieldname}_dict.json", "r+")
-        src_dict = json.load(dict_file)
-
-        fitflux = src_dict[f"{band}"][f"{day}"]
-        uvmodelfit(
-            vis=ms,
-            niter=10,
-            field=fieldname,
-            selectdata=True,
-            spw=spw,
-            scan = f"{scan}",
-            sourcepar = [fitflux, 0, 0],
-            outfile=f"{fieldname}_{band}_{day}_{scan}.cl"
+    records = []
+    for fit in fit_many(jobs, nproc=nproc, fitter=fitter):
+        records.append({"source": fit["field"], "band": band, "day": day, "flux": fit["flux"], "niter": fit.get("niter_used")})
+    store.append(records)
+    report_iterations(records, "day")
+
+
+def fit_scans(store, ms, spw, src_names):
+    # Scans already in the store with the same inputs fingerprint are skipped, so a rerun after a
+    # crash or with another source only fits what's missing or changed
+    signature = data_signature(ms)
+    done = {}
+    skipped = 0
+    jobs = []
+    for info in load_index(ms)["scans"]:
+        fieldname = info["field"]
+        if fieldname in src_names:
+            timestamp = info["begin"]
+            scan = info["scan"]
+
+            fitflux = store.day_flux(fieldname, band, day)
+            if fitflux is None:
+                fitflux = seed_flux(store, fieldname)
+            job = {
+                "vis": ms,
+                "niter": max_niter,
+                "tol": tolerance,
+                "field": fieldname,
+                "spw": spw,
+                "scan": f"{scan}",
+                "sourcepar": [fitflux, 0, 0],
+                "outfile": f"{fieldname}_{band}_{day}_{scan}.cl",
+                "timestamp": timestamp,
+            }
+            job["inputs"] = job_inputs(job, signature, fitter)
+            if fieldname not in done:
+                done[fieldname] = store.scan_inputs(fieldname, band, day)
+            if done[fieldname].get(str(timestamp)) == job["inputs"]:
+                skipped += 1
+                continue
+            jobs.append(job)
+        else:
+            print("This is not a source I care about apparently!")
+    print(f"Fitting {len(jobs)} scans, {skipped} are already in the store")
+
+    # Results come back in scan order, write them in batches so a crash only loses the last few scans
+    jobs = sorted(jobs, key=lambda job: int(job["scan"]))
+    records = []
+    niters = []
+    for fit in iter_fits(jobs, nproc=nproc, fitter=fitter):
+        records.append(
+            {
+                "source": fit["field"],
+                "band": band,
+                "day": day,
+                "timestamp": fit["timestamp"],
+                "scan": int(fit["scan"]),
+                "flux": fit["flux"],
+                "niter": fit.get("niter_used"),
+                "inputs": fit["inputs"],
+            }
         )
-
-        tbl = cl.open(f"{fieldname}_{band}_{day}_{scan}.cl")
-        fit = cl.getcomponent(0)
-        flux = fit["flux"]["value"][0]
-        src_dict[f"{band}"][f"{timestamp}"] =  flux
-
-        with open(f"/home/cira/ATCA/bin/data/{fieldname}_dict.json", "w") as f: 
-            json.dump(src_dict,f)
-    else: 
-        print("This is not a source I care about apparently!")
\ No newline at end of file
+        niters.append(fit.get("niter_used"))
+        if len(records) >= batch_size:
+            store.append(records)
+            records = []
+    store.append(records)
+    report_iterations([{"niter": n} for n in niters], "scan")
+
+
+def report_iterations(records, kind):
+    niters = [r["niter"] for r in records if r.get("niter") is not None]
+    if len(niters) > 0:
+        print(f"{len(niters)} {kind} fits used {sum(niters) / len(niters):.1f} uvmodelfit iterations on average (at most {max(niters)})")
+
+
+def fit_points(store, ms, spw, src_names):
+    # One read per field gives the day flux and every scan flux, with uncertainties
+    index = load_index(ms)
+    begin = {info["scan"]: info["begin"] for info in index["scans"]}
+    jobs = [{"vis": ms, "field": key, "spw": spw, "timebin": timebin} for key in src_names if key in index["fields"]]
+    for fit in iter_fits(jobs, nproc=nproc, fitter="pointfit:fit_field_job"):
+        records = []
+        if store.day_flux(fit["field"], band, day) is None:
+            records.append(
+                {"source": fit["field"], "band": band, "day": day, "flux": fit["flux"], "flux_err": fit["flux_err"]}
+            )
+        for s in fit["scans"]:
+            # Keep the listobs scan start as the key so both fitters write to the same rows
+            timestamp = begin.get(s["scan"], s["timestamp"]) if timebin is None else s["timestamp"]
+            records.append(
+                {
+                    "source": fit["field"],
+                    "band": band,
+                    "day": day,
+                    "timestamp": timestamp,
+                    "scan": s["scan"],
+                    "flux": s["flux"],
+                    "flux_err": s["flux_err"],
+                }
+            )
+        store.append(records)
+
+
+if __name__ == "__main__":
+    filename = open(f"{datadir}/source_fluxesdict.json", "r")
+    srcs = json.load(filename)
+    src_names = list(srcs.keys())
+
+    # All fluxes live in one store now, the first time through pull in the old json dictionaries
+    dbname = f"{datadir}/lightcurves.db"
+    new_store = not os.path.exists(dbname)
+    store = LightcurveStore(dbname)
+    if new_store:
+        import_json_dicts(store, datadir, src_names)
+
+
+    if band == "c":
+        ms = f"c3487_{day}_cx.ms"
+        spw = "0"
+    elif band == "x":
+        ms = f"c3487_{day}_cx.ms"
+        spw = "1"
+    elif band == "l":
+        ms = f"c3487_{day}_l.ms"
+        spw = ""
+
+    # TODO: add option to check if the band is there not just the file since it crashes for second freq atm
+    if method == "pointfit":
+        fit_points(store, ms, spw, src_names)
+    else:
+        fit_days(store, ms, spw, src_names, catalogue=srcs)
+        fit_scans(store, ms, spw, src_names)
+    store.close()
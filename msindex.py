@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# Small metadata index of a measurement set: fields, scans, times, spws, antennas and row counts
+# Built once from a single listobs (so scan BeginTimes match what measureflux_casa.py always used)
+# and msmetadata call, then saved as a {vis}.index.json sidecar. The sidecar is rebuilt whenever the
+# main table or the FIELD/SPECTRAL_WINDOW/ANTENNA subtables change on disk, of the ms itself and, for
+# a multi-ms (e.g. the virtualconcat of the parallel import parts), of every sub-ms under SUBMSS.
+
+import os
+import json
+from glob import glob
+import logging
+
+logger = logging.getLogger(__name__)
+
+WATCHED = ["table.dat", "FIELD/table.dat", "SPECTRAL_WINDOW/table.dat", "ANTENNA/table.dat"]
+
+
+def index_name(vis):
+    return f"{vis.rstrip('/')}.index.json"
+
+
+def submss(vis):
+    # Sub-ms of a multi-ms, relative to vis. They may be links to the parts, os.stat follows them
+    return [os.path.relpath(p, vis) for p in sorted(glob(os.path.join(vis, "SUBMSS", "*")))]
+
+
+def signature(vis):
+    sig = {}
+    for sub in [""] + submss(vis):
+        for name in WATCHED:
+            path = os.path.join(vis, sub, name)
+            if os.path.exists(path):
+                st = os.stat(path)
+                sig[os.path.join(sub, name)] = [st.st_size, st.st_mtime_ns]
+    return sig
+
+
+def data_signature(vis):
+    # signature plus the column files of the main table, so it changes when the data or flags do
+    sig = signature(vis)
+    for sub in [""] + submss(vis):
+        for path in sorted(glob(os.path.join(vis, sub, "table.f*"))):
+            st = os.stat(path)
+            sig[os.path.join(sub, os.path.basename(path))] = [st.st_size, st.st_mtime_ns]
+    return sig
+
+
+def build_index(vis):
+    from casatasks import listobs
+    from casatools import msmetadata
+
+    obsinfo = listobs(vis=vis)
+    scans = []
+    for key, value in obsinfo.items():
+        if not key.startswith("scan"):
+            continue
+        # A scan has one entry per sub scan, the first one has the start of the scan
+        subscans = [value[k] for k in sorted(value.keys(), key=int)]
+        first = subscans[0]
+        scans.append(
+            {
+                "scan": int(first["scanId"]),
+                "field": first["FieldName"],
+                "field_id": int(first["FieldId"]),
+                "begin": first["BeginTime"],
+                "end": max(s["EndTime"] for s in subscans),
+                "spws": sorted({int(spw) for s in subscans for spw in s["SpwIds"]}),
+                "nrows": int(sum(s["nRow"] for s in subscans)),
+                "integration": float(first.get("IntegrationTime", 0.0)),
+            }
+        )
+    scans = sorted(scans, key=lambda s: s["scan"])
+
+    msmd = msmetadata()
+    msmd.open(vis)
+    spws = []
+    for i in range(msmd.nspw()):
+        freqs = msmd.chanfreqs(i)
+        spws.append(
+            {
+                "spw": i,
+                "nchan": int(msmd.nchan(i)),
+                "freq_min": float(min(freqs)),
+                "freq_max": float(max(freqs)),
+                "chan_width": float(abs(msmd.chanwidths(i)[0])),
+            }
+        )
+    antennas = list(msmd.antennanames())
+    fieldnames = list(msmd.fieldnames())
+    nrows = int(msmd.nrows())
+    msmd.close()
+
+    fields = {}
+    for i, name in enumerate(fieldnames):
+        fields[name] = {"field_id": i, "scans": [s["scan"] for s in scans if s["field"] == name]}
+    return {
+        "vis": vis,
+        "signature": signature(vis),
+        "fields": fields,
+        "scans": scans,
+        "spws": spws,
+        "antennas": antennas,
+        "nrows": nrows,
+    }
+
+
+def save_index(index, filename):
+    # Per process temp file, concurrent workers (e.g. the cx imaging) can rebuild the same index
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, filename)
+
+
+def load_index(vis, rebuild=False):
+    filename = index_name(vis)
+    if rebuild is False and os.path.exists(filename):
+        try:
+            with open(filename, "r") as f:
+                index = json.load(f)
+            if index["signature"] == signature(vis):
+                return index
+            logger.debug(f"{vis} has changed since it was indexed, rebuilding")
+        except (ValueError, KeyError):
+            logger.warning(f"Couldn't read {filename}, rebuilding it")
+    logger.debug(f"Indexing {vis}")
+    index = build_index(vis)
+    save_index(index, filename)
+    return index
+
+
+def field_scans(index, field):
+    return [s for s in index["scans"] if s["field"] == field]
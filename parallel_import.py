@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# Parallel RPFITS import for make_ms
+# Every RPFITS file is imported to its own ms under {visname}.parts/ by a pool of workers, then the
+# pieces are joined with virtualconcat into a multi-ms at visname. The pieces are handed to
+# virtualconcat as symlinks, so the join moves links rather than copying any data and the parts
+# stay where they are. A manifest of file sizes and mtimes means a rerun only imports files that
+# are new or have changed since the last time, and the time each part was imported tells
+# processing.py when a part was reimported under an existing multi-ms.
+# Since the multi-ms links to the parts, flagging and applycal on it write into the parts. Each part
+# saves its flags as they came out of importatca and gets them back before every join, so a rebuilt
+# multi-ms never starts from the previous run's flags.
+
+import os
+import json
+import time
+import shutil
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Flag version every part saves right after importatca
+IMPORT_VERSION = "imported"
+
+
+def parts_dir(visname):
+    return f"{visname.rstrip('/')}.parts"
+
+
+def part_name(visname, rpfits):
+    return os.path.join(parts_dir(visname), f"{os.path.basename(rpfits)}.ms")
+
+
+def file_stats(rpfits):
+    return [os.path.getsize(rpfits), os.path.getmtime(rpfits)]
+
+
+def load_manifest(visname):
+    filename = os.path.join(parts_dir(visname), "manifest.json")
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning(f"Couldn't read {filename}, reimporting every file")
+        return {}
+
+
+def save_manifest(visname, manifest):
+    filename = os.path.join(parts_dir(visname), "manifest.json")
+    with open(f"{filename}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def import_part(job):
+    from casatasks import importatca, flagmanager
+
+    for name in [job["part"], f"{job['part']}.flagversions"]:
+        if os.path.exists(name):
+            shutil.rmtree(name)
+    importatca(vis=job["part"], files=[job["file"]], options=job["options"], edge=job["edge"])
+    if os.path.exists(job["part"]):
+        flagmanager(vis=job["part"], mode="save", versionname=IMPORT_VERSION)
+    return job
+
+
+def has_import_version(part):
+    return os.path.exists(os.path.join(f"{part.rstrip('/')}.flagversions", f"flags.{IMPORT_VERSION}"))
+
+
+def restore_import_flags(part):
+    # Puts back the flags importatca left in part, undoing whatever was flagged through the multi-ms
+    from casatasks import flagmanager
+
+    if not has_import_version(part):
+        logger.warning(f"{part} has no {IMPORT_VERSION} flag version, its flags may not be the imported ones")
+        return
+    flagmanager(vis=part, mode="restore", versionname=IMPORT_VERSION)
+    return
+
+
+def stale_files(files, visname):
+    # Files that aren't imported yet, changed since they were, or whose part has gone missing
+    manifest = load_manifest(visname)
+    stale = []
+    for f in files:
+        entry = manifest.get(os.path.basename(f))
+        if entry is None or entry["stats"] != file_stats(f) or not os.path.exists(entry["part"]):
+            stale.append(f)
+    return stale
+
+
+def import_parts(files, visname, nproc=4, options="birdie,noac", edge=4):
+    os.makedirs(parts_dir(visname), exist_ok=True)
+    manifest = load_manifest(visname)
+    todo = stale_files(files, visname)
+    logger.info(f"Importing {len(todo)} of {len(files)} RPFITS files on {nproc} workers")
+    jobs = [{"file": f, "part": part_name(visname, f), "options": options, "edge": edge} for f in todo]
+    if nproc <= 1 or len(jobs) <= 1:
+        done = [import_part(job) for job in jobs]
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=min(nproc, len(jobs))) as pool:
+            done = pool.map(import_part, jobs, chunksize=1)
+    for job in done:
+        if os.path.exists(job["part"]):
+            manifest[os.path.basename(job["file"])] = {
+                "stats": file_stats(job["file"]),
+                "part": job["part"],
+                "imported": time.time(),
+            }
+        else:
+            logger.warning(f"importatca didn't make {job['part']} from {job['file']}")
+        save_manifest(visname, manifest)
+    return [manifest[os.path.basename(f)]["part"] for f in files if os.path.basename(f) in manifest]
+
+
+def join_parts(parts, visname):
+    from casatasks import virtualconcat
+
+    # Links to the parts go into the multi-ms, removing visname later only removes the links
+    if os.path.islink(visname) or os.path.isfile(visname):
+        os.remove(visname)
+    elif os.path.exists(visname):
+        shutil.rmtree(visname)
+    for part in parts:
+        restore_import_flags(part)
+    linkdir = os.path.join(parts_dir(visname), "links")
+    if os.path.exists(linkdir):
+        shutil.rmtree(linkdir)
+    os.makedirs(linkdir)
+    links = []
+    for part in parts:
+        link = os.path.join(linkdir, os.path.basename(part))
+        os.symlink(os.path.abspath(part), link)
+        links.append(link)
+    if len(links) == 1:
+        os.symlink(os.path.abspath(parts[0]), visname)
+    else:
+        virtualconcat(vis=links, concatvis=visname, copypointing=True, keepcopy=False)
+    shutil.rmtree(linkdir, ignore_errors=True)
+    return
+
+
+def make_ms_parallel(files, visname, nproc=4, options="birdie,noac", edge=4):
+    parts = import_parts(sorted(files), visname, nproc=nproc, options=options, edge=edge)
+    if len(parts) == 0:
+        logger.warning(f"No RPFITS files could be imported for {visname}")
+        return
+    join_parts(parts, visname)
+    return
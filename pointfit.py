@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# Vectorised point source flux fitter, an alternative to uvmodelfit for lightcurves
+# For a point source at the phase centre every visibility is just the Stokes I flux, so the weighted
+# least squares solution is the weighted mean of the real part of (XX+YY)/2. The visibilities of a
+# field are read once in row chunks, reduced to per row sums and then every scan (or sub scan time
+# bin) is solved at the same time with np.bincount.
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bytes of visibilities read per chunk, the flags, weights and row_sums temporaries come on top
+CHUNK_BYTES = 256 * 1024**2
+
+
+def row_sums(data, flag, weight):
+    # data, flag are (ncorr, nchan, nrow) and weight is (ncorr, nrow) or (ncorr, nchan, nrow).
+    # Only the parallel hands (first and last correlation) go into Stokes I
+    pols = [0, data.shape[0] - 1] if data.shape[0] > 1 else [0]
+    data = data[pols]
+    flag = flag[pols]
+    weight = weight[pols]
+    if weight.ndim == 2:
+        weight = np.broadcast_to(weight[:, None, :], data.shape)
+    w = np.where(flag, 0.0, weight)
+    re = data.real
+    sw = w.sum(axis=(0, 1))
+    swx = (w * re).sum(axis=(0, 1))
+    swxx = (w * re * re).sum(axis=(0, 1))
+    n = (~flag).sum(axis=(0, 1))
+    return sw, swx, swxx, n
+
+
+def solve_groups(groups, sw, swx, swxx, n, ngroups=None):
+    # groups is an integer index per row, returns flux, flux_err and the number of visibilities
+    if ngroups is None:
+        ngroups = int(groups.max()) + 1 if len(groups) > 0 else 0
+    SW = np.bincount(groups, weights=sw, minlength=ngroups)
+    SWX = np.bincount(groups, weights=swx, minlength=ngroups)
+    SWXX = np.bincount(groups, weights=swxx, minlength=ngroups)
+    N = np.bincount(groups, weights=n, minlength=ngroups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        flux = SWX / SW
+        # Error from the scatter of the visibilities, so it doesn't depend on the weights being
+        # properly calibrated
+        var = np.clip(SWXX / SW - flux**2, 0, None)
+        flux_err = np.sqrt(var / (N - 1))
+    flux[SW == 0] = np.nan
+    flux_err[N <= 1] = np.nan
+    return flux, flux_err, N
+
+
+def group_index(scan, time=None, timebin=None):
+    # One group per scan, or per scan and timebin (seconds) when sub scan fluxes are wanted
+    if timebin is None:
+        keys = np.stack([scan], axis=1)
+    else:
+        uscan, sinv = np.unique(scan, return_inverse=True)
+        start = np.full(len(uscan), np.inf)
+        np.minimum.at(start, sinv, time)
+        tbin = np.floor((time - start[sinv]) / timebin).astype(int)
+        keys = np.stack([scan, tbin], axis=1)
+    uniq, groups = np.unique(keys, axis=0, return_inverse=True)
+    return uniq, groups.reshape(-1)
+
+
+def fit_point_source(data, flag, weight, scan, time=None, timebin=None):
+    # In memory version for visibilities that have already been read
+    uniq, groups = group_index(scan, time, timebin)
+    flux, flux_err, nvis = solve_groups(groups, *row_sums(data, flag, weight), ngroups=len(uniq))
+    return uniq, flux, flux_err, nvis
+
+
+def field_rows(vis, field, spw=""):
+    # TaQL selection of the cross correlations of a field (and spws) in the main table
+    from casatools import table
+
+    tb = table()
+    tb.open(f"{vis}/FIELD")
+    names = list(tb.getcol("NAME"))
+    tb.close()
+    if field not in names:
+        raise ValueError(f"{field} is not a field in {vis}")
+    query = f"FIELD_ID=={names.index(field)} && ANTENNA1!=ANTENNA2"
+    if spw != "":
+        tb.open(f"{vis}/DATA_DESCRIPTION")
+        spw_ids = list(tb.getcol("SPECTRAL_WINDOW_ID"))
+        tb.close()
+        ddids = [i for i, s in enumerate(spw_ids) if str(s) in spw.split(",")]
+        query += f" && DATA_DESC_ID IN [{','.join(str(d) for d in ddids)}]"
+    return query
+
+
+def chunk_rows(sel, column, chunk_bytes=CHUNK_BYTES):
+    # Rows per chunk so the complex64 visibilities of a chunk take about chunk_bytes
+    if sel.nrows() == 0:
+        return 1
+    ncorr, nchan = sel.getcell(column, 0).shape
+    return max(1, int(chunk_bytes // (ncorr * nchan * 8)))
+
+
+def read_field(vis, field, spw="", datacolumn="corrected", chunk_bytes=CHUNK_BYTES):
+    # Streams through every row of the field once, keeping only the per row sums
+    from casatools import table
+
+    tb = table()
+    tb.open(vis)
+    column = "CORRECTED_DATA" if datacolumn == "corrected" and "CORRECTED_DATA" in tb.colnames() else "DATA"
+    wcol = "WEIGHT_SPECTRUM" if "WEIGHT_SPECTRUM" in tb.colnames() else "WEIGHT"
+    sel = tb.query(field_rows(vis, field, spw))
+    tb.close()
+    nrow = sel.nrows()
+    chunk = chunk_rows(sel, column, chunk_bytes)
+    scan, time, sums = [], [], []
+    for start in range(0, nrow, chunk):
+        n = min(chunk, nrow - start)
+        data = sel.getcol(column, startrow=start, nrow=n)
+        flag = sel.getcol("FLAG", startrow=start, nrow=n)
+        weight = sel.getcol(wcol, startrow=start, nrow=n)
+        sums.append(row_sums(data, flag, weight))
+        scan.append(sel.getcol("SCAN_NUMBER", startrow=start, nrow=n))
+        time.append(sel.getcol("TIME", startrow=start, nrow=n))
+    sel.close()
+    if nrow == 0:
+        logger.warning(f"No rows for {field} in {vis}")
+        return np.zeros(0, int), np.zeros(0), [np.zeros(0)] * 4
+    sums = [np.concatenate([s[i] for s in sums]) for i in range(4)]
+    return np.concatenate(scan), np.concatenate(time), sums
+
+
+def fit_field(vis, field, spw="", datacolumn="corrected", timebin=None):
+    # Fits the whole field (the day flux) and every scan/time bin from a single read.
+    # Times are returned as MJD (days) to match the listobs BeginTime
+    scan, time, sums = read_field(vis, field, spw=spw, datacolumn=datacolumn)
+    allrows = np.zeros(len(scan), dtype=int)
+    day_flux, day_err, day_n = solve_groups(allrows, *sums, ngroups=1)
+    uniq, groups = group_index(scan, time, timebin)
+    flux, flux_err, nvis = solve_groups(groups, *sums, ngroups=len(uniq))
+    begin = np.full(len(uniq), np.inf)
+    np.minimum.at(begin, groups, time)
+    scans = []
+    for i, key in enumerate(uniq):
+        scans.append(
+            {
+                "scan": int(key[0]),
+                "timestamp": begin[i] / 86400.0,
+                "flux": float(flux[i]),
+                "flux_err": float(flux_err[i]),
+                "nvis": int(nvis[i]),
+            }
+        )
+    return {"field": field, "flux": float(day_flux[0]), "flux_err": float(day_err[0]), "scans": scans}
+
+
+def fit_field_job(job):
+    # Job dict version of fit_field for fluxfit.iter_fits
+    try:
+        result = fit_field(job["vis"], job["field"], spw=job.get("spw", ""), timebin=job.get("timebin"))
+    except ValueError as e:
+        logger.warning(f"{e}")
+        result = {"field": job["field"], "flux": np.nan, "flux_err": np.nan, "scans": []}
+    result.update({k: v for k, v in job.items() if k not in result})
+    return result
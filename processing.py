@@ -3,11 +3,10 @@
 # Updated from B. Quici script By K.Ross 19/5/21
 
 import os
-from astropy.io import fits 
-import astropy.units as u 
-from astropy.table import Table 
-from matplotlib import rcParams
-from casatasks import (
+import sys
+import shutil
+from glob import glob
+from casafacade import (
     flagmanager,
     flagdata,
     importatca,
@@ -22,142 +21,191 @@ from casatasks import (
     rmtables,
     impbcor,
     split,
+    partition,
     uvmodelfit,
     exportfits,
 )
-import numpy as np
-from casaplotms import plotms
-import matplotlib.pyplot as plt
-from casatools import image as IA
 import logging 
+import multiprocessing
 from argparse import ArgumentParser
 import datetime 
+from stagecache import StageCache
+from msindex import load_index, save_index
+from flagplan import run_plan
+from diagnostics import run_diagnostics
+from profiling import RunProfile, dir_size
+from parallel_import import make_ms_parallel, parts_dir, load_manifest
+from callibrary import CalLibrary, provenance_name
+from averaging import choose_averaging, save_averaging
+from selfcal import run_selfcal, log_name
+from virtualmodel import drop_model_column, check_models, model_column_bytes
+from applyplan import APPLY_TABLES, apply_plan, callib_name, run_apply
+from imagegeom import image_geometry, check_memory, available_memory
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
 logger.setLevel(logging.INFO)
 
 
-rcParams['font.family'] = 'serif'
-s, dt, axlab = 8, 1.1, 12.
-plt.rcParams["xtick.major.size"] = s
-plt.rcParams["xtick.minor.size"] = s
-plt.rcParams["ytick.major.size"] = s
-plt.rcParams["ytick.minor.size"] = s
-plt.rcParams["xtick.major.width"] = dt
-plt.rcParams["xtick.minor.width"] = dt
-plt.rcParams["ytick.major.width"] = dt
-plt.rcParams["ytick.minor.width"] = dt
-plt.rcParams["xtick.direction"] = 'in'
-plt.rcParams["ytick.direction"] = 'in'
-plt.rcParams["xtick.major.pad"] = 5.
-plt.rcParams["figure.figsize"] = [10., 4.5]
-
-def make_ms(files, visname):
+def log_setup():
+    # Only the entry points set up the logging. The spawned workers don't run __main__, so they call
+    # this themselves
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+
+
+def make_ms(files, visname, nproc=1):
     try:
-        importatca(
-            vis=visname, files=files, options="birdie,noac", edge=4
-        )
+        if nproc > 1:
+            # One ms per RPFITS file imported in parallel, then joined with a virtual concat
+            make_ms_parallel(files, visname, nproc=nproc, options="birdie,noac", edge=4)
+        else:
+            importatca(
+                vis=visname, files=files, options="birdie,noac", edge=4
+            )
     except:
         logger.warning(f"Unable to read in ATCA data??? Something wrong... ")
     return 
 
 
+# Steps of flag_ms, run as list mode flagdata passes by flagplan.run_plan. The online flags are
+# one pass, then they're saved before tfcrop + extend go in a second pass (extend sees the tfcrop
+# flags inside the same list)
+FLAG_MS_PLAN = [
+    {"name": "shadow", "cmd": {"mode": "shadow", "tolerance": 0.0}},
+    {"name": "clip_zeros", "cmd": {"mode": "clip", "clipzeros": True}},
+    {"name": "quack", "cmd": {"mode": "quack", "quackinterval": 5.0, "quackmode": "beg"}},
+    {"checkpoint": "after_online_flagging"},
+    {
+        "name": "tfcrop",
+        "cmd": {
+            "mode": "tfcrop",
+            "datacolumn": "data",
+            "extendpols": True,
+            "correlation": "",
+            "flagdimension": "freqtime",
+            "growtime": 95.0,
+            "growfreq": 95.0,
+            "timecutoff": 4.0,
+            "timefit": "line",
+            "freqfit": "poly",
+            "maxnpieces": 5,
+            "combinescans": False,
+            "ntime": "scan",
+            "extendflags": False,
+        },
+    },
+    {
+        "name": "extend",
+        "cmd": {
+            "mode": "extend",
+            "extendpols": True,
+            "correlation": "",
+            "growtime": 95.0,
+            "growfreq": 95.0,
+            "growaround": True,
+            "flagneartime": False,
+            "flagnearfreq": False,
+            "combinescans": False,
+            "ntime": "scan",
+        },
+    },
+]
+
+# Steps of flag_postcal, one pass on the corrected data of the secondary and target
+POSTCAL_PLAN = [
+    {
+        "name": "tfcrop",
+        "cmd": {"mode": "tfcrop", "datacolumn": "corrected", "growfreq": 80, "growaround": True, "flagnearfreq": True},
+    },
+    {"name": "extend", "cmd": {"mode": "extend", "growfreq": 80, "growaround": True, "flagnearfreq": True}},
+]
+
+
 def flag_ms(visname):
-    logger.debug("Flagging antennas affected by shadowing...")
+    logger.debug("Flagging antennas affected by shadowing, zero amplitudes, quacking and rfi...")
 
     flagmanager(vis=visname, mode="save", versionname="before_online_flagging")
-    logger.debug("Flagging antennas affected by shadowing...")
-    flagdata(vis=visname, mode="shadow", tolerance=0.0, flagbackup=False)
-    logger.debug("Flagging visibilities with zero amplitudes...")
-    flagdata(vis=visname, mode="clip", clipzeros=True, flagbackup=False)
-    logger.debug("Quacking visibilities ...")
-    flagdata(
-        vis=visname, mode="quack", quackinterval=5.0, quackmode="beg", flagbackup=False
-    )
-    flagmanager(vis=visname, mode="save", versionname="after_online_flagging")
-    flagdata(
-        vis=visname,
-        mode="tfcrop",
-        datacolumn="data",
-        action="apply",
-        display="report",
-        flagbackup=True,
-        extendpols=True,
-        correlation="",
-        flagdimension="freqtime",
-        growtime=95.0,
-        growfreq=95.0,
-        timecutoff=4.0,
-        timefit="line",
-        freqfit="poly",
-        maxnpieces=5,
-        combinescans=False,
-        ntime="scan",
-        extendflags=False,
-    )
-    logger.debug("Extending flags to all correlations")
-    flagdata(
-        vis=visname,
-        mode="extend",
-        action="apply",
-        display="report",
-        flagbackup=False,
-        extendpols=True,
-        correlation="",
-        growtime=95.0,
-        growfreq=95.0,
-        growaround=True,
-        flagneartime=False,
-        flagnearfreq=False,
-        combinescans=False,
-        ntime="scan",
-    )
+    run_plan(visname, FLAG_MS_PLAN, "flag_ms")
     return
 
-def split_ms(visname, msname, field="", spw="", n_spw=1, antenna="", scan = "", datacolumn="corrected",listfile=""):
+def split_ms(visname, msname, field="", spw="", n_spw=1, antenna="", scan = "", datacolumn="corrected",listfile="", regrid=True, chanbin=1, timebin="", separationaxis=None):
+    # chanbin (an int or one per spw) and timebin (e.g. "20s") average the data on the way out,
+    # separationaxis ("scan" or "spw") writes a multi-ms partitioned along it
+    average = {}
+    if separationaxis is not None:
+        average.update(createmms=True, separationaxis=separationaxis, numsubms="auto")
+    if max(chanbin if isinstance(chanbin, list) else [chanbin]) > 1:
+        average.update(chanaverage=True, chanbin=chanbin)
+    if timebin != "":
+        average.update(timeaverage=True, timebin=timebin)
     try: 
         mstransform(
             vis=visname,
             outputvis=msname,
             field=field,
             nspw=n_spw,
-            regridms=True,
+            regridms=regrid,
             antenna=antenna,
             scan=scan,
             datacolumn=datacolumn,
-            spw=spw
+            spw=spw,
+            **average,
         )
     except: 
         logger.warning("Unable to run mstransform! Check logs ")
 
 
+    # Index the new ms once so later scan/field lookups don't need listobs again
+    index = load_index(msname, rebuild=True)
     if listfile == "":
-        logger.debug("Not listing ms details")
+        logger.debug("Not writing out ms details")
     else: 
-        listobs(
-            vis=msname,
-            listfile=f"{listfile}.dat",
-            overwrite=True,
-        )
+        save_index(index, f"{listfile}.json")
     flagmanager(vis=msname, mode="save", versionname="after_transform")
     return
 
-def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint="inf"):
-    setjy(
-        vis=msname,
-        field=pri,
-        scalebychan=True,
-        standard="Perley-Butler 2010",
-        usescratch=True,
+def partition_ms(visname, mmsname, axis="scan"):
+    # Multi-ms of visname with a sub-ms per scan group or spw. flagdata, setjy, applycal and tclean
+    # (parallel=True) then work on the sub-ms in parallel when run under mpicasa
+    partition(
+        vis=visname,
+        outputvis=mmsname,
+        createmms=True,
+        separationaxis=axis,
+        numsubms="auto",
+        datacolumn="data",
+        flagbackup=False,
     )
-    if os.path.exists(f"{calfile}.G0"):
-        logger.debug(f"Found {calfile}.G0, skipping")
+    load_index(mmsname, rebuild=True)
+    return
+
+
+def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint="inf", reuse_bandpass=False, spw="", write_ms=True, virtual_model=False):
+    # With reuse_bandpass the B0/B1 from the calibration library are already in place, so the gains
+    # that only exist to solve them (G0, G1) aren't needed either
+    # setjy and the flag version at the end write to the ms, with write_ms=False only the (read only)
+    # solves run so several spws can be solved at the same time. With virtual_model the primary's model
+    # is kept as a keyword instead of a MODEL_DATA column
+    if write_ms is True:
+        if virtual_model is True:
+            drop_model_column(msname)
+        setjy(
+            vis=msname,
+            field=pri,
+            spw=spw,
+            scalebychan=True,
+            standard="Perley-Butler 2010",
+            usescratch=not virtual_model,
+        )
+        if virtual_model is True:
+            check_models(msname, [pri])
+    if os.path.exists(f"{calfile}.G0") or reuse_bandpass is True:
+        logger.debug(f"Found {calfile}.G0 or reusing the bandpass, skipping")
     else: 
         logger.debug(f"Performing gain calibration on {pri}")
         try: 
             gaincal(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.G0",
                 field=pri,
                 refant=ref,
@@ -177,6 +225,7 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
         try:
             bandpass(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.B0",
                 field=pri,
                 refant=ref,
@@ -189,13 +238,14 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
         except: 
             logger.warning("Issue with cal? Couldn't do bandpass?")
             return
-    if os.path.exists(f"{calfile}.G1"):
-        logger.debug(f"Found {calfile}.G1, skipping")
+    if os.path.exists(f"{calfile}.G1") or reuse_bandpass is True:
+        logger.debug(f"Found {calfile}.G1 or reusing the bandpass, skipping")
     else: 
         try:
             logger.debug(f"Determining gains on {sec}")
             gaincal(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.G1",
                 field=f"{pri},{sec}",
                 refant=ref,
@@ -216,6 +266,7 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
         try:
             bandpass(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.B1",
                 field=pri,
                 refant=ref,
@@ -234,6 +285,7 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
             logger.debug(f"Deriving gain calibration using {pri}")
             gaincal(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.G2",
                 field=pri,
                 refant=ref,
@@ -247,6 +299,7 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
             logger.debug(f"Deriving gain calibration using {sec}")
             gaincal(
                 vis=msname,
+                spw=spw,
                 caltable=f"{calfile}.G2",
                 field=sec,
                 refant=ref,
@@ -277,81 +330,179 @@ def calibrate_ms(msname, sec, calfile, pri = "1934_cal_cx", ref = "CA04", solint
         return 
     
     logger.debug("Completed making all cal files ")
-    flagmanager(vis=msname, mode="save", versionname="before_applycal")
+    if write_ms is True:
+        flagmanager(vis=msname, mode="save", versionname="before_applycal")
     return
 
+CALTABLES = ["G0", "B0", "G1", "B1", "G2", "F0"]
 
-def applycal_ms(calfile, msname, sec, tar, pri = "1934_cal_cx"):
-    applycal(
-        vis=msname,
-        gaintable=[
-            f"{calfile}.B1",
-            f"{calfile}.F0",
-        ],
-        gainfield=[pri, pri, pri],
-        field=f"{pri}",
-        parang=True,
-        flagbackup=False,
-    )
-    applycal(
-        vis=msname,
-        gaintable=[
-            f"{calfile}.B1",
-            f"{calfile}.F0",
-        ],
-        gainfield=[pri, pri, sec],
-        field=f"{sec},{tar}",
-        parang=True,
-        flagbackup=False,
-    )
-    applycal(
+
+def calibrate_job(job):
+    calibrate_ms(**job)
+    return
+
+
+def merge_caltables(parts, outname):
+    # Rows of the per spw tables go into one table, their subtables already cover every spw
+    from casatools import table
+
+    if os.path.exists(outname):
+        shutil.rmtree(outname)
+    shutil.copytree(parts[0], outname)
+    tb = table()
+    for part in parts[1:]:
+        tb.open(part)
+        tb.copyrows(outname)
+        tb.close()
+    return
+
+
+def calibrate_spws(msname, sec, calfile, spws, pri="1934_cal_cx", ref="CA04", solint="inf", reuse_bandpass=False, nproc=1, virtual_model=False):
+    # Every spw is solved on its own into {calfile}_spw{n}.*, nproc at a time, then the per spw
+    # tables are merged into the usual {calfile}.* for the later stages
+    if len(spws) <= 1:
+        calibrate_ms(msname, sec, calfile, pri=pri, ref=ref, solint=solint, reuse_bandpass=reuse_bandpass, virtual_model=virtual_model)
+        return
+    if virtual_model is True:
+        drop_model_column(msname)
+    setjy(
         vis=msname,
-        gaintable=[
-            f"{calfile}.B1",
-            f"{calfile}.F0",
-        ],
-        gainfield=[pri, pri, sec],
-        field=tar,
-        parang=True,
-        flagbackup=False,
+        field=pri,
+        scalebychan=True,
+        standard="Perley-Butler 2010",
+        usescratch=not virtual_model,
     )
-    if args.plots is True: 
-        plotms(vis=msname, plotfile=f"{calfile}_{pri}_amppostcal.png",xaxis='frequency', yaxis='amp', ydatacolumn='corrected', field=pri,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{pri}_phasepostcal.png",xaxis='frequency', yaxis='phase', ydatacolumn='corrected', field=pri,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{tar}_phasepostcal.png",xaxis='frequency', yaxis='phase', ydatacolumn='corrected', field=tar,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{tar}_amppostcal.png",xaxis='frequency', yaxis='amp', ydatacolumn='corrected', field=tar,correlation="XX", showgui=False, overwrite=True)
+    if virtual_model is True:
+        check_models(msname, [pri])
+    jobs = []
+    for spw in spws:
+        spwcal = f"{calfile}_spw{spw}"
+        if reuse_bandpass is True:
+            # The library bandpass covers every spw, each solve gets its own copy
+            for ext in ["B0", "B1"]:
+                if os.path.exists(f"{spwcal}.{ext}"):
+                    shutil.rmtree(f"{spwcal}.{ext}")
+                shutil.copytree(f"{calfile}.{ext}", f"{spwcal}.{ext}")
+        jobs.append(
+            {
+                "msname": msname,
+                "sec": sec,
+                "calfile": spwcal,
+                "pri": pri,
+                "ref": ref,
+                "solint": solint,
+                "reuse_bandpass": reuse_bandpass,
+                "spw": spw,
+                "write_ms": False,
+            }
+        )
+    if nproc <= 1:
+        for job in jobs:
+            calibrate_job(job)
+    else:
+        logger.info(f"Calibrating spws {','.join(spws)} on {min(nproc, len(jobs))} workers")
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=min(nproc, len(jobs)), initializer=log_setup) as pool:
+            pool.map(calibrate_job, jobs, chunksize=1)
+    for ext in CALTABLES:
+        parts = [f"{job['calfile']}.{ext}" for job in jobs]
+        if ext in ["G0", "B0", "G1", "B1"] and reuse_bandpass is True:
+            # Copied from the library or not solved at all when the bandpass is reused
+            continue
+        if all(os.path.exists(part) for part in parts):
+            merge_caltables(parts, f"{calfile}.{ext}")
+        else:
+            logger.warning(f"Not every spw made a .{ext}, not merging them")
+    flagmanager(vis=msname, mode="save", versionname="before_applycal")
     return
 
-def flag_postcal(msname, sec, tar, calfile, pri="1934_cal_cx"):
 
-    flagmanager(vis=msname, mode="save", versionname="before_rflag")
-    flagdata(
-        vis=msname,
-        mode="tfcrop",
-        field=f"{sec},{tar}",
-        datacolumn="corrected",
-        growfreq=80,
-        growaround=True,
-        flagnearfreq=True,
-    )
-    flagdata(
-        vis=msname,
-        mode="extend",
-        field=f"{sec},{tar}",
-        growfreq=80,
-        growaround=True,
-        flagnearfreq=True,
-    )
-    if args.plots is True: 
-        plotms(vis=msname, plotfile=f"{calfile}_{pri}_amppostcalflag.png",xaxis='frequency', yaxis='amp', ydatacolumn='corrected', field=pri,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{pri}_phasepostcalflag.png",xaxis='frequency', yaxis='phase', ydatacolumn='corrected', field=pri,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{tar}_phasepostcalflag.png",xaxis='frequency', yaxis='phase', ydatacolumn='corrected', field=tar,correlation="XX", showgui=False, overwrite=True)
-        plotms(vis=msname, plotfile=f"{calfile}_{tar}_amppostcalflag.png",xaxis='frequency', yaxis='amp', ydatacolumn='corrected', field=tar,correlation="XX", showgui=False, overwrite=True)
+def flag_versions(vis):
+    return [os.path.basename(f)[len("flags."):] for f in glob(f"{vis.rstrip('/')}.flagversions/flags.*")]
+
+
+def checkpoint(vis, version, stale=(), keep=()):
+    # A stage that flags starts from the flags it started from last time: its version is restored if
+    # there is one, otherwise saved. Restoring takes back whatever was flagged after it, by other
+    # targets' stages too, so their versions (names starting with anything in stale) go and their
+    # cache entries stop matching. Versions in keep were saved before this one and stay good
+    if version not in flag_versions(vis):
+        flagmanager(vis=vis, mode="save", versionname=version)
+        return
+    flagmanager(vis=vis, mode="restore", versionname=version)
+    drop_versions(vis, [v for v in flag_versions(vis) if v != version and v not in keep and v.startswith(tuple(stale))])
+    return
+
+
+def drop_versions(vis, versions):
+    for version in versions:
+        logger.info(f"Deleting flag version {version} of {vis}, the flags it was saved over have changed")
+        flagmanager(vis=vis, mode="delete", versionname=version)
+    return
+
+
+def applycal_ms(calfile, msname, sec, tar, pri = "1934_cal_cx", plots=False):
+    checkpoint(msname, f"before_applycal_{tar}", stale=["before_applycal_", "before_rflag_"])
+    # The postcal flags of this target were made on top of the last apply
+    drop_versions(msname, [f"before_rflag_{tar}"] if f"before_rflag_{tar}" in flag_versions(msname) else [])
+    run_apply(msname, apply_plan(calfile, pri, sec, [pri, sec, tar]), callib_name(msname))
+    if plots is True: 
+        # One read of the corrected data for both fields, the pngs are drawn in the background
+        run_diagnostics(msname, [pri, tar], calfile, "postcal")
+    return
+
+def flag_postcal(msname, sec, tar, calfile, pri="1934_cal_cx", plots=False):
+
+    checkpoint(msname, f"before_rflag_{tar}", stale=["before_applycal_", "before_rflag_"], keep=[f"before_applycal_{tar}"])
+    run_plan(msname, POSTCAL_PLAN, f"flag_postcal_{sec}_{tar}", field=f"{sec},{tar}", flagbackup=True)
+    if plots is True: 
+        run_diagnostics(msname, [pri, tar], calfile, "postcalflag")
     return 
 
 
 
-def imgmfs_ms(imagems, imagename, field="0", spw="", uvrange="", niter=3000, nterms=1, mode="mfs", antenna="",weighting="briggs", robust=-0.5, imsize=2250, cell="0.5arcsec", interactive=True, scan="", datacolumn="corrected"):
+def imgmfs_ms(imagems, imagename, field="0", spw="", uvrange="", niter=3000, nterms=1, mode="mfs", antenna="",weighting="briggs", robust=-0.5, imsize=None, cell=None, interactive=True, scan="", datacolumn="corrected", startmodel="", nsigma=4.0, savemodel="modelcolumn", mem_budget=None, parallel=False):
+    # imsize and cell default to the primary beam and the longest baseline of the data, and the run
+    # is refused if tclean would need more than mem_budget GB (default everything we're allowed)
+    if imsize is None or cell is None:
+        geometry = image_geometry(imagems, field=field, spw=spw)
+        logger.info(
+            f"{imagename}: longest baseline {geometry['longest_baseline_m']:.0f}m, beam {geometry['beam_arcsec']:.2f}arcsec, "
+            f"primary beam {geometry['fov_arcmin']:.1f}arcmin"
+        )
+        imsize = geometry["imsize"] if imsize is None else imsize
+        cell = f"{geometry['cell_arcsec']}arcsec" if cell is None else cell
+    check_memory(imagename, imsize if isinstance(imsize, int) else max(imsize), nterms=nterms, budget=mem_budget)
+    if interactive is False:
+        # Batch mode, a single tclean: auto-multithresh masking, cleaning stops at nsigma times the
+        # robust rms of the residual (taken from the first residual and updated every major cycle)
+        # and the model is saved at the end of the same run
+        logger.info(f"Cleaning {imagename} down to {nsigma} sigma with automasking")
+        tclean(
+            vis=imagems,
+            imagename=f"{imagename}",
+            specmode=mode,
+            nterms=nterms,
+            niter=niter,
+            imsize=imsize,
+            cell=cell,
+            weighting=weighting,
+            robust=robust,
+            antenna=antenna,
+            spw=spw,
+            field=field,
+            interactive=False,
+            usemask="auto-multithresh",
+            nsigma=nsigma,
+            parallel=parallel,
+            savemodel=savemodel,
+            pbcor=False,
+            uvrange=uvrange,
+            scan=scan,
+            datacolumn=datacolumn,
+            startmodel=startmodel,
+        )
+        return
     print("Initiating interactive cleaning")
 
     tclean(
@@ -368,11 +519,13 @@ def imgmfs_ms(imagems, imagename, field="0", spw="", uvrange="", niter=3000, nte
         spw=spw,
         field=field,
         interactive=interactive,
-        savemodel="modelcolumn",
+        savemodel=savemodel,
         pbcor=False,
         uvrange=uvrange,
         scan=scan,
         datacolumn=datacolumn,
+        startmodel=startmodel,
+        parallel=parallel,
     )
     tclean(
         vis=imagems,
@@ -388,7 +541,7 @@ def imgmfs_ms(imagems, imagename, field="0", spw="", uvrange="", niter=3000, nte
         robust=robust,
         antenna=antenna,
         interactive=interactive,
-        savemodel="modelcolumn",
+        savemodel=savemodel,
         pbcor=False,
         calcres=False,
         calcpsf=False,
@@ -398,13 +551,36 @@ def imgmfs_ms(imagems, imagename, field="0", spw="", uvrange="", niter=3000, nte
     return
 
 
+def image_job(job):
+    log_setup()
+    try:
+        imgmfs_ms(**job)
+    except (MemoryError, ValueError) as e:
+        logger.warning(f"Couldn't image {job['imagename']}: {e}")
+        sys.exit(1)
+    return
+
 
-def slefcal_ms(calfile, srcms, tar, selfround="0",solint="60s",minblperant=4,combine="",spwmap="",applymode="",calmode="p",gaintable=[""],solnorm=False):
+def image_concurrent(jobs):
+    # Each image in its own process at the same time, spawned so every one gets its own casa
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=image_job, args=(job,)) for job in jobs]
+    for p in procs:
+        p.start()
+    for p, job in zip(procs, jobs):
+        p.join()
+        if p.exitcode != 0:
+            logger.warning(f"Imaging {job['imagename']} failed with exit code {p.exitcode}")
+    return
+
+
+def slefcal_ms(calfile, srcms, tar, selfround="0",solint="60s",minblperant=4,combine="",spwmap="",applymode="",calmode="p",gaintable=[""],solnorm=False,spw=""):
     logger.debug("Running selfcal")
     gaincal(
         vis=srcms,
         caltable=f"{calfile}_self{selfround}.cal",
         field=tar,
+        spw=spw,
         combine=combine,
         gaintype="G",
         calmode=calmode,
@@ -423,6 +599,7 @@ def slefcal_ms(calfile, srcms, tar, selfround="0",solint="60s",minblperant=4,com
         gaintable=gaintable,
         parang=True,
         field=tar,
+        spw=spw,
         spwmap=spwmap,
         applymode=applymode,
         flagbackup=False,
@@ -432,9 +609,265 @@ def slefcal_ms(calfile, srcms, tar, selfround="0",solint="60s",minblperant=4,com
     return gaintable 
 
 
-# TODO: Currnetly only calibrates assuming 1 spw but gives options for it to split to multiple...
+def find_rpfits(project, path="."):
+    files = []
+    for f in os.listdir(path):
+        if f.endswith(f".{project}"):
+            files.append(os.path.join(path, f) if path != "." else f)
+    return files
+
+
+def day_names(day, project, tar, sec, band):
+    # Naming used for every product of a day, returns visname, calfile, imagename
+    visname = f"./data/{day}/{project}_{day}_{band}.ms"
+    calfile = f"./data/{day}/{sec}_cal_{band}"
+    imagename = f"./data/{day}/{tar}_{band}_spw"
+    return visname, calfile, imagename
+
+
+def run_pipeline(cache, files, visname, calfile, imagename, sec, tar, pri, band, ref="CA04", applycal=True, flag6=True, force=False, import_nproc=1, library=None, project="c3487", day="day0", smearing=None, fov=None, selfcal=False, selfcal_threshold=0.05, interactive=False, mem_budget=None, cal_nproc=1, partition_axis=None, virtual_model=False, plots=False):
+    # Stage graph: import -> flag -> (reduce) -> calibrate -> applycal -> postcal flag -> image
+    # With smearing set (the fractional peak loss allowed at the edge of the field, fov arcmin or
+    # half the primary beam) everything after flagging, calibration included, runs on an averaged ms
+    # of pri, sec and tar
+    # Each stage is rebuilt only if its parameters, or anything upstream of it, changed
+    def flag_stage():
+        # Flagging is done in place, so go back to the raw flags before redoing it
+        if os.path.exists(f"{flagms}.flagversions/flags.before_online_flagging"):
+            flagmanager(vis=flagms, mode="restore", versionname="before_online_flagging")
+            drop_versions(flagms, [v for v in flag_versions(flagms) if v.startswith(("before_applycal_", "before_rflag_"))])
+        flag_ms(flagms)
+        if flag6 is True:
+            flagdata(vis=flagms, mode="manual", antenna="5", flagbackup=False)
+
+    def image_stage():
+        # check_memory refusing an image or image_geometry finding nothing to image (e.g. no unflagged
+        # data) shouldn't throw away the calibration, the stage just doesn't get recorded
+        try:
+            make_images()
+        except (MemoryError, ValueError) as e:
+            logger.warning(f"Couldn't image {tar}: {e}")
+
+    def make_images():
+        if band == "l":
+            imgmfs_ms(workms, imagename, field=tar, spw="0,1", interactive=interactive, mem_budget=mem_budget, parallel=parallel, savemodel=savemodel)
+        elif band == "cx" and interactive is True:
+            imgmfs_ms(workms, f"{imagename}0", field=tar, spw="0", mem_budget=mem_budget, parallel=parallel, savemodel=savemodel)
+            imgmfs_ms(workms, f"{imagename}1", field=tar, spw="1", mem_budget=mem_budget, parallel=parallel, savemodel=savemodel)
+        elif band == "cx":
+            # Both spws at once. Nothing downstream reads the model column of this ms and two tcleans
+            # writing it at the same time would fight over the table lock, so no model is saved.
+            # The two share the memory budget
+            budget = (available_memory() / 1024**3 if mem_budget is None else mem_budget) / 2
+            image_concurrent(
+                [
+                    {
+                        "imagems": workms,
+                        "imagename": f"{imagename}{spw}",
+                        "field": tar,
+                        "spw": spw,
+                        "interactive": False,
+                        "savemodel": "none",
+                        "mem_budget": budget,
+                        "parallel": parallel,
+                    }
+                    for spw in ["0", "1"]
+                ]
+            )
+
+    def selfcal_stage():
+        # Self cal works on a copy of the calibrated target so the solutions stack on top of it
+        split_ms(workms, selfms, field=tar, datacolumn="corrected", regrid=False)
+        for spw, name, imaging in selfcal_images:
+            run_selfcal(selfms, tar, name, spw=spw, threshold=selfcal_threshold, imaging=imaging, virtual_model=virtual_model)
+
+    def calibrate_stage():
+        # The bandpass can come from the calibration library, solved ones get added to it
+        record = None
+        if library is not None:
+            key = library.key(workms, project, band, pri)
+            date = min(s["begin"] for s in load_index(workms)["scans"])
+            record = library.fetch(calfile, key, date, day)
+        spws = [str(spw["spw"]) for spw in load_index(workms)["spws"]]
+        calibrate_spws(workms, sec, calfile, spws, pri=pri, ref=ref, reuse_bandpass=record is not None, nproc=cal_nproc, virtual_model=virtual_model)
+        if library is not None and record is None and os.path.exists(f"{calfile}.B1"):
+            library.add(calfile, key, date, day)
+
+    def reduce_stage():
+        split_ms(
+            flagms,
+            msname,
+            field=f"{pri},{sec},{tar}",
+            datacolumn="data",
+            regrid=False,
+            chanbin=averaging["chanbin"],
+            timebin=f"{averaging['timebin']}s" if averaging["timebin"] > averaging["integration"] else "",
+            separationaxis=partition_axis,
+        )
+        if os.path.exists(msname):
+            averaging["size_fraction"] = dir_size(msname) / max(dir_size(flagms), 1)
+            save_averaging(msname, averaging)
+            logger.info(
+                f"{msname} is averaged by {averaging['chanbin']} channels and {averaging['timebin']}s, "
+                f"{100 * averaging['size_fraction']:.1f}% of the size of {flagms}"
+            )
+
+    files = sorted(files)
+    file_stats = [[f, os.path.getsize(f), os.path.getmtime(f)] for f in files]
+    # With a parallel import the per file parts are kept between runs, so only new files get
+    # imported, unless everything is being redone
+    clean = [visname, f"{visname}.flagversions"]
+    if force is True:
+        clean.append(parts_dir(visname))
+    cache.run(
+        "import",
+        lambda: make_ms(files, visname, nproc=import_nproc),
+        {"files": file_stats, "options": "birdie,noac", "edge": 4, "parallel": import_nproc > 1},
+        products=[visname],
+        clean=clean,
+        force=force,
+        # A part reimported behind our back (e.g. by watch.py) changes the manifest
+        state=(lambda: load_manifest(visname)) if import_nproc > 1 else None,
+    )
+    # With partition_axis set ("scan" or "spw") everything from flagging on runs on a multi-ms, which is
+    # turned back into a normal ms of pri, sec and tar at the end
+    flagms = visname
+    parallel = partition_axis is not None
+    if partition_axis is not None:
+        flagms = f"{visname[:-3] if visname.endswith('.ms') else visname}.mms"
+        cache.run(
+            "partition",
+            lambda: partition_ms(visname, flagms, axis=partition_axis),
+            {"axis": partition_axis},
+            upstream=["import"],
+            products=[flagms],
+            clean=[flagms, f"{flagms}.flagversions"],
+            force=force,
+        )
+    cache.run(
+        "flag",
+        flag_stage,
+        {"flag6": flag6, "plan": FLAG_MS_PLAN, "partition": partition_axis},
+        upstream=["partition" if partition_axis is not None else "import"],
+        flagversion=(flagms, "before_online_flagging"),
+        force=force,
+    )
+    workms = flagms
+    # With virtual_model no step writes a MODEL_DATA column, setjy and tclean keep their models as
+    # keywords of the ms instead
+    savemodel = "virtual" if virtual_model is True else "modelcolumn"
+    cal_params = {"sec": sec, "pri": pri, "ref": ref, "solint": "inf", "bandpass": "solve" if library is None else library.mode, "virtual_model": virtual_model}
+    cal_upstream = ["flag"]
+    cal_stage = f"calibrate_{sec}"
+    if smearing is not None:
+        # split renumbers the fields in their original order, so sec can have a different field id
+        # in each target's averaged ms. The calibration is solved per target, into its own tables
+        msname = os.path.join(os.path.dirname(visname), f"{tar}_{band}.{'mms' if parallel else 'ms'}")
+        averaging = choose_averaging(flagms, max_loss=smearing, fov=fov, exclude=[5] if flag6 is True else [])
+        reduce = f"reduce_{tar}"
+        cache.run(
+            reduce,
+            reduce_stage,
+            {"fields": [pri, sec, tar], "chanbin": averaging["chanbin"], "timebin": averaging["timebin"]},
+            upstream=["flag"],
+            products=[msname],
+            clean=[msname, f"{msname}.flagversions"],
+            force=force,
+        )
+        workms = msname
+        cal_params["averaging"] = [averaging["chanbin"], averaging["timebin"]]
+        cal_upstream = [reduce]
+        cal_stage = f"calibrate_{sec}_{tar}"
+        calfile = f"{calfile}_{tar}"
+
+    caltables = [f"{calfile}.{ext}" for ext in CALTABLES]
+    if library is not None and library.mode != "solve":
+        # G0 and G1 aren't made when the bandpass is reused
+        caltables = [f"{calfile}.{ext}" for ext in ["B0", "B1", "G2", "F0"]]
+    # import and flag are shared by every target in the day, calibration by the targets of a secondary
+    # (unless averaged per target) and the rest is per secondary/target
+    apply_stage = f"applycal_{sec}_{tar}"
+    postcal_stage = f"postcal_flag_{sec}_{tar}"
+    cache.run(
+        cal_stage,
+        calibrate_stage,
+        cal_params,
+        upstream=cal_upstream,
+        products=caltables,
+        clean=[f"{calfile}.{ext}" for ext in CALTABLES] + glob(f"{calfile}_spw*") + [provenance_name(calfile)],
+        # The averaged ms has no flag versions of its own, its flags come from flagms
+        flagversion=(flagms, "after_online_flagging"),
+        force=force,
+    )
+    if applycal is True:
+        logger.debug(f"Apply on: Applying solutions now ")
+        cache.run(
+            apply_stage,
+            lambda: applycal_ms(calfile, workms, sec, tar, pri=pri, plots=plots),
+            {"sec": sec, "tar": tar, "pri": pri, "tables": APPLY_TABLES},
+            upstream=[cal_stage],
+            flagversion=(workms, f"before_applycal_{tar}"),
+            force=force,
+        )
+    else:
+        logger.warning(f"NOT APPLYING CAL! ")
+        cache.invalidate(apply_stage)
+    cache.run(
+        postcal_stage,
+        lambda: flag_postcal(workms, sec, tar, calfile, pri=pri, plots=plots),
+        {"sec": sec, "tar": tar, "plan": POSTCAL_PLAN},
+        upstream=[apply_stage],
+        flagversion=(workms, f"before_rflag_{tar}"),
+        force=force,
+    )
+    if band == "l":
+        images = [f"{imagename}.image"]
+    else:
+        images = [f"{imagename}0.image", f"{imagename}1.image"]
+    cache.run(
+        f"image_{tar}",
+        image_stage,
+        {"band": band, "field": tar, "interactive": interactive, "savemodel": savemodel},
+        upstream=[postcal_stage],
+        products=images,
+        clean=glob(f"{imagename}*"),
+        force=force,
+    )
+    if selfcal is True:
+        selfms = os.path.join(os.path.dirname(visname), f"{tar}_{band}_self.ms")
+        if band == "l":
+            selfcal_images = [("", f"{imagename}_self", {"mem_budget": mem_budget})]
+        else:
+            selfcal_images = [("0", f"{imagename}0_self", {"mem_budget": mem_budget}), ("1", f"{imagename}1_self", {"mem_budget": mem_budget})]
+        cache.run(
+            f"selfcal_{tar}",
+            selfcal_stage,
+            {"band": band, "field": tar, "threshold": selfcal_threshold, "virtual_model": virtual_model},
+            upstream=[postcal_stage],
+            products=[log_name(name) for spw, name, imaging in selfcal_images],
+            clean=[selfms, f"{selfms}.flagversions"] + glob(f"{imagename}*_self*"),
+            force=force,
+        )
+    if partition_axis is not None:
+        finalms = os.path.join(os.path.dirname(visname), f"{tar}_{band}_cal.ms")
+        cache.run(
+            f"unpartition_{tar}",
+            lambda: split_ms(workms, finalms, field=f"{pri},{sec},{tar}", datacolumn="all", regrid=False),
+            {"fields": [pri, sec, tar]},
+            upstream=[postcal_stage],
+            products=[finalms],
+            clean=[finalms, f"{finalms}.flagversions"],
+            force=force,
+        )
+    if virtual_model is True:
+        virtual = [workms] + ([selfms] if selfcal is True and os.path.exists(selfms) else [])
+        saved = sum(model_column_bytes(vis) for vis in virtual)
+        logger.info(f"Virtual models saved about {saved / 1024**3:.2f} GB of MODEL_DATA in {', '.join(virtual)}")
+    return
+
 
 if __name__ == "__main__":
+    log_setup()
     parser = ArgumentParser(
         description="Script to go through basic processing of continuum ATCA data"
     )
@@ -470,6 +903,12 @@ if __name__ == "__main__":
         default="c3487",
         help="The project code from ATCA to use for naming and for searching for all data files to make ms. default=C3487"
     )
+    parser.add_argument(
+        "--data_path",
+        type=str,
+        default="./data/{day}",
+        help="Directory with the rpfits files, {day} is replaced by --day, default=./data/{day}"
+    )
     # parser.add_argument(
     #     "--day",
     #     type=str,
@@ -512,6 +951,92 @@ if __name__ == "__main__":
     )
 
 
+    parser.add_argument(
+        "--import_nproc",
+        type=int,
+        default=1,
+        help="Import each RPFITS file to its own ms with this many workers and virtually concat them, default=1 (one serial importatca)"
+    )
+    parser.add_argument(
+        "--smearing",
+        type=float,
+        default=None,
+        help="Split pri, sec and target into an averaged ms before calibrating, averaging as much as keeps bandwidth and time smearing each under this fractional peak loss at the edge of the field (e.g. 0.02), default=no averaging"
+    )
+    parser.add_argument(
+        "--fov",
+        type=float,
+        default=None,
+        help="Radius in arcmin the smearing budget has to hold out to, default=half the primary beam FWHM at the bottom of the band"
+    )
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        default=False,
+        help="Clean the images interactively, otherwise a single automasked tclean to 4 sigma (both cx spws at once)"
+    )
+    parser.add_argument(
+        "--cal_nproc",
+        type=int,
+        default=1,
+        help="Solve the calibration of each spw separately on this many workers, each one more casa in memory, default=1"
+    )
+    parser.add_argument(
+        "--virtual_model",
+        action="store_true",
+        help="Keep the setjy, tclean and self cal models virtual instead of writing a MODEL_DATA column, default=False"
+    )
+    parser.add_argument(
+        "--partition",
+        type=str,
+        default=None,
+        choices=["scan", "spw"],
+        help="Partition the ms into a multi-ms by scan or spw so flagging, calibration and imaging can use it in parallel (run under mpicasa), default=no partitioning"
+    )
+    parser.add_argument(
+        "--mem_budget",
+        type=float,
+        default=None,
+        help="GB an image may use, tclean runs that would need more are refused, default=all the memory of the machine"
+    )
+    parser.add_argument(
+        "--selfcal",
+        action="store_true",
+        default=False,
+        help="Self calibrate the target after imaging, phase rounds with shrinking solints then amplitude rounds until the dynamic range stops improving"
+    )
+    parser.add_argument(
+        "--selfcal_threshold",
+        type=float,
+        default=0.05,
+        help="Fractional improvement in dynamic range a self cal round needs to keep going, default=0.05"
+    )
+    parser.add_argument(
+        "--bandpass",
+        type=str,
+        default="solve",
+        choices=["solve", "reuse", "interpolate"],
+        help="solve the bandpass for every day, reuse the nearest one from the calibration library or interpolate between the nearest either side, default=solve"
+    )
+    parser.add_argument(
+        "--bandpass_maxage",
+        type=float,
+        default=30.0,
+        help="Furthest away in days a library bandpass can be to get reused, default=30"
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="Array configuration for the calibration library (e.g. H168), default=worked out from the antenna positions"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=None,
+        help="Record time, cpu, memory and io of every stage to a json run report. Optionally give the report name, default=./data/{day}/profile_{time}.json"
+    )
     parser.add_argument(
         '-v',
         '--verbose',
@@ -536,43 +1061,45 @@ if __name__ == "__main__":
 
     selfround = "0"
     msname = f"./{args.day}/{tar}_{band}.ms"
-    visname = f"./data/{args.day}/{args.project}_{args.day}_{args.band}.ms"
+    visname, calfile, imagename = day_names(args.day, args.project, tar, sec, band)
     logger.debug(f"{visname}")
-    calfile = f"./data/{args.day}/{sec}_cal_{band}"
-    imagename = f"./data/{args.day}/{tar}_{band}_spw"
-
-    files=[]
-    for f in os.listdir():
-        if f.endswith(f".{args.project}"):
-            files.append(f)
-
-    # Read in the ATCA data and make initial visname 
-    if args.cont is True:
-        logger.warning("Continue is on, checking if files exist before running make_ms")
-        if os.path.exists(f"{visname}"):
-            logger.debug(f"Found vis, not reading in the ATCA data")
-        else: 
-            make_ms(files, visname)    
-    else: 
-        logger.warning(f"Found visname and continue is on so deleting ms")
-        os.system(f"rm -r {visname}")
-        os.system(f"rm -r {visname}.flagversions") 
-        make_ms(files, visname)
 
+    files = find_rpfits(args.project, path=args.data_path.format(day=args.day))
 
-    # # Flagging data 
-    # if args.cont is True: 
-    #     logger.debug(f"Continue on: checking for flag versions before flagging ")
-    #     if os.path.exists(f"{visname}.flagversions"):
-    #         logger.debug(f"Found flag version for visname, not running the flagging")
-    #     else: 
-    #         flag_ms(visname)
-    # else: 
-    #     flag_ms(visname)
+    if args.profile is not None:
+        profile_name = args.profile
+        if profile_name == "":
+            profile_name = f"./data/{args.day}/profile_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+        profile = RunProfile(f"./data/{args.day}", profile_name)
+        # The casa tasks are wrapped too so the steps inside calibrate_ms get their own entries
+        profile.instrument(
+            globals(),
+            [
+                "make_ms",
+                "flag_ms",
+                "calibrate_spws",
+                "calibrate_ms",
+                "applycal_ms",
+                "flag_postcal",
+                "image_concurrent",
+                "imgmfs_ms",
+                "slefcal_ms",
+                "setjy",
+                "gaincal",
+                "bandpass",
+                "fluxscale",
+            ],
+        )
+        logger.info(f"Profiling this run into {profile_name}")
 
-    # flag_ms(visname)
-    # if args.flag6 is True:
-    #     flagdata(vis=visname, mode="manual", antenna="5")
+    cache = StageCache(f"./data/{args.day}/stagecache_{band}.json")
+    library = CalLibrary("./data/callibrary", mode=args.bandpass, maxage=args.bandpass_maxage, config=args.config)
+    if args.cont is True:
+        logger.warning("Continue is on, only rerunning stages whose inputs have changed")
+        force = False
+    else:
+        logger.warning("Continue is off, rerunning every stage")
+        force = True
 
     # # Splitting main MS to have just target ms 
     # if args.cont is True:
@@ -587,52 +1114,33 @@ if __name__ == "__main__":
     #         os.system(f"rm -r {msname}.flagversions")
     #         split_ms(visname, msname, field=f"{pri},{sec},{tar}", spw=args.spw, n_spw=args.nspw, datacolumn="data",listfile=f"listobs_{msname}.dat")
     #         logger.debug(f"remade split version")
-    
-
-
-    # Generating calibration solutions 
-    if args.cont is True: 
-        logger.debug(f"Continue on: Looking for calibration files before trying calibation")
-        if os.path.exists(f"{calfile}.G2"):
-            logger.debug("Found last calfile needed so skipping generating cal solutions")
-        else: 
-            calibrate_ms(visname, sec, calfile, pri=pri,ref = args.ref)
-    else: 
-        os.system(f"rm -r {calfile}*")
-        calibrate_ms(visname, sec, calfile, pri=pri,ref = args.ref)
-
 
-
-    # Applying cal solutions 
-    if args.applycal is True: 
-        logger.debug(f"Apply on: Applying solutions now ")
-        applycal_ms(calfile, visname, sec, tar, pri=pri)
-    else: 
-        logger.warning(f"NOT APPLYING CAL! ")
-
-    flag_postcal(visname, sec, tar, calfile, pri=pri)
-
-    # Running first initial imaging 
-    if args.cont is True: 
-        logger.debug(f"Continue on: looking for images before starting again")
-        if os.path.exists(f"{imagename}0.image"):
-            logger.debug(f"Found image, not reimaging")
-        else:
-            if band == "l":
-                temp_imname = f"{imagename}"
-                imgmfs_ms(visname, temp_imname, field=tar, spw="0,1", cell="1arcsec")
-            elif band == "cx":
-                temp_imname = f"{imagename}0" 
-                imgmfs_ms(visname, temp_imname, field=tar, spw="0")
-                temp_imname = f"{imagename}1" 
-                imgmfs_ms(visname, temp_imname, field=tar, spw="1")
-    else: 
-        os.system(f"rm -r {imagename}*")
-        if band == "l":
-            temp_imname = f"{imagename}"
-            imgmfs_ms(visname, temp_imname, field=tar, spw="0,1", cell="0.5arcsec",imsize=4500)
-        elif band == "cx":
-            temp_imname = f"{imagename}0" 
-            imgmfs_ms(visname, temp_imname, field=tar, spw="0")
-            temp_imname = f"{imagename}1" 
-            imgmfs_ms(visname, temp_imname, field=tar, spw="1")
+    run_pipeline(
+        cache,
+        files,
+        visname,
+        calfile,
+        imagename,
+        sec,
+        tar,
+        pri,
+        band,
+        ref=args.ref,
+        applycal=args.applycal,
+        flag6=args.flag6,
+        force=force,
+        import_nproc=args.import_nproc,
+        library=library,
+        project=args.project,
+        day=args.day,
+        smearing=args.smearing,
+        fov=args.fov,
+        selfcal=args.selfcal,
+        selfcal_threshold=args.selfcal_threshold,
+        interactive=args.interactive,
+        mem_budget=args.mem_budget,
+        cal_nproc=args.cal_nproc,
+        partition_axis=args.partition,
+        virtual_model=args.virtual_model,
+        plots=args.plots,
+    )
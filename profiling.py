@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# Stage level profiling for processing.py runs
+# RunProfile.instrument wraps functions in a namespace (e.g. the globals of processing.py) so each
+# call records wall time, cpu time (including child processes), peak rss, bytes read and written
+# by the process, how much the day directory grew and whether it raised. Calls made inside another
+# wrapped function are recorded with it as their parent, which is how the gaincal/bandpass/fluxscale
+# steps of calibrate_ms show up. The report is a json file, compare reports with
+# python profiling.py compare run1.json run2.json
+
+import os
+import sys
+import json
+import time
+import socket
+import datetime
+import resource
+import threading
+import functools
+import traceback
+import logging
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def cpu_seconds():
+    total = 0.0
+    for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def current_rss():
+    # Resident set size in bytes from /proc, 0 where that isn't available
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def io_bytes():
+    counters = {"read_bytes": 0, "write_bytes": 0}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in counters:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+class RunProfile:
+    def __init__(self, daydir, filename):
+        self.daydir = daydir
+        self.filename = filename
+        self.stack = []
+        self.report = {
+            "started": datetime.datetime.now().isoformat(),
+            "argv": sys.argv,
+            "host": socket.gethostname(),
+            "daydir": daydir,
+            "stages": [],
+        }
+
+    def wrap(self, func, name):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            entry = {"name": name, "parent": self.stack[-1] if len(self.stack) > 0 else None}
+            sampler = RssSampler()
+            sampler.start()
+            io_start = io_bytes()
+            size_start = dir_size(self.daydir)
+            cpu_start = cpu_seconds()
+            wall_start = time.perf_counter()
+            self.stack.append(name)
+            try:
+                result = func(*args, **kwargs)
+                entry["status"] = "ok"
+                entry["error"] = ""
+                return result
+            except BaseException as e:
+                entry["status"] = "failed"
+                entry["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+                raise
+            finally:
+                self.stack.pop()
+                entry["wall"] = time.perf_counter() - wall_start
+                entry["cpu"] = cpu_seconds() - cpu_start
+                entry["peak_rss"] = sampler.stop()
+                io_end = io_bytes()
+                entry["read_bytes"] = io_end["read_bytes"] - io_start["read_bytes"]
+                entry["write_bytes"] = io_end["write_bytes"] - io_start["write_bytes"]
+                entry["daydir_growth"] = dir_size(self.daydir) - size_start
+                self.report["stages"].append(entry)
+                logger.info(
+                    f"{name}: {entry['wall']:.1f}s wall, {entry['cpu']:.1f}s cpu, "
+                    f"{entry['peak_rss'] / 1024**2:.0f} MB peak rss, {entry['status']}"
+                )
+                self.save()
+
+        return wrapper
+
+    def instrument(self, namespace, names):
+        # namespace is a module globals() dict, the functions are replaced in place
+        for name in names:
+            if name in namespace:
+                namespace[name] = self.wrap(namespace[name], name)
+            else:
+                logger.warning(f"Can't profile {name}, it isn't defined")
+
+    def save(self):
+        self.report["finished"] = datetime.datetime.now().isoformat()
+        tmp = f"{self.filename}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.report, f, indent=2)
+        os.replace(tmp, self.filename)
+
+
+def stage_totals(report):
+    # Sums repeated calls of the same stage, keyed by parent/name
+    totals = {}
+    for entry in report["stages"]:
+        key = entry["name"] if entry["parent"] is None else f"{entry['parent']}/{entry['name']}"
+        tot = totals.setdefault(key, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": 0, "failed": 0})
+        tot["calls"] += 1
+        tot["wall"] += entry["wall"]
+        tot["cpu"] += entry["cpu"]
+        tot["peak_rss"] = max(tot["peak_rss"], entry["peak_rss"])
+        tot["failed"] += entry["status"] != "ok"
+    return totals
+
+
+def compare(filenames):
+    reports = []
+    for filename in filenames:
+        with open(filename, "r") as f:
+            reports.append(json.load(f))
+    totals = [stage_totals(r) for r in reports]
+    stages = []
+    for tot in totals:
+        stages.extend(k for k in tot.keys() if k not in stages)
+    header = f"{'stage':<32}" + "".join(f"{os.path.basename(f)[:18]:>20}" for f in filenames)
+    print(header)
+    for stage in stages:
+        line = f"{stage:<32}"
+        base = totals[0].get(stage, {}).get("wall")
+        for tot in totals:
+            if stage not in tot:
+                line += f"{'-':>20}"
+                continue
+            wall = tot[stage]["wall"]
+            change = f" ({wall / base:.2f}x)" if base not in [None, 0.0] and tot is not totals[0] else ""
+            flag = "!" if tot[stage]["failed"] > 0 else ""
+            line += f"{f'{wall:.1f}s{change}{flag}':>20}"
+        print(line)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(description="Compare the json run reports written by processing.py --profile")
+    parser.add_argument("command", choices=["compare"], help="What to do with the reports")
+    parser.add_argument("reports", nargs="+", help="Run reports, the first one is the baseline")
+    args = parser.parse_args()
+    compare(args.reports)
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# Self calibration driver around slefcal_ms and imgmfs_ms
+# The calibrated target is split into its own ms (so its DATA column already has the primary and
+# secondary solutions in it), imaged once, then put through phase rounds with shrinking solints and
+# after those amplitude and phase rounds. After every round the target is imaged again, starting
+# from the previous round's model, and the dynamic range (peak of the image over the robust rms of
+# the residual) is compared with the best so far. A round that improves it by less than threshold
+# ends that kind of round (phase rounds move on to amplitude rounds, amplitude rounds stop), and a
+# round that makes it worse is undone. The rounds are written to {imagename}_selfcal.json.
+# e.g. python selfcal.py ./data/day4/src_cx.ms src --imagename ./data/day4/src_cx_self --spw 0
+
+import json
+import logging
+from glob import glob
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PHASE_SOLINTS = ["300s", "120s", "60s", "30s"]
+AMP_SOLINTS = ["inf", "600s"]
+
+
+def image_stats(imagename):
+    from casatools import image
+
+    ia = image()
+    ia.open(f"{imagename}.residual")
+    residual = ia.statistics(robust=True)
+    ia.close()
+    ia.open(f"{imagename}.image")
+    peak = float(ia.statistics()["max"][0])
+    ia.close()
+    # Robust rms of the residual so the source itself and any leftover sidelobes don't dominate it
+    rms = float(residual["medabsdevmed"][0]) * 1.4826
+    return {"rms": rms, "peak": peak, "dynamic_range": peak / rms if rms > 0 else 0.0}
+
+
+def round_schedule(phase_solints, amp_solints):
+    return [("p", solint) for solint in phase_solints] + [("ap", solint) for solint in amp_solints]
+
+
+def log_name(imagename):
+    return f"{imagename}_selfcal.json"
+
+
+def run_selfcal(vis, tar, imagename, spw="", threshold=0.05, phase_solints=PHASE_SOLINTS, amp_solints=AMP_SOLINTS, minblperant=4, imaging=None, virtual_model=False):
+    # vis has the target with the calibration applied in its DATA column, imaging is passed on to
+    # imgmfs_ms (non interactive). With virtual_model the models the solves use are never written to
+    # a MODEL_DATA column. Returns the log of every round, "best" is the round kept
+    import processing
+    from stagecache import remove_products
+    from virtualmodel import drop_model_column, check_models
+    from casatasks import applycal, clearcal, ft
+
+    imaging = dict(imaging or {})
+    imaging["interactive"] = False
+    imaging["savemodel"] = "virtual" if virtual_model is True else "modelcolumn"
+    calfile = f"{imagename}_cal"
+    if virtual_model is True:
+        drop_model_column(vis)
+
+    def image_round(r, startmodel=""):
+        name = f"{imagename}_sc{r}"
+        remove_products(glob(f"{name}.*"))
+        processing.imgmfs_ms(vis, name, field=tar, spw=spw, datacolumn="corrected", startmodel=startmodel, **imaging)
+        return name, image_stats(name)
+
+    name, stats = image_round(0)
+    rounds = [dict(stats, round=0, calmode="", solint="", gaintable=[], image=name)]
+    best = rounds[0]
+    logger.info(f"selfcal {tar} round 0: peak {stats['peak']:.4g} rms {stats['rms']:.3g} dr {stats['dynamic_range']:.1f}")
+    skip = None
+    for r, (calmode, solint) in enumerate(round_schedule(phase_solints, amp_solints), start=1):
+        if calmode == skip:
+            continue
+        if virtual_model is True:
+            check_models(vis, [tar])
+        gaintable = slefcal_round(processing, calfile, vis, tar, r, solint, calmode, best["gaintable"], spw, minblperant)
+        name, stats = image_round(r, startmodel=f"{best['image']}.model")
+        entry = dict(stats, round=r, calmode=calmode, solint=solint, gaintable=gaintable, image=name)
+        rounds.append(entry)
+        gain = stats["dynamic_range"] / best["dynamic_range"] - 1 if best["dynamic_range"] > 0 else 1.0
+        logger.info(
+            f"selfcal {tar} round {r} ({calmode}, {solint}): peak {stats['peak']:.4g} rms {stats['rms']:.3g} "
+            f"dr {stats['dynamic_range']:.1f} ({100 * gain:+.1f}%)"
+        )
+        if gain > 0:
+            best = entry
+        else:
+            # Worse than before, go back to the best solutions so far and put the best model back in
+            # the model column for the next solve
+            ft(vis=vis, field=tar, spw=spw, model=f"{best['image']}.model", usescratch=not virtual_model)
+            if len(best["gaintable"]) > 0:
+                applycal(vis=vis, gaintable=best["gaintable"], field=tar, spw=spw, parang=True, flagbackup=False)
+            else:
+                clearcal(vis=vis, field=tar, spw=spw)
+        if gain < threshold:
+            if calmode == "ap":
+                break
+            logger.info(f"Phase selfcal of {tar} has converged, moving on to amplitude and phase")
+            skip = "p"
+
+    log = {"vis": vis, "field": tar, "spw": spw, "threshold": threshold, "rounds": rounds, "best": best["round"]}
+    with open(log_name(imagename), "w") as f:
+        json.dump(log, f, indent=2)
+    logger.info(f"Kept selfcal round {best['round']} of {len(rounds) - 1} for {tar}, image {best['image']}")
+    return log
+
+
+def slefcal_round(processing, calfile, vis, tar, r, solint, calmode, gaintable, spw, minblperant):
+    # Solves against the model of the best image so far with its solutions applied on the fly
+    previous = list(gaintable) if len(gaintable) > 0 else [""]
+    return processing.slefcal_ms(
+        calfile,
+        vis,
+        tar,
+        selfround=str(r),
+        solint=solint,
+        minblperant=minblperant,
+        calmode=calmode,
+        gaintable=previous,
+        solnorm=calmode == "ap",
+        spw=spw,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(description="Self calibrate a calibrated target ms until the image stops improving")
+    parser.add_argument("vis", type=str, help="ms with the calibrated target in its DATA column")
+    parser.add_argument("field", type=str, help="Target field name")
+    parser.add_argument("--imagename", type=str, required=True, help="Prefix of the images and self cal tables")
+    parser.add_argument("--spw", type=str, default="", help="spw to self calibrate and image, default=all")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.05,
+        help="Fractional improvement in dynamic range a round needs to keep going, default=0.05"
+    )
+    parser.add_argument("--phase_solints", type=str, default=",".join(PHASE_SOLINTS), help="Phase round solints, default=%(default)s")
+    parser.add_argument("--amp_solints", type=str, default=",".join(AMP_SOLINTS), help="Amplitude and phase round solints, default=%(default)s")
+    parser.add_argument("--niter", type=int, default=3000, help="Clean iterations per image, default=3000")
+    parser.add_argument("--virtual_model", action="store_true", help="Keep the models virtual instead of in a MODEL_DATA column")
+    args = parser.parse_args()
+
+    run_selfcal(
+        args.vis,
+        args.field,
+        args.imagename,
+        spw=args.spw,
+        threshold=args.threshold,
+        phase_solints=[s for s in args.phase_solints.split(",") if s != ""],
+        amp_solints=[s for s in args.amp_solints.split(",") if s != ""],
+        imaging={"niter": args.niter},
+        virtual_model=args.virtual_model,
+    )
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# Content-hashed stage cache for processing.py
+# Each stage (import -> flag -> calibrate -> applycal -> postcal flag -> image) is stored with a
+# fingerprint of its task parameters and the builds of the stages upstream of it, and with a hash of
+# the contents of the flag version it ran against. Every time a stage is (re)built it gets a new
+# build id, so everything downstream of a rebuilt stage no longer matches and is rebuilt too. A
+# rerun only rebuilds stages whose fingerprint or flag version has changed or whose products have
+# gone missing. A stage can also give a state function, its value is recorded after the stage has
+# run and the stage is rebuilt once it returns anything else (e.g. the parts behind an imported ms).
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(params, upstream=(), flagversion=None):
+    blob = json.dumps(
+        {"params": params, "upstream": list(upstream), "flagversion": flagversion},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def flag_version_hash(flagversion):
+    # flagversion is (vis, name), hashes the contents of {vis}.flagversions/flags.{name}. None when
+    # there is no such version (yet)
+    if not flagversion:
+        return None
+    vis, name = flagversion
+    path = os.path.join(f"{vis.rstrip('/')}.flagversions", f"flags.{name}")
+    if not os.path.exists(path):
+        return None
+    files = [path]
+    if os.path.isdir(path):
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, n) for n in sorted(names))
+    digest = hashlib.sha1()
+    for filename in files:
+        digest.update(os.path.relpath(filename, path).encode())
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def json_value(value):
+    # What value looks like once it has been through the json cache file
+    return json.loads(json.dumps(value, sort_keys=True, default=str))
+
+
+def remove_products(products):
+    for product in products:
+        if os.path.islink(product):
+            os.remove(product)
+        elif os.path.isdir(product):
+            shutil.rmtree(product)
+        elif os.path.exists(product):
+            os.remove(product)
+
+
+class StageCache:
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.stages = json.load(f)
+            except ValueError:
+                logger.warning(f"Stage cache {path} is unreadable, rebuilding every stage")
+                self.stages = {}
+
+    def save(self):
+        # Write to a temp file first so a crash never leaves a half written cache behind
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.stages, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def fingerprint(self, stage):
+        try:
+            return self.stages[stage]["fingerprint"]
+        except KeyError:
+            return None
+
+    def build(self, stage):
+        try:
+            return self.stages[stage]["build"]
+        except KeyError:
+            return None
+
+    def is_valid(self, stage, fp, products=(), flagversion=None, state=None):
+        entry = self.stages.get(stage)
+        if entry is None or entry["fingerprint"] != fp:
+            return False
+        if entry.get("flags") != flag_version_hash(flagversion):
+            logger.info(f"Flag version {flagversion[1]} of {flagversion[0]} changed since stage {stage} ran")
+            return False
+        if state is not None and entry.get("state") != json_value(state()):
+            logger.info(f"The state stage {stage} was built from has changed since it ran")
+            return False
+        missing = [p for p in products if not os.path.exists(p)]
+        if len(missing) > 0:
+            logger.debug(f"Stage {stage} is missing products {missing}")
+            return False
+        return True
+
+    def record(self, stage, fp, products=(), flagversion=None, state=None):
+        self.stages[stage] = {
+            "fingerprint": fp,
+            "products": list(products),
+            "build": uuid.uuid4().hex,
+            "flags": flag_version_hash(flagversion),
+            "state": None if state is None else json_value(state()),
+        }
+        self.save()
+
+    def invalidate(self, stage=None):
+        if stage is None:
+            self.stages = {}
+        else:
+            self.stages.pop(stage, None)
+        self.save()
+
+    def run(self, stage, func, params, upstream=(), products=(), flagversion=None, force=False, clean=None, state=None):
+        # upstream is a list of stage names, clean is a list of paths to remove before rebuilding
+        # (defaults to the products) so tasks that skip existing tables don't pick up stale ones.
+        # flagversion is (vis, version name), its contents are hashed once the stage has run
+        upstream_builds = [self.build(s) for s in upstream]
+        fp = fingerprint(params, upstream_builds, flagversion[1] if flagversion else None)
+        if force is False and self.is_valid(stage, fp, products, flagversion, state):
+            logger.info(f"Stage {stage} is up to date, skipping")
+            return fp
+
+        logger.info(f"Running stage {stage}")
+        # Drop the old entry first, if func fails part way the stage must not look complete
+        self.stages.pop(stage, None)
+        self.save()
+        remove_products(products if clean is None else clean)
+        func()
+        # Most of the casa wrappers swallow their own errors, so only trust the stage if it made
+        # everything it was meant to
+        missing = [p for p in products if not os.path.exists(p)]
+        if len(missing) > 0:
+            logger.warning(f"Stage {stage} didn't make {missing}, not caching it")
+            return fp
+        self.record(stage, fp, products, flagversion, state)
+        return fp
@@ -0,0 +1,38 @@
+# The tests run the pipeline modules against the mock casa of the benchmarks
+import os
+import sys
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.join(REPO, "benchmarks", "mockcasa"))
+
+import mockconfig
+
+
+@pytest.fixture(autouse=True)
+def mockcasa(tmp_path, monkeypatch):
+    # A small mock ms and a clean call log, every test runs in its own directory
+    monkeypatch.setattr(mockconfig, "NSOURCES", 4)
+    monkeypatch.setattr(mockconfig, "NSCANS", 20)
+    monkeypatch.setattr(mockconfig, "NCHAN", 16)
+    monkeypatch.setattr(mockconfig, "MS_MB", 0.0)
+    monkeypatch.setattr(mockconfig, "LATENCY", 0.0)
+    monkeypatch.chdir(tmp_path)
+    del mockconfig.CALLS[:]
+    del mockconfig.PARTITIONS[:]
+    yield mockconfig
+
+
+def calls(name):
+    return [kwargs for task, kwargs in mockconfig.CALLS if task == name]
+
+
+def write_rpfits(path, name, mtime=None):
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, name)
+    with open(filename, "w") as f:
+        f.write(name)
+    if mtime is not None:
+        os.utime(filename, (mtime, mtime))
+    return filename
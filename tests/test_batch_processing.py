@@ -0,0 +1,69 @@
+import os
+
+import pytest
+import batch_processing
+from batch_processing import read_manifest, group_jobs, run_batch, run_job
+
+MANIFEST = """day,target,sec,band,path
+# a comment and a blank line are skipped
+
+day1,src0000,secondary,cx,
+day1,src0001,secondary,cx,/data/rpfits
+day2, src0000 ,secondary,l,
+"""
+
+
+def write_manifest(text=MANIFEST):
+    with open("manifest.csv", "w") as f:
+        f.write(text)
+    return "manifest.csv"
+
+
+def exit_on_day2(i, group, options, results):
+    # A worker that dies without a result for the day2 group, like one killed by the OS
+    if group[0]["day"] == "day2":
+        os._exit(3)
+    results.put((i, [{"job": job, "status": "ok", "error": "", "duration": 0.0, "pid": os.getpid()} for job in group]))
+
+
+def test_read_manifest():
+    jobs = read_manifest(write_manifest(), project="c3487", pri="1934_cal", ref="CA04")
+    assert [(j["day"], j["target"], j["band"]) for j in jobs] == [
+        ("day1", "src0000", "cx"),
+        ("day1", "src0001", "cx"),
+        ("day2", "src0000", "l"),
+    ]
+    assert [j["path"] for j in jobs] == ["./data/day1", "/data/rpfits", "./data/day2"]
+    assert all(j["project"] == "c3487" and j["pri"] == "1934_cal" and j["ref"] == "CA04" for j in jobs)
+    jobs = read_manifest(write_manifest(), path="/rpfits/{day}")
+    assert jobs[0]["path"] == "/rpfits/day1"
+
+    with pytest.raises(ValueError):
+        read_manifest(write_manifest("day,target,sec,band\nday1,,secondary,cx\n"))
+
+
+def test_group_jobs():
+    jobs = read_manifest(write_manifest("day,target,sec,band\n" + "\n".join(
+        ["day1,a,s,cx", "day2,b,s,cx", "day1,c,s,l", "day1,d,s,cx"]
+    )))
+    groups = group_jobs(jobs)
+    assert [[j["target"] for j in group] for group in groups] == [["a", "d"], ["b"], ["c"]]
+
+
+def test_run_job_without_files():
+    os.makedirs("data/day1")
+    job = read_manifest(write_manifest())[0]
+    with pytest.raises(FileNotFoundError):
+        run_job(job)
+
+
+def test_run_batch_dead_worker(monkeypatch):
+    monkeypatch.setattr(batch_processing, "group_worker", exit_on_day2)
+    jobs = read_manifest(write_manifest())
+    summary = run_batch(jobs, nproc=2)
+    assert [(r["job"]["day"], r["job"]["target"], r["status"]) for r in summary] == [
+        ("day1", "src0000", "ok"),
+        ("day1", "src0001", "ok"),
+        ("day2", "src0000", "failed"),
+    ]
+    assert summary[2]["error"] == "Worker exited with code 3"
@@ -0,0 +1,20 @@
+from lightcurve_store import LightcurveStore
+
+
+def day_fluxes(store, fluxes):
+    store.append([{"source": "src0001", "band": "c", "day": day, "timestamp": "", "flux": flux} for day, flux in fluxes])
+
+
+def test_latest_day_flux():
+    store = LightcurveStore("lightcurves.db")
+    assert store.latest_day_flux("src0001", "c", "day3") is None
+    day_fluxes(store, [("day2", 2.0), ("day9", 9.0), ("day40", 40.0)])
+    # The nearest earlier day, not the latest one
+    assert store.latest_day_flux("src0001", "c", "day3") == 2.0
+    assert store.latest_day_flux("src0001", "c", "day10") == 9.0
+    assert store.latest_day_flux("src0001", "c", "day41") == 40.0
+    # Nothing before, any day will do
+    assert store.latest_day_flux("src0001", "c", "day1") == 40.0
+    assert store.latest_day_flux("src0001", "c") == 40.0
+    assert store.latest_day_flux("src0001", "x", "day3") is None
+    store.close()
@@ -0,0 +1,78 @@
+import os
+import shutil
+from conftest import calls, write_rpfits
+
+from msindex import load_index
+from stagecache import StageCache
+from parallel_import import make_ms_parallel, import_parts, load_manifest, parts_dir
+
+VISNAME = "day1.ms"
+
+
+def import_stage(cache, files):
+    # The import stage of processing.run_pipeline with a parallel import
+    file_stats = [[f, os.path.getsize(f), os.path.getmtime(f)] for f in files]
+    cache.run(
+        "import",
+        lambda: make_ms_parallel(files, VISNAME, nproc=1),
+        {"files": file_stats, "options": "birdie,noac", "edge": 4, "parallel": True},
+        products=[VISNAME],
+        clean=[VISNAME, f"{VISNAME}.flagversions"],
+        state=lambda: load_manifest(VISNAME),
+    )
+
+
+def submss(vis):
+    return sorted(os.listdir(os.path.join(vis, "SUBMSS")))
+
+
+def test_import_twice():
+    cache = StageCache("cache.json")
+    files = [write_rpfits("data", f"2024-01-01_000{i}.C3000", mtime=1e9 + i) for i in range(2)]
+    import_stage(cache, files)
+    assert len(calls("importatca")) == 2
+    assert len(calls("virtualconcat")) == 1
+    assert submss(VISNAME) == ["2024-01-01_0000.C3000.ms", "2024-01-01_0001.C3000.ms"]
+    for sub in submss(VISNAME):
+        link = os.path.join(VISNAME, "SUBMSS", sub)
+        assert os.path.realpath(link) == os.path.abspath(os.path.join(parts_dir(VISNAME), sub))
+    index = load_index(VISNAME)
+    assert "SUBMSS/2024-01-01_0001.C3000.ms/FIELD/table.dat" in index["signature"]
+    assert len(calls("listobs")) == 1
+
+    # Nothing changed, nothing is imported, joined or indexed again
+    import_stage(cache, files)
+    assert len(calls("importatca")) == 2
+    assert len(calls("virtualconcat")) == 1
+    assert load_index(VISNAME) == index
+    assert len(calls("listobs")) == 1
+
+    # A new file only imports that file, but the whole multi-ms is joined and indexed again
+    files.append(write_rpfits("data", "2024-01-01_0002.C3000", mtime=1e9 + 2))
+    import_stage(cache, files)
+    assert len(calls("importatca")) == 3
+    assert calls("importatca")[-1]["files"] == [files[-1]]
+    assert len(calls("virtualconcat")) == 2
+    assert len(submss(VISNAME)) == 3
+    assert len(load_index(VISNAME)["signature"]) > len(index["signature"])
+    assert len(calls("listobs")) == 2
+
+
+def test_reimported_part():
+    cache = StageCache("cache.json")
+    files = [write_rpfits("data", f"2024-01-01_000{i}.C3000", mtime=1e9 + i) for i in range(2)]
+    import_stage(cache, files)
+    index = load_index(VISNAME)
+
+    # A part reimported outside the stage (e.g. by watch.py) changes the manifest and the part itself
+    shutil.rmtree(os.path.join(parts_dir(VISNAME), "2024-01-01_0000.C3000.ms"))
+    import_parts(files, VISNAME, nproc=1)
+    assert len(calls("importatca")) == 3
+    assert load_index(VISNAME)["signature"] != index["signature"]
+    assert len(calls("listobs")) == 2
+
+    # The files are the same, so only the join is redone
+    import_stage(cache, files)
+    assert len(calls("importatca")) == 3
+    assert len(calls("virtualconcat")) == 2
+    assert submss(VISNAME) == ["2024-01-01_0000.C3000.ms", "2024-01-01_0001.C3000.ms"]
@@ -0,0 +1,84 @@
+import os
+import time
+from conftest import calls, write_rpfits
+
+import mockconfig
+from lightcurve_store import LightcurveStore
+from parallel_import import load_manifest
+from watch import settled_files, scan_jobs, poll, state_name
+
+VISNAME = "data/day2/c3487_day2_cx.ms"
+PRI = "1934_cal_cx"
+SEC = "secondary"
+
+
+def fake_fit(job):
+    # Every scan comes out at its starting flux, or 1 Jy without one
+    flux = job["sourcepar"][0] if job["sourcepar"][0] is not None else 1.0
+    return dict(job, flux=flux, niter_used=1)
+
+
+def make_calfile(day="day1"):
+    for ext in ["B1", "F0"]:
+        mockconfig.make_table(f"data/{day}/{SEC}_cal_cx.{ext}")
+
+
+def test_settled_files():
+    old = time.time() - 60
+    write_rpfits("rpfits", "2024-01-01_0000.C3487", mtime=old)
+    write_rpfits("rpfits", "2024-01-01_0001.C3487", mtime=old)
+    write_rpfits("rpfits", "2024-01-01_0002.C3487")
+    write_rpfits("rpfits", "2024-01-01_0000.C9999", mtime=old)
+    files = settled_files("C3487", "rpfits", 30)
+    assert [os.path.basename(f) for f in files] == ["2024-01-01_0000.C3487", "2024-01-01_0001.C3487"]
+    assert len(settled_files("C3487", "rpfits", 0)) == 3
+
+
+def test_scan_jobs():
+    mockconfig.make_table("part.ms")
+    store = LightcurveStore("lightcurves.db")
+    store.append([{"source": "src0001", "band": "c", "day": "day1", "timestamp": "", "flux": 2.5}])
+    store.append([{"source": "src0001", "band": "c", "day": "day2", "timestamp": "60000.0", "scan": 1, "flux": 2.4}])
+    jobs = scan_jobs(store, "part.ms", "day2", {"fields": ["src0001", "src0002"], "bands": [("c", "0"), ("x", "1")]})
+    store.close()
+
+    # src0001 is in scans 1, 5, 9, ... of the mock schedule and scan 1 of band c is already in the store
+    c1 = [j for j in jobs if j["field"] == "src0001" and j["band"] == "c"]
+    assert [j["scan"] for j in c1] == ["5", "9", "13", "17"]
+    assert all(j["sourcepar"] == [2.5, 0, 0] and j["spw"] == "0" for j in c1)
+    x1 = [j for j in jobs if j["field"] == "src0001" and j["band"] == "x"]
+    assert [j["scan"] for j in x1] == ["1", "5", "9", "13", "17"]
+    assert all(j["sourcepar"] == [None, 0, 0] for j in x1)
+    assert len([j for j in jobs if j["field"] == "src0002"]) == 8
+    assert all(os.path.dirname(j["outfile"]) == "cl" for j in jobs)
+
+
+def test_poll():
+    store = LightcurveStore("lightcurves.db")
+    files = [write_rpfits("rpfits", f"2024-01-01_000{i}.C3487", mtime=1e9 + i) for i in range(2)]
+
+    # Nothing is fit until there is a calibration to apply
+    targets = ["src0000", "src0001"]
+    assert poll(store, VISNAME, files, "day2", "cx", PRI, SEC, targets, fitter="test_watch:fake_fit") == 0
+    assert len(calls("importatca")) == 2
+    assert len(calls("applycal")) == 0
+
+    make_calfile()
+    # 4 + 5 scans of the targets in 2 bands. Every mock part has the whole schedule, so the second
+    # part's scans are already in the store
+    nfluxes = poll(store, VISNAME, files, "day2", "cx", PRI, SEC, targets, fitter="test_watch:fake_fit")
+    assert nfluxes == (4 + 5) * 2
+    assert len(calls("importatca")) == 2
+    assert len(calls("applycal")) == 2
+    assert len(store.history("src0001", band="x")) == 5
+    for entry in load_manifest(VISNAME).values():
+        assert mockconfig.flag_state(entry["part"]) == "0"
+
+    # The same files again are already fit, a new one is imported and fit on its own
+    assert poll(store, VISNAME, files, "day2", "cx", PRI, SEC, targets, fitter="test_watch:fake_fit") == 0
+    files.append(write_rpfits("rpfits", "2024-01-01_0002.C3487", mtime=1e9 + 2))
+    poll(store, VISNAME, files, "day2", "cx", PRI, SEC, targets, fitter="test_watch:fake_fit")
+    assert len(calls("importatca")) == 3
+    assert len(calls("applycal")) == 3
+    assert os.path.exists(state_name(VISNAME))
+    store.close()
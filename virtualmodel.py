@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# Virtual model data instead of a MODEL_DATA column
+# setjy(usescratch=True), tclean(savemodel="modelcolumn") and ft(usescratch=True) each fill a
+# MODEL_DATA column as big as DATA. With virtual models casa keeps the model (a component list or
+# the clean components) as a keyword of the ms, definedmodel_field_{id}, and gaincal/bandpass predict
+# from it on the fly. A MODEL_DATA column takes precedence over a virtual model, so any left over
+# column is dropped first, and check_models makes sure the fields a solve needs have a virtual model
+# and nothing shadows it. uvmodelfit fits its own point source model and doesn't read either.
+
+import logging
+import numpy as np
+
+from msindex import load_index
+
+logger = logging.getLogger(__name__)
+
+# ATCA always has the four linear correlations
+DEFAULT_NCORR = 4
+
+
+def has_model_column(vis):
+    from casatools import table
+
+    tb = table()
+    tb.open(vis)
+    found = "MODEL_DATA" in tb.colnames()
+    tb.close()
+    return found
+
+
+def drop_model_column(vis):
+    from casatasks import delmod
+
+    if has_model_column(vis):
+        delmod(vis=vis, otf=False, scr=True)
+        logger.info(f"Dropped the MODEL_DATA column of {vis}, models are virtual from here on")
+    return
+
+
+def virtual_model_fields(vis):
+    # Field ids with a virtual model, casa keeps them on the SOURCE table when there is one
+    from casatools import table
+
+    tb = table()
+    ids = set()
+    for name in [vis, f"{vis.rstrip('/')}/SOURCE"]:
+        try:
+            tb.open(name)
+        except RuntimeError:
+            continue
+        ids.update(int(k.rsplit("_", 1)[1]) for k in tb.keywordnames() if k.startswith("definedmodel_field_"))
+        tb.close()
+    return ids
+
+
+def check_models(vis, fields):
+    # Before a solve against the model: every field needs a virtual model and no MODEL_DATA may hide it
+    if has_model_column(vis):
+        raise RuntimeError(f"{vis} has a MODEL_DATA column, it would be used instead of the virtual model")
+    index = load_index(vis)
+    missing = [f for f in fields if f in index["fields"] and index["fields"][f]["field_id"] not in virtual_model_fields(vis)]
+    if len(missing) > 0:
+        raise RuntimeError(f"No virtual model for {', '.join(missing)} in {vis}")
+    return
+
+
+def model_column_bytes(vis):
+    # Size a MODEL_DATA column would have, complex64 for every row, channel and correlation
+    from casatools import table
+
+    index = load_index(vis)
+    ncorr = DEFAULT_NCORR
+    tb = table()
+    try:
+        tb.open(f"{vis.rstrip('/')}/POLARIZATION")
+        ncorr = int(np.max(tb.getcol("NUM_CORR")))
+        tb.close()
+    except (RuntimeError, KeyError):
+        pass
+    nchan = np.mean([spw["nchan"] for spw in index["spws"]]) if len(index["spws"]) > 0 else 0
+    return int(8 * ncorr * nchan * index["nrows"])
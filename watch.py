@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+# Watch mode, near real time lightcurves while an observation is still going
+# Polls a directory for RPFITS files and imports only the new ones, each to its own part ms (the same
+# parts and manifest as processing.py --import_nproc, so the full run afterwards doesn't import them
+# again). Every new part gets the online flags and the newest {calfile}.B1/.F0 that exist, then only
+# its scans are fit against the day flux already in the store and appended to the lightcurves.
+# The parts are shared with the full run, so each part gets its import time flags back once its
+# scans are fit.
+# A file is only picked up once it hasn't changed for --settle seconds, so a file still being
+# written by the correlator isn't imported half way.
+# e.g. python watch.py --day day5 --sec 1921-293 --band cx --path /data/rpfits
+
+import os
+import json
+import time
+import logging
+from glob import glob
+from argparse import ArgumentParser
+
+from processing import FLAG_MS_PLAN, day_names
+from flagplan import run_plan
+from msindex import load_index
+from fluxfit import iter_fits, TOLERANCE, MAX_NITER
+from lightcurve_store import LightcurveStore
+from parallel_import import parts_dir, stale_files, import_parts, join_parts, load_manifest, restore_import_flags
+from applyplan import apply_plan, callib_name, run_apply
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Lightcurve band and spw of each processing band
+LIGHTCURVE_BANDS = {"cx": [("c", "0"), ("x", "1")], "l": [("l", "")]}
+
+# Only the online flagging of flag_ms, tfcrop/extend need more than one scan to be any use
+ONLINE_PLAN = FLAG_MS_PLAN[: FLAG_MS_PLAN.index({"checkpoint": "after_online_flagging"})]
+
+
+def settled_files(project, path, settle):
+    now = time.time()
+    files = []
+    for f in sorted(glob(os.path.join(path, f"*.{project}"))):
+        if now - os.path.getmtime(f) >= settle:
+            files.append(f)
+    return files
+
+
+def latest_calfile(sec, band, datadir="./data"):
+    # Newest {sec}_cal_{band} of any day with both the bandpass and the flux scaled gains
+    candidates = []
+    for f0 in glob(os.path.join(datadir, "*", f"{sec}_cal_{band}.F0")):
+        calfile = f0[: -len(".F0")]
+        if os.path.exists(f"{calfile}.B1"):
+            candidates.append((os.path.getmtime(f0), calfile))
+    if len(candidates) == 0:
+        return None
+    return max(candidates)[1]
+
+
+def state_name(visname):
+    return os.path.join(parts_dir(visname), "watch.json")
+
+
+def load_state(visname):
+    filename = state_name(visname)
+    if not os.path.exists(filename):
+        return {"fitted": []}
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def save_state(visname, state):
+    filename = state_name(visname)
+    with open(f"{filename}.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def calibrate_part(part, calfile, pri, sec, fields):
+    run_plan(part, ONLINE_PLAN, "watch_online")
+    run_apply(part, apply_plan(calfile, pri, sec, fields), callib_name(part))
+    return
+
+
+def scan_jobs(store, part, day, sources):
+    # uvmodelfit jobs for every scan of the sources in this part that isn't in the store yet
+    index = load_index(part)
+    cldir = os.path.join(os.path.dirname(part), "cl")
+    os.makedirs(cldir, exist_ok=True)
+    jobs = []
+    for band, spw in sources["bands"]:
+        for field in sources["fields"]:
+            done = store.scan_timestamps(field, band, day)
+            fitflux = store.day_flux(field, band, day)
+            if fitflux is None:
+                fitflux = store.latest_day_flux(field, band, day)
+            for info in index["scans"]:
+                if info["field"] != field or str(info["begin"]) in done:
+                    continue
+                scan = info["scan"]
+                jobs.append(
+                    {
+                        "vis": part,
+                        "niter": MAX_NITER,
+                        "tol": TOLERANCE,
+                        "field": field,
+                        "spw": spw,
+                        "scan": f"{scan}",
+                        "sourcepar": [fitflux, 0, 0],
+                        "outfile": os.path.join(cldir, f"{os.path.basename(part)}_{field}_{band}_{scan}.cl"),
+                        "timestamp": info["begin"],
+                        "band": band,
+                    }
+                )
+    return jobs
+
+
+def poll(store, visname, files, day, band, pri, sec, targets, nproc=1, fitter="fluxfit:fit_uv", datadir="./data"):
+    # One pass: import what's new, then calibrate and fit every part that hasn't been fit yet.
+    # Returns the number of scan fluxes appended
+    new = stale_files(files, visname)
+    if len(new) > 0:
+        logger.info(f"Found {len(new)} new RPFITS files: {', '.join(os.path.basename(f) for f in new)}")
+        import_parts(new, visname, nproc=nproc)
+        manifest = load_manifest(visname)
+        join_parts([manifest[name]["part"] for name in sorted(manifest)], visname)
+
+    state = load_state(visname)
+    manifest = load_manifest(visname)
+    todo = [manifest[name]["part"] for name in sorted(manifest) if manifest[name]["part"] not in state["fitted"]]
+    if len(todo) == 0:
+        return 0
+    calfile = latest_calfile(sec, band, datadir=datadir)
+    if calfile is None:
+        logger.warning(f"No {sec}_cal_{band}.B1/.F0 yet, leaving {len(todo)} parts until there is")
+        return 0
+    logger.info(f"Calibrating {len(todo)} new parts with {calfile}")
+
+    nfluxes = 0
+    for part in todo:
+        fields = load_index(part)["fields"]
+        present = [t for t in targets if t in fields] if targets else [f for f in fields if f not in [pri, sec]]
+        if len(present) > 0:
+            try:
+                calibrate_part(part, calfile, pri, sec, present)
+                jobs = scan_jobs(store, part, day, {"fields": present, "bands": LIGHTCURVE_BANDS[band]})
+                records = []
+                for fit in iter_fits(jobs, nproc=nproc, fitter=fitter):
+                    records.append(
+                        {
+                            "source": fit["field"],
+                            "band": fit["band"],
+                            "day": day,
+                            "timestamp": fit["timestamp"],
+                            "scan": int(fit["scan"]),
+                            "flux": fit["flux"],
+                            "niter": fit.get("niter_used"),
+                        }
+                    )
+                nfluxes += store.append(records)
+            finally:
+                # Leave the part's flags the way the import made them for processing.py
+                restore_import_flags(part)
+        state["fitted"].append(part)
+        save_state(visname, state)
+    logger.info(f"Appended {nfluxes} scan fluxes")
+    return nfluxes
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(module)s:%(levelname)s:%(lineno)d %(message)s")
+    parser = ArgumentParser(
+        description="Watch a directory for new RPFITS files and add their scans to the lightcurves as they arrive"
+    )
+    parser.add_argument("--day", type=str, default="day0", help="Day the new data belongs to, default=day0")
+    parser.add_argument("--project", type=str, default="c3487", help="ATCA project code of the RPFITS files, default=c3487")
+    parser.add_argument("--path", type=str, default=".", help="Directory the RPFITS files are written to, default=.")
+    parser.add_argument("--sec", type=str, help="Field name of the secondary calibrator, no default")
+    parser.add_argument(
+        "--pri",
+        type=str,
+        default="1934_cal",
+        help="Field name of the primary calibrator, the band is appended like processing.py, default=1934_cal"
+    )
+    parser.add_argument("--band", type=str, default="cx", help="cx or l, default=cx")
+    parser.add_argument(
+        "--targets",
+        type=str,
+        default="",
+        help="Comma separated fields to fit, default=every field that isn't a calibrator"
+    )
+    parser.add_argument("--db", type=str, default="./data/lightcurves.db", help="Lightcurve store, default=./data/lightcurves.db")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between polls, default=60")
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=30.0,
+        help="Seconds a file has to be unchanged before it's imported, default=30"
+    )
+    parser.add_argument("--nproc", type=int, default=1, help="Workers for the imports and fits, default=1")
+    parser.add_argument(
+        "--fitter",
+        type=str,
+        default="fluxfit:fit_uv",
+        help="module:function doing a single scan fit, default=fluxfit:fit_uv"
+    )
+    parser.add_argument("--once", action="store_true", default=False, help="Poll once and exit")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Enable extra logging")
+    args = parser.parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    pri = f"{args.pri}_{args.band}"
+    targets = [t for t in args.targets.split(",") if t != ""]
+    visname, calfile, imagename = day_names(args.day, args.project, "watch", args.sec, args.band)
+    os.makedirs(os.path.dirname(visname), exist_ok=True)
+    store = LightcurveStore(args.db)
+    logger.info(f"Watching {args.path} for *.{args.project} into {visname}")
+    try:
+        while True:
+            files = settled_files(args.project, args.path, args.settle)
+            poll(store, visname, files, args.day, args.band, pri, args.sec, targets, nproc=args.nproc, fitter=args.fitter)
+            if args.once is True:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        store.close()